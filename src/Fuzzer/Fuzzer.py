@@ -1,3 +1,4 @@
+import argparse
 import datetime
 import json
 import logging
@@ -9,8 +10,8 @@ import signal
 import socket
 import subprocess
 import sys
+import threading
 import time
-import zipfile
 from distutils.util import strtobool
 import colorama as clr
 import paramiko
@@ -19,6 +20,13 @@ import paramiko
 from byte_flipper import ByteFlipper
 from radamsa import Radamsa
 from metadata import MetaMutation
+from ufs_field import UfsFieldMutation
+from checksum_fixup import ChecksumFixup
+from seed_corpus import SeedCorpus, get_corpus_key
+from pipeline import Pipeline, TestCase
+from delta import FullImage
+from exec_log import ExecLog, EXEC_OK, EXEC_FAILED, EXEC_CRASHED, MOUNT_CRASHED
+from metrics import PRODUCER_STAGES, StageMetrics, format_stages
 
 
 THIS_FILE = os.path.dirname(os.path.abspath(__file__))
@@ -29,6 +37,7 @@ from Manager.Manager_NetBSD import NetBSD
 from Manager.Manager_OpenBSD import OpenBSD
 from Manager.Manager_Ubuntu import Ubuntu
 from Manager.Manager import VmManager, get_basename, get_parent_path, create_directory
+from Manager.HealthMonitor import VM_DOWN
 
 from config import fuzzing_config
 
@@ -38,7 +47,39 @@ from UserEmulation.UE_NetBSD import NetbsdUserEmulation
 from UserEmulation.UE_OpenBSD import OpenbsdUserEmulation
 from UserEmulation.UE_Ubuntu import UbuntuUserEmulation
 
-from utility import extract_core_features
+from utility import extract_core_features, crash_buckets, crash_store, crash_packer, blob_store
+from worker_pool import WorkerPool, boot_pool_vms, ensure_clones
+
+
+GUEST_SCRIPTS = ["get_users_and_groups.py", "file_traversal.py", "apply_delta.py"]
+GUEST_SEED_CACHE = "/tmp/seed_cache"  # seeds cached on the fuzzing VM, named by their image id
+GUEST_SEED_CACHE_SIZE = 4
+# fuzzing_config.fuzzer entries, see get_fuzzer_config
+FUZZER_REQUIRED = [
+    "name",
+    "fs_creator_vm",
+    "fuzzing_vm",
+    "mutation_engine",
+    "target_fs",
+    "target_size",
+    "populate_with_files",
+    "max_file_size",
+]
+FUZZER_DEFAULTS = {
+    "enable_dyn_scaling": False,
+    "seed_corpus_size": 32,
+    "mutations_per_seed": 100,
+    "pipeline_depth": 2,
+    "snapshot_fuzzing": False,
+    "worker_vms": [],
+    "worker_clones": 0,
+    "crash_codec": "zstd",
+    "compression_workers": 2,
+    "dedup_vmcores": True,
+    "metrics_port": 0,
+    "metrics_log": True,
+    "fix_checksums": ["radamsa", "byte_flip_seq", "byte_flip_rnd", "metadata", "ufs_field"],
+}
 
 
 def get_random_list_entry(file_list):
@@ -53,7 +94,10 @@ class Fuzzer:
         self.new_crash_dir = None  # local directory where crash is saved
         self.vm_object = None  # Manager object instance
         self.lpath_mfs = None  # full path to the current mutated fs
-        self.syscall_log = None  # full path to the log for the executed syscalls
+        self.lpath_seed = None  # full path to the seed fs the current mutation is based on
+        self.mutation_delta = None  # delta.Delta patch list turning the seed into the mutated fs
+        self.mfs_materialized = False  # whether lpath_mfs has been written for the current mutation
+        self.syscall_log = None  # full path to the exec_log.ExecLog of the executed syscalls
         self.mutation_engine = None
         self.mutation_size = None
         self.mfs_type = "ufs"  # file system type that is currently used
@@ -81,6 +125,38 @@ class Fuzzer:
         self.dyn_scaling = True  # if enabled increases the fs size after 15k iterations of not finding a unique crash
         self.target_os = None
         self.host_os = None
+        self.seed_corpus = None  # SeedCorpus of pre generated file systems
+        self.seed_corpus_size = 32  # max amount of seed images kept in the corpus
+        self.mutations_per_seed = 100  # mutations spent on each seed before it is retired
+        self.seed_refill_threshold = 2  # generate new seeds once fewer usable seeds are left
+        self.pipeline = None  # Pipeline producing and staging the next test cases
+        self.pipeline_depth = 2  # test cases kept in flight per pipeline stage, 0 runs all stages serially
+        self.test_case = None  # TestCase that is currently executed
+        self.tc_counter = 0  # running number for produced test cases
+        self.stale_guest_files = []  # staged but discarded test cases that still need to be removed on the guest
+        self.guest_python = {}  # vm name -> whether apply_delta.py can run there, the sh applier is used otherwise
+        self.full_copy_vms = set()  # vms already warned about falling back to full image copies
+        self.snapshot_fuzzing = False  # revert to a running-state snapshot after every iteration instead of rebooting
+        self.fuzz_snapshot = None  # name of the running-state snapshot taken right before mount
+        self.parent = None  # controlling Fuzzer when running as a WorkerPool worker
+        self.worker_storage = None  # private directory for materialized images of a worker
+        self.stats_lock = threading.Lock()  # guards iter/last_unique updates coming from workers
+        self.crash_store = None  # crash_store.CrashStore in crash_dumps/
+        self.crash_packer = None  # crash_packer.CrashPacker compressing crash artifacts in the background
+        self.crash_codec = "zstd"  # zstd, lz4 or zip
+        self.compression_workers = 2  # processes packing crash artifacts
+        self.dedup_vmcores = True  # drop the vmcore of a crash whose trace hash is already known
+        self.known_trace = False  # whether the trace of the last crash was already in the crash store
+        self.staged_artifacts = []  # crash files staged for the crash packer
+        self.crash_check_attempts = 3  # socket timeouts tolerated while collecting a crash before restoring the snapshot
+        self.metrics = None  # metrics.StageMetrics, per stage latency histograms shared with the workers
+        self.metrics_port = 0  # serve the histograms in Prometheus text format on this port, 0 disables it
+        self.metrics_log = True  # append the histograms to stats/<name>_metrics.jsonl every minute
+        # engines whose mutations get their ext4/UFS2 checksums recomputed
+        self.fix_checksums = ["radamsa", "byte_flip_seq", "byte_flip_rnd", "metadata", "ufs_field"]
+        self.fixup_control_share = 0.1  # share of fixable test cases left as is, to measure the mount rate gain
+        self.fixup_mounts = {"fixed": [0, 0], "control": [0, 0]}  # [successful mounts, mounts] per fixup group
+        self.fixed_checksums = 0  # checksums rewritten by the fixup
         signal.signal(signal.SIGINT, self.signal_handler)
 
     def __setup__(self, **kwargs):
@@ -101,15 +177,46 @@ class Fuzzer:
             self.mutation_size = int(kwargs["mutation_engine"][1])
         if "vm_object" in kwargs:
             self.vm_object = kwargs["vm_object"]
+        if "seed_corpus_size" in kwargs:
+            self.seed_corpus_size = int(kwargs["seed_corpus_size"])
+        if "mutations_per_seed" in kwargs:
+            self.mutations_per_seed = int(kwargs["mutations_per_seed"])
+        if "pipeline_depth" in kwargs:
+            self.pipeline_depth = int(kwargs["pipeline_depth"])
+        if "snapshot_fuzzing" in kwargs:
+            try:
+                self.snapshot_fuzzing = bool(strtobool(str(kwargs["snapshot_fuzzing"])))
+            except ValueError:
+                self.snapshot_fuzzing = False
+        if "crash_codec" in kwargs:
+            self.crash_codec = kwargs["crash_codec"]
+        if "compression_workers" in kwargs:
+            self.compression_workers = int(kwargs["compression_workers"])
+        if "dedup_vmcores" in kwargs:
+            try:
+                self.dedup_vmcores = bool(strtobool(str(kwargs["dedup_vmcores"])))
+            except ValueError:
+                self.dedup_vmcores = True
+        if "metrics_port" in kwargs:
+            self.metrics_port = int(kwargs["metrics_port"])
+        if "metrics_log" in kwargs:
+            try:
+                self.metrics_log = bool(strtobool(str(kwargs["metrics_log"])))
+            except ValueError:
+                self.metrics_log = True
+        if "fix_checksums" in kwargs:
+            self.fix_checksums = list(kwargs["fix_checksums"])
         if "dyn_scaling" in kwargs:
             try:
-                self.dyn_scaling = bool(strtobool(kwargs["dyn_scaling"]))
+                self.dyn_scaling = bool(strtobool(str(kwargs["dyn_scaling"])))
             except ValueError:
                 self.dyn_scaling = False
 
     def signal_handler(self, sig, frame):
         print("Observed Ctrl+C! Exiting...")
         self._save_stats()
+        if self.crash_packer:
+            self.crash_packer.shutdown()
         sys.exit(1)
 
     def get_guest_os_kernel(self):
@@ -132,35 +239,50 @@ class Fuzzer:
     def mutation_radamsa(
         self, file_system, preserve_magic=True, preserve_uberblock=False, determinism=True,
     ):
-        self.radamsa_seed, self.lpath_mfs = Radamsa(file_system).mutation(preserve_magic, preserve_uberblock, determinism)
+        engine = Radamsa(file_system)
+        radamsa_seed, lpath_mfs = engine.mutation(preserve_magic, preserve_uberblock, determinism)
+        return lpath_mfs, engine.delta, radamsa_seed
+
+    @staticmethod
+    def mutation_byte_flip_seq(fs_path, n_bytes=1):
+        engine = ByteFlipper(fs_path, n_bytes, mode="seq")
+        return engine.mutation_seq(), engine.delta, None
 
-    def mutation_byte_flip_seq(self, fs_path, n_bytes=1):
-        self.lpath_mfs = ByteFlipper(fs_path, n_bytes, mode="seq").mutation_seq()
+    @staticmethod
+    def mutation_byte_flip_rnd(fs_path, n_bytes=1):
+        engine = ByteFlipper(fs_path, n_bytes, mode="rnd")
+        return engine.mutation_rnd(), engine.delta, None
 
-    def mutation_byte_flip_rnd(self, fs_path, n_bytes=1):
-        self.lpath_mfs = ByteFlipper(fs_path, n_bytes, mode="rnd").mutation_rnd()
+    @staticmethod
+    def mutation_metadata(fs_path, n_bytes=3):
+        engine = MetaMutation(fs_path, n_bytes, mode="sb_meta")
+        return engine.mutation(), engine.delta, None
+
+    @staticmethod
+    def mutation_ufs_field(fs_path, n_fields=2):
+        engine = UfsFieldMutation(fs_path, n_fields, mode="ufsfield")
+        mfs = engine.mutation()
+        logging.debug("Mutated UFS fields: {}".format(", ".join(engine.mutated_fields)))
+        return mfs, engine.delta, None
 
-    def mutation_metadata(self, fs_path, n_bytes=3):
-        self.lpath_mfs = MetaMutation(fs_path, n_bytes, mode="sb_meta").mutation()
+    def materialize_mutated_fs(self):
+        # Mutation engines only produce a delta, the sparse image is written when it is actually needed
+        if self.mutation_delta is not None and not self.mfs_materialized:
+            self.mutation_delta.materialize(self.lpath_seed, self.lpath_mfs)
+            self.mfs_materialized = True
+        return self.lpath_mfs
 
     def mutation_metablock(self, fs_path):
         pass
 
-    def _get_two_distinct_list_elements(self, list_one, list_two):
-        _file1 = get_random_list_entry(list_one)
-        _file2 = get_random_list_entry(list_two)
-        try:
+    @staticmethod
+    def _get_two_distinct_list_elements(list_one, list_two, max_tries=100):
+        for _ in range(max_tries):
+            _file1 = get_random_list_entry(list_one)
+            _file2 = get_random_list_entry(list_two)
             if _file1 != _file2:
                 return _file1, _file2
-            else:
-                self._get_two_distinct_list_elements(list_one, list_two)
-        except RecursionError:
-            return None, None
-
-    @staticmethod
-    def _flush_write(open_file_handle):
-        open_file_handle.flush()
-        os.fsync(open_file_handle.fileno())
+        return None, None
 
     def user_interaction_emulation(self, syscall_log):
         print(clr.Fore.LIGHTYELLOW_EX + "\t[*] Accessing & modifying mounted filesystem: {}".format(self.rmount) + clr.Fore.RESET)
@@ -171,37 +293,50 @@ class Fuzzer:
         except IndexError:
             return 1
         self.max_exec += len(total_cmds)
-        for cmd in total_cmds:
-            if any(x in cmd for x in ["cp", "mv"]):
-                cmd = self.dynamic_resolving_of_cp_and_mv_command(cmd, syscall_log)
-            ret_cmd = self.vm_object.exec_cmd_quiet(cmd)
-            logging.debug("RET VAL FOR {} IS: {}".format(cmd, ret_cmd))
-            if ret_cmd == 2 and not self.vm_object.check_vm_state():
-                self.print_successful_executed_commands(exec_cmds, total_cmds)
-                return self._flush_write_crash_syscall_log(cmd, syscall_log, exec_cmds)
-            if (
-                any(x in cmd for x in ["dd", "find", "readlink", "getfacl", "ls", "stat", "tar", "du", "wc"])
-                and type(ret_cmd) == str
-            ):
-                if "tar" in cmd and "Error" in ret_cmd:
-                    syscall_log.write("[-] {}\n".format(cmd))
-                elif "getfacl" in cmd and "stat() failed" in ret_cmd:
-                    syscall_log.write("[-] {}\n".format(cmd))
-                elif "No such" in ret_cmd:
-                    syscall_log.write("[-] {}\n".format(cmd))
-                else:
-                    exec_cmds = self._write_success_log(cmd, syscall_log, exec_cmds)
-            elif (
-                not any(x in cmd for x in ["dd", "find", "readlink", "getfacl", "ls", "stat", "tar", "du", "wc"]) and not ret_cmd
-            ):
-                exec_cmds = self._write_success_log(cmd, syscall_log, exec_cmds)
-            else:
-                syscall_log.write("[-] {}\n>>{}\n".format(cmd, ret_cmd))
-                self._flush_write(syscall_log)
+        for batch in self._split_user_emulation_into_batches(total_cmds):
+            if any(x in batch[0] for x in ["cp", "mv"]):
+                batch[0] = self.dynamic_resolving_of_cp_and_mv_command(batch[0], syscall_log)
+            while batch:
+                # commit point, the batch may take the guest down
+                syscall_log.commit()
+                results = self.vm_object.exec_batch(batch)
+                latencies = self.vm_object.batch_latencies
+                for idx, (cmd, (ret_cmd, exit_code)) in enumerate(zip(batch, results)):
+                    logging.debug("RET VAL FOR {} IS: {}".format(cmd, ret_cmd))
+                    if ret_cmd == 2 and not self.vm_object.check_vm_state():
+                        self.print_successful_executed_commands(exec_cmds, total_cmds)
+                        return self._flush_write_crash_syscall_log(cmd, syscall_log, exec_cmds)
+                    latency = latencies[idx] if idx < len(latencies) else 0
+                    self.get_metrics().observe(self.vm_name, "cmd_" + get_command_name(cmd), latency)
+                    exec_cmds = self._log_user_emulation_result(cmd, ret_cmd, exit_code, latency, syscall_log, exec_cmds)
+                    if ret_cmd == 2:
+                        break  # the session was dropped, resubmit whatever did not run yet
+                batch = batch[idx + 1 :]
         self.print_successful_executed_commands(exec_cmds, total_cmds)
         self.actual_exec += exec_cmds
         return 1
 
+    @staticmethod
+    def _split_user_emulation_into_batches(total_cmds):
+        # cp/mv operands are resolved against the current fs contents, so each of them starts a new batch
+        batches = []
+        for cmd in total_cmds:
+            if not batches or any(x in cmd for x in ["cp", "mv"]):
+                batches.append([])
+            batches[-1].append(cmd)
+        return batches
+
+    @staticmethod
+    def _log_user_emulation_result(cmd, ret_cmd, exit_code, latency, syscall_log, exec_cmds):
+        status = EXEC_FAILED
+        if any(x in cmd for x in ["dd", "find", "readlink", "getfacl", "ls", "stat", "tar", "du", "wc"]) and type(ret_cmd) == str:
+            if not ("tar" in cmd and "Error" in ret_cmd or "getfacl" in cmd and "stat() failed" in ret_cmd or "No such" in ret_cmd):
+                status = EXEC_OK
+        elif not any(x in cmd for x in ["dd", "find", "readlink", "getfacl", "ls", "stat", "tar", "du", "wc"]) and not ret_cmd:
+            status = EXEC_OK
+        syscall_log.append(cmd, status, exit_code, latency, ret_cmd)
+        return exec_cmds + 1 if status == EXEC_OK else exec_cmds
+
     def _set_user_emulation(self):
         # return UserEmulation(vm_object=self.vm_object, rpath=self.rmount).set_user_emulation()
         if self.host_os == "freebsd":
@@ -237,28 +372,62 @@ class Fuzzer:
             )
             cmd = cmd.format(_file, _dir)
         except (AttributeError, TypeError):
-            syscall_log.write("[-] {}\n".format(cmd))
+            syscall_log.append(cmd, EXEC_FAILED)
         return cmd
 
-    def _write_success_log(self, cmd, log_handler, ctr_exec_cmd):
-        log_handler.write("[+] {}\n".format(cmd))
-        self._flush_write(log_handler)
-        ctr_exec_cmd += 1
-        return ctr_exec_cmd
-
-    def _flush_write_crash_syscall_log(self, cmd, fd, success):
-        fd.write("[!] {}\n".format(cmd))
-        self._flush_write(fd)
+    def _flush_write_crash_syscall_log(self, cmd, syscall_log, success):
+        syscall_log.append(cmd, EXEC_CRASHED)
+        syscall_log.commit()
         self.actual_exec += success
         self.check_if_crash_sample()
         return None
 
-    def _compress_vmcore(self):
-        vmcore = [os.path.join(self.new_crash_dir, f) for f in os.listdir(self.new_crash_dir) if f.startswith("vmcore")][0]
-        zip_path = os.path.join(self.new_crash_dir, get_basename(vmcore))
-        with zipfile.ZipFile(zip_path + ".zip", "w", compression=zipfile.ZIP_DEFLATED) as myzip:
-            myzip.write(vmcore, arcname=get_basename(vmcore))
-        os.remove(vmcore)
+    def _pack_crash_artifacts(self):
+        # Hashing and compression run in the background, the fuzz loop goes on right after the core was fetched
+        artifacts = self.staged_artifacts
+        for vmcore in [f for f in os.listdir(self.new_crash_dir) if f.startswith("vmcore")]:
+            if self.dedup_vmcores and self.known_trace:
+                logging.info("Dropping vmcore of already known trace: {}".format(vmcore))
+                os.remove(os.path.join(self.new_crash_dir, vmcore))
+            else:
+                artifacts.append((vmcore, vmcore, "vmcore", None))
+        self.get_crash_packer().pack(self.new_crash_dir, artifacts)
+        self.staged_artifacts = []
+
+    def get_crash_packer(self):
+        if not self.crash_packer:
+            self.crash_packer = crash_packer.CrashPacker(
+                os.path.join(os.getcwd(), "crash_dumps", blob_store.BLOB_STORE_NAME),
+                codec=self.crash_codec,
+                workers=self.compression_workers,
+            )
+        return self.crash_packer
+
+    def get_metrics(self):
+        if not self.metrics:
+            self.metrics = StageMetrics()
+        return self.metrics
+
+    def start_metrics_export(self):
+        self.get_metrics()  # created before any pipeline or worker thread needs it
+        if self.metrics_port:
+            self.get_metrics().serve(self.metrics_port)
+        if self.metrics_log:
+            statsp = create_directory(os.path.join(os.getcwd(), "stats"))
+            self.get_metrics().log_to(os.path.join(statsp, "{}_metrics.jsonl".format(self.name)))
+
+    def format_top_stages(self, n=3):
+        # stages this VM spends most of its time in
+        summaries = [(stage, x) for (_, stage), x in self.get_metrics().summaries(self.vm_name).items() if stage != "iteration"]
+        return format_stages(summaries[:n])
+
+    def format_producer_stages(self):
+        # seed generation and mutation are recorded under "host" and the generator VM, not under self.vm_name
+        summaries = self.get_metrics().summaries(stages=PRODUCER_STAGES).items()
+        return format_stages([("{}@{}".format(stage, vm), x) for (vm, stage), x in summaries])
+
+    def _timed(self, stage, vm=None):
+        return self.get_metrics().time(vm or self.vm_name, stage)
 
     def save_fs_dict_to_disk(self):
         try:
@@ -269,6 +438,9 @@ class Fuzzer:
             self.fs_log = json.loads(self.fs_log)
             self.fs_log["crash_meta_data"] = {}
             self.fs_log["crash_meta_data"]["seed"] = self.radamsa_seed
+            if self.mutation_delta is not None:
+                self.fs_log["crash_meta_data"]["seed_image_id"] = self.mutation_delta.seed_id
+                self.fs_log["crash_meta_data"]["mutated_bytes"] = self.mutation_delta.mutated_bytes()
             self.fs_log["crash_meta_data"]["panic"] = self.last_panic
             with open(_path, "w") as f:
                 f.write(json.dumps(self.fs_log, indent=4))
@@ -277,28 +449,49 @@ class Fuzzer:
 
     def check_if_crash_sample(self):
         self.last_crash_iter = self.iter
+        # nothing may be staged on the VM while it is reset, everything in flight is stale afterwards
+        self._pause_pipeline()
         try:
+            for attempt in range(1, self.crash_check_attempts + 1):
+                try:
+                    self._collect_crash_sample()
+                    return
+                except socket.timeout as e:
+                    logging.error("SOCKET TIMEOUT ({}/{}): {}".format(attempt, self.crash_check_attempts, e))
+                    self.vm_object.reset_vm()
+                    if not self.vm_object.silent_vm_state():
+                        break
+            self.vm_object.restore_snapshot(self.vm_object.get_current_snapshot())
+            self.vm_object.quick_boot(vm_name=self.vm_object.name)
+        finally:
+            self._drain_pipeline()
+
+    def _collect_crash_sample(self):
+        with self._timed("crash_fetch"):
             self.new_crash_dir = self.vm_object.crash_handler()
-            if self.new_crash_dir:
-                self._backup_samples()
-                self._check_if_crash_is_yet_unknown()
-                self.save_fs_dict_to_disk()
-                self.vm_object.exec_cmd_quiet("/bin/rm -rf /var/crash/*")
-                self._compress_vmcore()
-            self._save_stats()
-        except socket.timeout as e:
-            logging.error("SOCKET TIMEOUT: {}".format(e))
-            self.vm_object.reset_vm()
-            if self.vm_object.silent_vm_state():
-                self.check_if_crash_sample()
-            else:
-                self.vm_object.restore_snapshot(self.vm_object.get_current_snapshot())
-                self.vm_object.quick_boot(vm_name=self.vm_object.name)
+        if self.new_crash_dir:
+            self._backup_samples()
+            self._check_if_crash_is_yet_unknown()
+            self.save_fs_dict_to_disk()
+            self.vm_object.exec_cmd_quiet("/bin/rm -rf /var/crash/*")
+            self._pack_crash_artifacts()
+        self._save_stats()
+
+    def _pause_pipeline(self):
+        if self.pipeline:
+            self.pipeline.pause()
+
+    def _drain_pipeline(self):
+        if self.pipeline:
+            self.pipeline.drain()
+            self.pipeline.resume()
 
     def _save_stats(self):
         statsp = os.path.join(os.getcwd(), "stats")
         create_directory(statsp)
-        with open(os.path.join(statsp, str(self.start)[:-4] + "_" + get_basename(self.lpath_mfs)) + ".txt", "w",) as s:
+        # workers of a pool share the start date and the fs name, their own name keeps the stats apart
+        prefix = str(self.start)[:-4] + "_" + (self.name + "_" if self.parent else "")
+        with open(os.path.join(statsp, prefix + get_basename(self.lpath_mfs)) + ".txt", "w",) as s:
             s.write("> Start date: {}\n".format(str(self.start)))
             s.write("> End date: {}\n".format(str(datetime.datetime.now())))
             s.write("> Engine: {}\n".format(str(get_basename(self.lpath_mfs)).split("_"))[-5].strip())
@@ -318,6 +511,13 @@ class Fuzzer:
                 )
             )
             s.write("> #Unsuccessful_Mounts {}\n".format(str(int(self.iter) - int(self.success_mounts))))
+            s.write("> Checksum fixup: {} ({} checksums rewritten)\n".format(self.format_fixup_stats(), self.fixed_checksums))
+            for (_, stage), summary in self.get_metrics().summaries(self.vm_name).items():
+                s.write(
+                    "> Stage {}: {}x, avg {}s, p90 <= {}s, total {}s\n".format(
+                        stage, summary["count"], summary["avg"], summary["p90"], summary["sum"]
+                    )
+                )
             s.write(
                 "> {}/{} ({}%) Commands executed\n".format(
                     str(self.actual_exec), str(self.max_exec), str(self._get_percentage(self.actual_exec, self.max_exec)),
@@ -327,35 +527,48 @@ class Fuzzer:
     def automate(self, rpath_mfs, mount_at):
         self.rmount = mount_at
         self._print_statistics_output_to_tty()
-        self.syscall_log = os.path.join(os.getcwd(), "file_system_storage/{}_syscall.log".format(self.name))
-        with open(self.syscall_log, "w") as syscall_log:
+        self.syscall_log = os.path.join(os.getcwd(), "file_system_storage/{}_exec.log".format(self.name))
+        with ExecLog(self.syscall_log) as syscall_log:
             self.set_target(rpath_mfs)
-            mount_ret = self.target_os.mount_file_system()
-            if mount_ret == 1 and self.vm_object.check_vm_state():
+            syscall_log.commit()
+            with self._timed("mount"):
+                mount_ret = self.target_os.mount_file_system()
+            mounted = mount_ret == 1 and self.vm_object.check_vm_state()
+            self.note_fixup_mount(mounted)
+            if mounted:
                 print(clr.Fore.GREEN + "[+] Mounting successful!" + clr.Fore.RESET)
                 self.success_mounts += 1
                 if self.user_interaction_emulation(syscall_log):
+                    syscall_log.commit()
                     self.unmount_file_system_on_remote()
             else:
                 print(clr.Fore.RED + "[!] Mounting failed!" + clr.Fore.RESET)
                 if mount_ret == 0 and not self.target_os.destroy_bdev() and self.vm_object.silent_vm_state():
                     pass
                 else:
-                    syscall_log.write("[!] mount\n")
+                    syscall_log.append("", MOUNT_CRASHED)
+                    syscall_log.commit()
                     self.check_if_crash_sample()
             self.iter += 1
+            if self.parent:
+                self.parent.note_iteration()
             self._print_separator()
             self.end_iter = round(time.time() - self.start_iter, 2)
+            self.get_metrics().observe(self.vm_name, "iteration", self.end_iter)
             self.all_iter_time += self.end_iter
             self.avg_iter_time = round(self.all_iter_time / self.iter, 2)
 
     def unmount_file_system_on_remote(self):
-        if self.target_os.unmount_file_system() and self.vm_object.silent_vm_state():
+        with self._timed("unmount"):
+            unmounted = self.target_os.unmount_file_system()
+        if unmounted and self.vm_object.silent_vm_state():
             print(clr.Fore.GREEN + "[+] Unmounted {} successfully".format(self.rmount) + clr.Fore.RESET)
         else:
             self.check_if_crash_sample()
 
     def _print_statistics_output_to_tty(self):
+        if self.parent:
+            return  # the WorkerPool prints the statistics of all workers
         os.system("clear")
         self._print_separator()
         print(
@@ -363,7 +576,10 @@ class Fuzzer:
             "Filesystem type: {} | Filesystem size: {}MB \n"
             "Iteration: {} | Last iteration time: {}s | Avg. iteration time: {}s\n"
             "# Crashes: {} | # New crashes: {} | Last panic: {} | Last new crash (iter): {}\n"
-            "Successful mounts: {} ({}%) | {}/{} ({}%) Commands executed".format(
+            "Successful mounts: {} ({}%) | {}/{} ({}%) Commands executed\n"
+            "Checksum fixup: {}\n"
+            "Top stages: {}\n"
+            "Producer stages: {}".format(
                 str(self.start)[:-4],
                 self.runtime,
                 self.host_os,
@@ -382,6 +598,9 @@ class Fuzzer:
                 self.actual_exec,
                 self.max_exec,
                 self._get_percentage(self.actual_exec, self.max_exec),
+                self.format_fixup_stats(),
+                self.format_top_stages(),
+                self.format_producer_stages(),
             )
         )
         self._print_separator()
@@ -392,10 +611,9 @@ class Fuzzer:
         print(line_separator * int(subprocess.check_output(["stty", "size"], encoding="utf-8").split()[1]))
 
     def _get_core_details(self, file):
-        with open(file, "rb") as f:
-            data = f.read()
-        self.last_panic = extract_core_features.get_panic_name(data)
-        return extract_core_features.get_core_details(data)
+        report = extract_core_features.parse_core_file(file)
+        self.last_panic = report.panic or ""
+        return report.sanitized_trace()
 
     @staticmethod
     def _write_sha256sum_txt(core_txt, sha256_trace):
@@ -407,76 +625,76 @@ class Fuzzer:
     def _check_if_crash_is_yet_unknown(self):
         core_txt = [os.path.join(self.new_crash_dir, f) for f in os.listdir(self.new_crash_dir) if f.startswith("core.txt")][0]
         sanitized_bt = self._get_core_details(core_txt)
+        self.known_trace = False
         if len(self.last_panic) <= 2:
             return 0
         self.crashes += 1
         sha256_trace = extract_core_features.get_sha256_sum(sanitized_bt)
+        self.known_trace = self.get_crash_store().is_known(sha256_trace)
         self._write_sha256sum_txt(core_txt, sha256_trace)
-        crashdb = os.path.join(os.getcwd(), "crash_dumps/crash.db")
         pathlib.Path(self.new_crash_dir).rename(self.new_crash_dir + "_" + str(self.last_panic))
         self.new_crash_dir = self.new_crash_dir + "_" + self.last_panic
-        with open(crashdb, "a+") as f:
-            f.seek(0)
-            db_contents = f.read()
-            if sha256_trace not in db_contents:
-                self.ucrashes += 1
-                self.last_unique = self.iter
-                print(clr.Fore.CYAN + "[+] New unseen crash found: {}!".format(sha256_trace) + clr.Fore.RESET)
-                mfs_meta = str(get_basename(self.lpath_mfs)).split("_")
-                engine = mfs_meta[0].strip()
-                if "radamsa" in engine and self.radamsa_seed:
-                    engine = engine + " (seed: {})".format(self.radamsa_seed)
-                else:
-                    engine = "None"
-                fs = mfs_meta[-2].strip()
-                size = mfs_meta[-1].strip()
-                entry = (
-                    str(self.name)
-                    + "; "
-                    + str(self.vm_name)
-                    + "; "
-                    + fs
-                    + "; "
-                    + size
-                    + "; "
-                    + engine
-                    + "; "
-                    + str(self.last_panic)
-                    + "; "
-                    + sha256_trace
-                    + "; "
-                    + str(self.new_crash_dir)
-                    + "; "
-                    + str(self.runtime)
-                    + "; "
-                    + str(self.iter)
-                    + "\n"
-                )
-                f.write(entry)
-            f.close()
+        mfs_meta = str(get_basename(self.lpath_mfs)).split("_")
+        frames = crash_buckets.get_frames(sanitized_bt)
+        is_unique = self.get_crash_store().record_crash(
+            trace_hash=sha256_trace,
+            bucket=crash_buckets.get_bucket_hash(self.last_panic, frames),
+            signature=crash_buckets.get_minhash(frames),
+            panic=str(self.last_panic),
+            fuzzer=str(self.name),
+            vm=str(self.vm_name),
+            fs_type=mfs_meta[-2].strip(),
+            fs_size=mfs_meta[-1].strip(),
+            engine=self.mutation_engine,
+            seed=self.radamsa_seed,
+            crash_dir=str(self.new_crash_dir),
+            runtime=self.runtime,
+            iteration=self.iter,
+            target_os=self.host_os,
+        )
+        if is_unique:
+            self.ucrashes += 1
+            self.last_unique = self.iter
+            if self.parent:
+                self.parent.note_unique_crash()
+            print(clr.Fore.CYAN + "[+] New unseen crash found: {}!".format(sha256_trace) + clr.Fore.RESET)
+
+    def get_crash_store(self):
+        if not self.crash_store:
+            self.crash_store = crash_store.open_crash_store(create_directory(os.path.join(os.getcwd(), "crash_dumps")))
+        return self.crash_store
 
     def _backup_samples(self):
+        # The seed is stored under its usual fs name, i.e. the mutated fs name without the engine prefix.
+        # Delta engines only keep seed and delta, which share the seed blob with every other crash of that seed
+        image_name = get_basename(self.lpath_mfs)
         files = [
-            self.lpath_mfs,
-            self.syscall_log,
-            os.path.join(
-                str(get_parent_path(self.lpath_mfs)), "_".join(x for x in str(get_basename(self.lpath_mfs)).split("_")[1:]),
-            ),
+            (self.syscall_log, get_basename(self.syscall_log), "log", None),
+            (self.lpath_seed, "_".join(x for x in str(image_name).split("_")[1:]), "seed", self.test_case.seed_id if self.test_case else None),
         ]
+        delta_path = None
+        if self.mutation_delta:
+            delta_path = self.mutation_delta.save(os.path.join(self.new_crash_dir, "mutation.delta"))
+            files.append((delta_path, image_name + blob_store.DELTA_SUFFIX, "delta", None))
+        else:
+            files.append((self.materialize_mutated_fs(), image_name, "image", None))
         logging.debug("BACKUP FILES: {}".format(files))
-        archive = os.path.join(self.new_crash_dir, "sample.zip")
-        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as myzip:
-            for f in list(filter(None, files)):
-                myzip.write(f, pathlib.Path(f).name)
-        myzip.close()
+        # only staged here, the crash packer moves them into the blob store
+        self.staged_artifacts = crash_packer.stage_files(files, self.new_crash_dir)
+        if delta_path:
+            os.remove(delta_path)
 
     def _iter_reset(self):
+        if self.snapshot_fuzzing:
+            return  # every iteration starts from a pristine snapshot anyway
         if self.iter % 150 == 0 and self.iter - self.last_crash_iter > 50:
             logging.warning("Automatic VM reset in progress...")
+            self._pause_pipeline()
             cur_snap = self.vm_object.get_current_snapshot()
             try:
-                self.vm_object.restore_snapshot(cur_snap)
-                self.vm_object.new_rshell()
+                with self._timed("reset"):
+                    self.vm_object.restore_snapshot(cur_snap)
+                    self.vm_object.new_rshell()
             except socket.timeout as e:
                 logging.debug("Socket timed out during snapshot restoring: {}".format(e))
                 time.sleep(2)
@@ -484,6 +702,8 @@ class Fuzzer:
                     self.vm_object.new_rshell()
                 else:
                     self.vm_object.crash_handler()
+            finally:
+                self._drain_pipeline()
 
     @staticmethod
     def _get_percentage(part, whole):
@@ -497,61 +717,217 @@ class Fuzzer:
         fs_maker_vm.exec_cmd_quiet("/bin/rm -rf {}".format(os.path.join("/tmp/", fs_name)))
         fs_maker_vm.exec_cmd_quiet("/bin/rm -rf {}".format(os.path.join("/mnt", fs_name)))
 
-    def copy_generated_file_system_to_host(self, fs_maker_vm, fs_name):
-        fs_maker_vm.cp_to_host(
-            save_files_at=os.path.join(os.getcwd() + "/file_system_storage"),
-            get_files_from="/tmp/",
-            list_of_files_to_copy=fs_name,
+    def generate_seed(self, fs_maker_vm):
+        fs_name = "{}_{}_{}MB".format(self.name, self.mfs_type, self.mfs_size)
+        cmd = (
+            "python3 /tmp/makeFS2.py -fs {} -m 1"
+            ' -n "{}"'
+            " -s {}"
+            " -p {}"
+            " -ps {}"
+            " -o {}".format(self.mfs_type, fs_name, self.mfs_size, self.mfs_files, self.mfs_max_file_size, "/tmp/",)
         )
+        if fs_maker_vm.silent_vm_state():
+            with self._timed("seed_generation", fs_maker_vm.name):
+                fs_log = fs_maker_vm.exec_cmd_quiet(cmd)
+            if "ERROR" in fs_log:
+                print("Failed FS creation: {}".format(fs_log))
+                sys.exit(1)
+        else:
+            fs_maker_vm.restore_snapshot(fs_maker_vm.get_current_snapshot())
+            fs_maker_vm.quick_boot(vm_name=fs_maker_vm.name)
+            fs_log = fs_maker_vm.exec_cmd_quiet(cmd)
+        if not fs_log:
+            logging.error("Failed to fetch fs sample log.. Exiting..!\n")
+            sys.exit(1)
+        with self._timed("seed_download", fs_maker_vm.name):
+            fs_maker_vm.cp_to_host(
+                save_files_at=self.seed_corpus.path, get_files_from="/tmp/", list_of_files_to_copy=fs_name,
+            )
         self._remove_iteration_leftovers_on_target(fs_maker_vm, "fs_" + fs_name)
+        return self.seed_corpus.add(
+            os.path.join(self.seed_corpus.path, fs_name),
+            self.mfs_type,
+            self.mfs_size,
+            self.mfs_files,
+            self.mfs_max_file_size,
+            fs_log,
+        )
+
+    def refill_seed_corpus(self, fs_maker_vm):
+        key = get_corpus_key(self.mfs_type, self.mfs_size, self.mfs_files, self.mfs_max_file_size)
+        while len(self.seed_corpus.available(key)) < self.seed_refill_threshold:
+            self.generate_seed(fs_maker_vm)
+
+    def get_seed_from_corpus(self, fs_maker_vm):
+        # The picked seed is hardlinked to its usual place so naming of mutated images stays unchanged
+        fs_name = "{}_{}_{}MB".format(self.name, self.mfs_type, self.mfs_size)
+        self.refill_seed_corpus(fs_maker_vm)
+        seed_id, entry = self.seed_corpus.pick(
+            get_corpus_key(self.mfs_type, self.mfs_size, self.mfs_files, self.mfs_max_file_size)
+        )
+        lpath_seed = os.path.join(os.getcwd(), "file_system_storage", fs_name)
+        if os.path.lexists(lpath_seed):
+            os.remove(lpath_seed)
+        os.link(self.seed_corpus.get_seed_path(seed_id), lpath_seed)
+        return fs_name, seed_id, entry["fs_log"]
+
+    def produce_test_case(self, fs_maker_vm):
+        if self.dyn_scaling:
+            self._change_fs_parameters()
+        fs_name, seed_id, fs_log = self.get_seed_from_corpus(fs_maker_vm)
+        with self._timed("mutation", "host"):
+            lpath_mfs, delta, radamsa_seed = self._make_mutation(fs_name)
+        self.tc_counter += 1
+        test_case = TestCase(self.tc_counter, fs_name, seed_id, fs_log, lpath_mfs, delta, radamsa_seed)
+        if not lpath_mfs:
+            self.discard_test_case(test_case)
+            return None
+        self.fix_checksums_of_test_case(test_case)
+        return test_case
+
+    def fix_checksums_of_test_case(self, test_case):
+        if self.mutation_engine not in self.fix_checksums or not test_case.delta:
+            return
+        fixup = ChecksumFixup(os.path.join(os.getcwd(), "file_system_storage", test_case.fs_name), test_case.delta)
+        if not fixup.supported():
+            return
+        if random.random() < self.fixup_control_share:
+            test_case.fixup_group = "control"
+            return
+        with self._timed("checksum_fixup", "host"):
+            self.fixed_checksums += fixup.fix()
+        test_case.fixup_group = "fixed"
+        if fixup.fixed:
+            logging.debug("Rewrote checksums: {}".format(", ".join(fixup.fixed)))
+
+    def note_fixup_mount(self, mounted):
+        group = self.test_case.fixup_group if self.test_case else None
+        if group:
+            self.fixup_mounts[group][0] += int(mounted)
+            self.fixup_mounts[group][1] += 1
+
+    def format_fixup_stats(self):
+        # mount rate of fixed test cases against the control group
+        (fixed_ok, fixed), (control_ok, control) = self.fixup_mounts["fixed"], self.fixup_mounts["control"]
+        if not fixed and not control:
+            return "-"
+        fixed_rate, control_rate = self._get_percentage(fixed_ok, fixed), self._get_percentage(control_ok, control)
+        return "fixed {}/{} ({}%) vs control {}/{} ({}%) mounted, {:+}% points".format(
+            fixed_ok, fixed, fixed_rate, control_ok, control, control_rate, round(fixed_rate - control_rate, 2)
+        )
+
+    def stage_test_case(self, test_case, fuzzy_vm):
+        if not fuzzy_vm.silent_vm_state():
+            return None
+        with self._timed("upload", fuzzy_vm.name):
+            test_case.rpath_mfs = self.send_mutated_fs_to_guest(fuzzy_vm, test_case)
+        return test_case if test_case.rpath_mfs else None
+
+    def release_test_case(self, test_case):
+        self.seed_corpus.release(test_case.seed_id)
+        if isinstance(test_case.delta, FullImage):
+            test_case.delta.remove()
+
+    def discard_test_case(self, test_case):
+        self.release_test_case(test_case)
+        if test_case.rpath_mfs:
+            self.stale_guest_files.append(test_case.rpath_mfs)
+
+    def _load_test_case(self, test_case):
+        self.test_case = test_case
+        self.lpath_mfs = test_case.lpath_mfs
+        if self.worker_storage:
+            # same file name, but workers must not materialize into each others images
+            self.lpath_mfs = os.path.join(self.worker_storage, get_basename(test_case.lpath_mfs))
+        self.lpath_seed = self.seed_corpus.get_seed_path(test_case.seed_id)
+        self.mutation_delta = test_case.delta
+        self.mfs_materialized = False
+        self.radamsa_seed = test_case.radamsa_seed
+        self.fs_log = test_case.fs_log
 
-    def fuzz(self, fuzzy_vm, fs_maker_vm):
+    @staticmethod
+    def _on_vm_health_event(event, vm_name):
+        if event == VM_DOWN:
+            logging.warning("VM {} stopped responding".format(vm_name))
+        else:
+            logging.info("VM {} is reachable again".format(vm_name))
+
+    def _remove_stale_guest_files(self):
+        if self.stale_guest_files and self.vm_object.silent_vm_state():
+            self.vm_object.exec_cmd_quiet("/bin/rm -f {}".format(" ".join(self.stale_guest_files)))
+            self.stale_guest_files = []
+
+    def create_seed_corpus(self):
         create_directory(os.getcwd() + "/file_system_storage")
+        return SeedCorpus(
+            os.path.join(os.getcwd(), "file_system_storage", "seed_corpus", self.name),
+            max_seeds=self.seed_corpus_size,
+            mutations_per_seed=self.mutations_per_seed,
+        )
+
+    def make_worker(self, idx, vm_object):
+        worker = Fuzzer()
+        worker.name = "{}_w{}".format(self.name, idx)
+        worker.vm_name = vm_object.name
+        worker.vm_object = vm_object
+        worker.parent = self
+        worker.worker_storage = create_directory(os.path.join(os.getcwd(), "file_system_storage", worker.name))
+        worker.mutation_engine = self.mutation_engine
+        worker.mutation_size = self.mutation_size
+        worker.mfs_type = self.mfs_type
+        worker.mfs_size = self.mfs_size
+        worker.mfs_files = self.mfs_files
+        worker.mfs_max_file_size = self.mfs_max_file_size
+        worker.dyn_scaling = False  # only the controller produces test cases
+        worker.pipeline_depth = self.pipeline_depth
+        worker.snapshot_fuzzing = self.snapshot_fuzzing
+        worker.start = self.start
+        worker.crash_store = self.get_crash_store()
+        worker.crash_packer = self.get_crash_packer()
+        worker.dedup_vmcores = self.dedup_vmcores
+        worker.metrics = self.get_metrics()
+        return worker
+
+    def note_iteration(self):
+        with self.stats_lock:
+            self.iter += 1
+
+    def note_unique_crash(self):
+        with self.stats_lock:
+            self.ucrashes += 1
+            self.last_unique = self.iter
+
+    def fuzz(self, fuzzy_vm, fs_maker_vm, source=None):
+        # source is the shared test case queue of a WorkerPool, without one this Fuzzer produces its own
+        if not self.seed_corpus:
+            self.seed_corpus = self.create_seed_corpus()
+        # A snapshot revert wipes everything staged ahead of time, so in snapshot mode the
+        # pipeline only mutates and staging happens right after the revert
+        self.pipeline = Pipeline(
+            produce=source.get if source else (lambda: self.produce_test_case(fs_maker_vm)),
+            stage=(lambda tc: tc) if self.snapshot_fuzzing else (lambda tc: self.stage_test_case(tc, fuzzy_vm)),
+            discard=self.discard_test_case,
+            depth=self.pipeline_depth,
+        )
+        self.pipeline.start()
+        fuzzy_vm.health.subscribe(self._on_vm_health_event)
         while True:
-            if self.dyn_scaling:
-                self._change_fs_parameters()
             try:
                 self.start_iter = time.time()
                 self.runtime = str(datetime.datetime.now() - self.start)[:-4]
                 self._iter_reset()
-                fs_name = "{}_{}_{}MB".format(self.name, self.mfs_type, self.mfs_size)
-                cmd = (
-                    "python3 /tmp/makeFS2.py -fs {} -m 1"
-                    ' -n "{}"'
-                    " -s {}"
-                    " -p {}"
-                    " -ps {}"
-                    " -o {}".format(self.mfs_type, fs_name, self.mfs_size, self.mfs_files, self.mfs_max_file_size, "/tmp/",)
-                )
-                if fs_maker_vm.silent_vm_state():
-                    self.fs_log = fs_maker_vm.exec_cmd_quiet(cmd)
-                    if "ERROR" in self.fs_log:
-                        print("Failed FS creation: {}".format(self.fs_log))
-                        sys.exit(1)
-                else:
-                    fs_maker_vm.restore_snapshot(fs_maker_vm.get_current_snapshot())
-                    fs_maker_vm.quick_boot(vm_name=fs_maker_vm.name)
-                    self.fs_log = fs_maker_vm.exec_cmd_quiet(cmd)
-                if not self.fs_log:
-                    logging.error("Failed to fetch fs sample log.. Exiting..!\n")
-                    sys.exit(1)
-                self.copy_generated_file_system_to_host(fs_maker_vm, fs_name)
-                self._make_mutation(fs_name)
-                if not self.lpath_mfs:
+                self._remove_stale_guest_files()
+                self._load_test_case(self.pipeline.get())
+                if self.snapshot_fuzzing and not self._stage_from_snapshot(fuzzy_vm):
                     continue
-                fuzzy_vm.cp_to_guest(
-                    get_files_from="file_system_storage/",
-                    list_of_files_to_copy=get_basename(self.lpath_mfs),
-                    save_files_at="/tmp",
-                )
                 if "zfs" in self.mfs_type:
                     mnt_path = "pool_" + "_".join(x for x in get_basename(self.lpath_mfs).split("_")[1:])
                 else:
                     mnt_path = get_basename(self.lpath_mfs)
-                self.automate(
-                    rpath_mfs="/tmp/{}".format(get_basename(self.lpath_mfs)), mount_at="/mnt/{}".format(mnt_path),
-                )
-                self.vm_object.exec_cmd_quiet("rm -rf {}".format(os.path.join("/tmp", self.lpath_mfs)))
+                self.automate(rpath_mfs=self.test_case.rpath_mfs, mount_at="/mnt/{}".format(mnt_path))
+                if not self.snapshot_fuzzing:
+                    self.vm_object.exec_cmd_quiet("rm -rf {}".format(self.test_case.rpath_mfs))
             except (paramiko.ssh_exception.SSHException, paramiko.ssh_exception.NoValidConnectionsError, socket.timeout,) as e:
                 logging.error("SSH/socket exception: {}. Resetting VM".format(e))
                 self.check_if_crash_sample()
@@ -560,20 +936,107 @@ class Fuzzer:
             except (EOFError, AttributeError) as e:
                 logging.error(e)
                 logging.error("VM may be down..? Resetting")
+                self._pause_pipeline()
                 self.vm_object.restore_snapshot(snap_name=self.vm_object.get_current_snapshot())
                 self.vm_object.reset_vm()
+                self._drain_pipeline()
+            finally:
+                if self.test_case:
+                    self.release_test_case(self.test_case)
+                    self.test_case = None
+                if self.snapshot_fuzzing:
+                    self._revert_fuzz_snapshot()
+
+    def _stage_from_snapshot(self, fuzzy_vm):
+        # Runs on a freshly reverted VM. Whenever the snapshot lacks the needed seed it is
+        # retaken after staging, so the guest seed cache survives the following reverts.
+        if not self.stage_test_case(self.test_case, fuzzy_vm):
+            return False
+        if not self.fuzz_snapshot or self.test_case.seed_uploaded:
+            self._take_fuzz_snapshot()
+        return True
+
+    def _take_fuzz_snapshot(self):
+        snap_name = "{}_snapshot_fuzzing".format(self.name)
+        self.vm_object.delete_snapshot(snap_name)
+        self.vm_object.create_snapshot_with_name(snap_name)
+        self.fuzz_snapshot = snap_name
+        logging.info("Took running-state snapshot {}".format(snap_name))
+
+    def _revert_fuzz_snapshot(self):
+        if not self.fuzz_snapshot:
+            return
+        with self._timed("reset"):
+            reverted = self.vm_object.revert_to_running_snapshot(self.fuzz_snapshot)
+        if not reverted:
+            self.fuzz_snapshot = None  # take a new one with the next test case
+
+    def send_mutated_fs_to_guest(self, fuzzy_vm, test_case):
+        # Only the delta crosses SSH, the guest agent rebuilds the image from its cached seed.
+        # Staged images carry the test case number so several of them can wait on the guest
+        rpath_mfs = "/tmp/{}.{}".format(get_basename(test_case.lpath_mfs), test_case.index)
+        if test_case.delta:
+            ret = self._apply_delta_on_guest(fuzzy_vm, test_case, rpath_mfs)
+            if ret == "MISSING_SEED":
+                self._send_seed_to_guest(fuzzy_vm, test_case.seed_id)
+                test_case.seed_uploaded = True
+                ret = self._apply_delta_on_guest(fuzzy_vm, test_case, rpath_mfs)
+            if ret == "OK":
+                return rpath_mfs
+            if ret == 2:
+                return None  # SSH failure, the VM is most likely down
+            if fuzzy_vm.name not in self.full_copy_vms:
+                self.full_copy_vms.add(fuzzy_vm.name)
+                logging.warning("Applying deltas on {} failed: {}. Copying full images from now on".format(fuzzy_vm.name, ret))
+        lpath_mfs = "{}.{}".format(test_case.lpath_mfs, test_case.index)
+        test_case.delta.materialize(self.seed_corpus.get_seed_path(test_case.seed_id), lpath_mfs)
+        fuzzy_vm.cp_to_guest(
+            get_files_from=get_parent_path(lpath_mfs), list_of_files_to_copy=get_basename(lpath_mfs), save_files_at="/tmp",
+        )
+        os.remove(lpath_mfs)
+        return rpath_mfs
+
+    def _apply_delta_on_guest(self, fuzzy_vm, test_case, rpath_mfs):
+        # Returns the applier's output: OK, MISSING_SEED, 2 on SSH failures or an error message
+        seed = os.path.join(GUEST_SEED_CACHE, test_case.seed_id)
+        if fuzzy_vm.name not in self.guest_python:
+            found = fuzzy_vm.exec_cmd_quiet("command -v python3 >/dev/null && echo 1 || echo 0")
+            if found not in ["0", "1"]:
+                return 2  # SSH failure, decide with the next test case
+            self.guest_python[fuzzy_vm.name] = found == "1"
+            if not self.guest_python[fuzzy_vm.name]:
+                logging.info("No python3 on {}, applying deltas with dd".format(fuzzy_vm.name))
+        if self.guest_python[fuzzy_vm.name]:
+            copy_scripts_to_fuzzer(fuzzy_vm)
+            cmd = "python3 /tmp/apply_delta.py {} - {}".format(seed, rpath_mfs)
+            return fuzzy_vm.exec_cmd_with_input(cmd, test_case.delta.to_bytes())
+        # OpenBSD and NetBSD ship no python3 in their base system
+        return fuzzy_vm.exec_cmd_with_input("/bin/sh -s", test_case.delta.to_shell_script(seed, rpath_mfs).encode())
+
+    def _send_seed_to_guest(self, fuzzy_vm, seed_id):
+        fuzzy_vm.mkdir(GUEST_SEED_CACHE)
+        # evict the least recently used seeds, both delta appliers touch a seed on every use
+        fuzzy_vm.exec_cmd_quiet(
+            "cd {} && /bin/ls -t | /usr/bin/tail -n +{} | /usr/bin/xargs /bin/rm -f".format(GUEST_SEED_CACHE, GUEST_SEED_CACHE_SIZE)
+        )
+        # corpus images are already named by their image id
+        fuzzy_vm.cp_to_guest(
+            get_files_from=self.seed_corpus.path, list_of_files_to_copy=seed_id, save_files_at=GUEST_SEED_CACHE,
+        )
 
     def _make_mutation(self, fs_name):
         try:
             fs = os.path.join(os.getcwd() + "/file_system_storage/", fs_name)
             if self.mutation_engine == "radamsa":
-                self.mutation_radamsa(fs)
+                return self.mutation_radamsa(fs)
             elif self.mutation_engine == "byte_flip_seq":
-                self.mutation_byte_flip_seq(fs, self.mutation_size)
+                return self.mutation_byte_flip_seq(fs, self.mutation_size)
             elif self.mutation_engine == "byte_flip_rnd":
-                self.mutation_byte_flip_rnd(fs, self.mutation_size)
+                return self.mutation_byte_flip_rnd(fs, self.mutation_size)
             elif self.mutation_engine == "metadata":
-                self.mutation_metadata(fs, self.mutation_size)
+                return self.mutation_metadata(fs, self.mutation_size)
+            elif self.mutation_engine == "ufs_field":
+                return self.mutation_ufs_field(fs, self.mutation_size)
             else:
                 logging.error("Unknown mutation engine specified! Exiting...")
                 sys.exit(1)
@@ -605,34 +1068,79 @@ def to_dict(input_ordered_dict):
     return json.loads(json.dumps(input_ordered_dict))
 
 
+def get_command_name(cmd):
+    # "/bin/ls -lah /mnt/x" -> "ls", used as metrics stage name
+    parts = cmd.split()
+    return os.path.basename(parts[0]) if parts else "empty"
+
+
 def copy_scripts_to_fuzzer(fuzzy_vm):
-    if not int(fuzzy_vm.exec_cmd_quiet("[ -f /tmp/get_users_and_groups.py ] && echo 1 || echo 0 | /usr/bin/head -n1")):
-        fuzzy_vm.cp_to_guest(
-            get_files_from="utility/", list_of_files_to_copy="get_users_and_groups.py", save_files_at="/tmp",
-        )
-    if not int(fuzzy_vm.exec_cmd_quiet("[ -f /tmp/file_traversal.py ] && echo 1 || echo 0 | /usr/bin/head -n1")):
-        fuzzy_vm.cp_to_guest(
-            get_files_from="utility/", list_of_files_to_copy="file_traversal.py", save_files_at="/tmp",
-        )
+    for script in GUEST_SCRIPTS:
+        if not int(fuzzy_vm.exec_cmd_quiet("[ -f /tmp/{} ] && echo 1 || echo 0 | /usr/bin/head -n1".format(script))):
+            fuzzy_vm.cp_to_guest(
+                get_files_from="utility/", list_of_files_to_copy=script, save_files_at="/tmp",
+            )
+
+
+def get_fuzzer_config(name):
+    """
+    The fuzzing_config.fuzzer entry called name, every optional setting it leaves out takes its
+    default from FUZZER_DEFAULTS. All settings are looked up by key here and nowhere else.
+    """
+    entries = [e for e in fuzzing_config.fuzzer if e.get("name") == name]
+    if len(entries) != 1:
+        logging.error("Expected exactly one fuzzer entry named {} in fuzzing_config, found {}".format(name, len(entries)))
+        sys.exit(1)
+    missing = [key for key in FUZZER_REQUIRED if key not in entries[0]]
+    if missing:
+        logging.error("Fuzzer entry {} lacks {}".format(name, ", ".join(missing)))
+        sys.exit(1)
+    unknown = [key for key in entries[0] if key not in FUZZER_REQUIRED and key not in FUZZER_DEFAULTS]
+    if unknown:
+        logging.warning("Ignoring unknown settings of fuzzer entry {}: {}".format(name, ", ".join(unknown)))
+    return dict(FUZZER_DEFAULTS, **entries[0])
 
 
 def main():
+    parser = argparse.ArgumentParser(description="File system fuzzer")
+    parser.add_argument(
+        "--fuzzer", "-f", required=True, dest="name", help="Name of the fuzzing_config.fuzzer entry to run",
+    )
+    args = parser.parse_args()
+    config = get_fuzzer_config(args.name)
+
     fs_generator = VmManager()
-    fs_generator.setup(vm_user=fuzzing_config.user, vm_password=fuzzing_config.pw, name=sys.argv[2])
-    fs_generator.quick_boot(vm_name=sys.argv[2])
+    fs_generator.setup(vm_user=fuzzing_config.user, vm_password=fuzzing_config.pw, name=config["fs_creator_vm"])
+    fs_generator.quick_boot(vm_name=config["fs_creator_vm"])
     if not int(fs_generator.exec_cmd_quiet("[ -f /tmp/makeFS2.py ] && echo 1 || echo 0 | head -n1")):
         fs_generator.cp_to_guest(get_files_from=".", list_of_files_to_copy="makeFS2.py", save_files_at="/tmp/")
     fuzzer = Fuzzer()
     fuzzer.__setup__(
-        name=sys.argv[1],
-        vm_name=sys.argv[3],
-        mutation_engine=tuple(x for x in sys.argv[4].split(", ")),
-        mfs_type=sys.argv[5],
-        mfs_size=int(sys.argv[6]),
-        mfs_files=int(sys.argv[7]),
-        mfs_max_file_size=int(sys.argv[8]),
-        dyn_scaling=sys.argv[9],
+        name=config["name"],
+        vm_name=config["fuzzing_vm"],
+        mutation_engine=tuple(x.strip() for x in config["mutation_engine"].split(",")),
+        mfs_type=config["target_fs"],
+        mfs_size=int(config["target_size"]),
+        mfs_files=int(config["populate_with_files"]),
+        mfs_max_file_size=int(config["max_file_size"]),
+        dyn_scaling=config["enable_dyn_scaling"],
+        seed_corpus_size=config["seed_corpus_size"],
+        mutations_per_seed=config["mutations_per_seed"],
+        pipeline_depth=config["pipeline_depth"],
+        snapshot_fuzzing=config["snapshot_fuzzing"],
+        crash_codec=config["crash_codec"],
+        compression_workers=config["compression_workers"],
+        dedup_vmcores=config["dedup_vmcores"],
+        metrics_port=config["metrics_port"],
+        metrics_log=config["metrics_log"],
+        fix_checksums=config["fix_checksums"],
     )
+    vm_names = [fuzzer.vm_name] + list(config["worker_vms"])
+    vm_names += ensure_clones(fuzzer.vm_name, int(config["worker_clones"]), fuzzing_config.user, fuzzing_config.pw)
+    fuzzer.start_metrics_export()
+    if len(vm_names) > 1:
+        WorkerPool(fuzzer, boot_pool_vms(vm_names, fuzzing_config.user, fuzzing_config.pw), fs_generator).run()
+        return
     fuzz_vm = VmManager()
     fuzz_vm.setup(vm_user=fuzzing_config.user, vm_password=fuzzing_config.pw, name=fuzzer.name)
     fuzz_vm.quick_boot(vm_name=fuzzer.vm_name)
@@ -1,8 +1,8 @@
 import logging
 import random
-import struct
 
-from file_system_magic.fs_util import get_bytearray, write_to_file, get_mutated_bytes
+from file_system_magic.fs_util import get_mutated_fs_path, get_mutated_bytes
+from mutation_buffer import MutationBuffer
 
 
 class ByteFlipper:
@@ -10,35 +10,33 @@ class ByteFlipper:
         self.nbytes = nbytes
         self.fs = fs
         self.mfs = None
+        self.delta = None
         self.mime = None
         self.mode = mode
         self.rnd = random.Random()
         self.rnd.seed(random.getrandbits(1024))
 
     def mutation_seq(self):
-        byte_array = get_bytearray(self.fs)
-        try:
-            rnd_pos = random.randint(0, len(byte_array) - self.nbytes)
-            muta_byte_seq = get_mutated_bytes(self.nbytes)
-            ctr = 0
-            while ctr <= self.nbytes:
-                byte_array[rnd_pos + ctr] = struct.pack("B", muta_byte_seq[ctr])
-                ctr += 1
-        except IndexError as e:
-            logging.error(e)
-            return None
-        return write_to_file(self.fs, self.nbytes, self.mode, byte_array)
-
-    def mutation_rnd(self):
-        ctr = 0
-        byte_array = get_bytearray(self.fs)
-        while ctr < self.nbytes:
+        with MutationBuffer(self.fs, get_mutated_fs_path(self.fs, self.nbytes, self.mode), materialize=False) as buf:
             try:
-                rnd_pos = random.randint(0, len(byte_array))
-                muta_byte_seq = get_mutated_bytes(self.nbytes)
-                byte_array[rnd_pos] = muta_byte_seq
-                ctr += 1
-            except IndexError as e:
+                rnd_pos = random.randint(0, len(buf) - self.nbytes)
+                buf.write(rnd_pos, get_mutated_bytes(self.nbytes))
+            except (IndexError, ValueError) as e:
                 logging.error(e)
                 return None
-        return write_to_file(self.fs, self.nbytes, self.mode, byte_array)
+        self.mfs, self.delta = buf.mfs, buf.delta
+        return self.mfs
+
+    def mutation_rnd(self):
+        with MutationBuffer(self.fs, get_mutated_fs_path(self.fs, self.nbytes, self.mode), materialize=False) as buf:
+            ctr = 0
+            while ctr < self.nbytes:
+                try:
+                    rnd_pos = random.randint(0, len(buf) - 1)
+                    buf.write(rnd_pos, get_mutated_bytes(1))
+                    ctr += 1
+                except (IndexError, ValueError) as e:
+                    logging.error(e)
+                    return None
+        self.mfs, self.delta = buf.mfs, buf.delta
+        return self.mfs
@@ -0,0 +1,206 @@
+import logging
+import struct
+
+from delta import get_image_id
+from file_system_magic.ext_superblock_parser import EXT, SBLOCK_EXT2
+from file_system_magic.fs_util import get_int, set_mime
+from file_system_magic.ufs_superblock_parser import SBLOCK_UFS2, SBLOCKSIZE
+from mutation_buffer import MutationBuffer
+from ufs_field import CG_LAYOUT, SB_LAYOUT, get_ufs_locations
+
+# ext4 feature flags (linux fs/ext4/ext4.h)
+EXT4_RO_COMPAT_GDT_CSUM = 0x10
+EXT4_RO_COMPAT_METADATA_CSUM = 0x400
+EXT4_INCOMPAT_META_BG = 0x10
+EXT4_INCOMPAT_64BIT = 0x80
+EXT4_INCOMPAT_CSUM_SEED = 0x2000
+EXT4_BG_CHECKSUM_OFF = 0x1E  # bg_checksum(u16) in struct ext4_group_desc
+EXT4_MIN_DESC_SIZE = 32
+EXT4_MAX_DESC_SIZE = 1024
+EXT4_MAX_GROUPS = 1024  # a mutated block count must not make us hash megabytes of descriptors
+
+# UFS2 check hashes in fs_metackhash (freebsd sys/ufs/ffs/fs.h)
+CK_SUPERBLOCK = 0x0001
+CK_CYLGRP = 0x0002
+
+SB_FIELDS = {f.name: f for f in SB_LAYOUT}
+CG_FIELDS = {f.name: f for f in CG_LAYOUT}
+
+_supported = {}
+
+
+def _make_table(poly, bits):
+    table = []
+    for n in range(256):
+        for _ in range(8):
+            n = (n >> 1) ^ poly if n & 1 else n >> 1
+        table.append(n & ((1 << bits) - 1))
+    return table
+
+
+CRC32C_TABLE = _make_table(0x82F63B78, 32)
+CRC16_TABLE = _make_table(0xA001, 16)
+
+
+def crc32c(crc, data):
+    # raw Castagnoli crc without the final inversion, as ext4_chksum() and calculate_crc32c() use it
+    table = CRC32C_TABLE
+    for b in data:
+        crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+def crc16(crc, data):
+    # linux lib/crc16.c, used by the old gdt_csum feature
+    table = CRC16_TABLE
+    for b in data:
+        crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+def _field(buf, base, fields, name):
+    f = fields[name]
+    return get_int(buf.read(base + f.offset, f.size * f.count))
+
+
+def _ext_field(buf, name):
+    off, size = EXT.get_offset_in_sb(name)
+    return get_int(buf.read(SBLOCK_EXT2 + off, size))
+
+
+class ChecksumFixup:
+    """
+    Recomputes the metadata checksums a mutation invalidated, so the image gets past the
+    integrity checks at mount time and the mutated fields reach the code behind them.
+    ext4: superblock crc32c (metadata_csum) and group descriptor checksums (metadata_csum or gdt_csum).
+    UFS2: superblock fs_ckhash and cylinder group cg_ckhash, if enabled via fs_metackhash.
+    Works on the seed plus delta, the rewritten checksums are appended to the delta as patches.
+    Only structures overlapping a patch are rehashed, the seed's own checksums are valid.
+    """
+
+    def __init__(self, fs, delta):
+        self.fs = fs
+        self.delta = delta
+        self.mime = None
+        self.fixed = []  # names of the rewritten checksums
+
+    def supported(self):
+        # whether the seed uses any checksum this class can fix
+        key = get_image_id(self.fs)
+        if key not in _supported:
+            self.mime = set_mime(self.fs)
+            with MutationBuffer(self.fs, materialize=False) as buf:
+                if self.mime == "ext":
+                    rocompat = _ext_field(buf, "e2fs_features_rocompat")
+                    _supported[key] = bool(rocompat & (EXT4_RO_COMPAT_GDT_CSUM | EXT4_RO_COMPAT_METADATA_CSUM))
+                elif self.mime == "ufs2":
+                    ckhash = _field(buf, SBLOCK_UFS2, SB_FIELDS, "fs_metackhash")
+                    _supported[key] = bool(ckhash & (CK_SUPERBLOCK | CK_CYLGRP))
+                else:
+                    _supported[key] = False  # ufs1 and zfs have no checksums handled here
+        return _supported[key]
+
+    def fix(self):
+        # Returns the amount of rewritten checksums
+        self.fixed = []
+        if not self.delta or not self.supported():
+            return 0
+        self.mime = self.mime or set_mime(self.fs)
+        with MutationBuffer(self.fs, materialize=False) as buf:
+            buf.delta = self.delta
+            try:
+                if self.mime == "ext":
+                    self._fix_ext(buf)
+                else:
+                    self._fix_ufs2(buf)
+            except (IndexError, ValueError) as e:
+                logging.debug("Checksum fixup stopped: {}".format(e))  # geometry mutated beyond repair
+        return len(self.fixed)
+
+    def _touched(self, start, end):
+        return any(off < end and start < off + len(new) for off, _, new in self.delta.patches)
+
+    def _write(self, buf, offset, value, name):
+        if buf.read(offset, len(value)) != value:
+            buf.write(offset, value)
+            self.fixed.append(name)
+
+    def _fix_ext(self, buf):
+        rocompat = _ext_field(buf, "e2fs_features_rocompat")
+        incompat = _ext_field(buf, "e2fs_features_incompat")
+        metadata_csum = rocompat & EXT4_RO_COMPAT_METADATA_CSUM
+        sb_end = SBLOCK_EXT2 + 1024
+        sb_touched = self._touched(SBLOCK_EXT2, sb_end)
+        if metadata_csum or rocompat & EXT4_RO_COMPAT_GDT_CSUM:
+            self._fix_ext_group_descriptors(buf, incompat, metadata_csum, sb_touched)
+        if metadata_csum and sb_touched:
+            off, _ = EXT.get_offset_in_sb("e4fs_sbchksum")
+            csum = crc32c(0xFFFFFFFF, buf.read(SBLOCK_EXT2, off))
+            self._write(buf, SBLOCK_EXT2 + off, struct.pack("<I", csum), "e4fs_sbchksum")
+
+    def _fix_ext_group_descriptors(self, buf, incompat, metadata_csum, sb_touched):
+        log_bsize = _ext_field(buf, "e2fs_log_bsize")
+        bpg = _ext_field(buf, "e2fs_bpg")
+        if log_bsize > 6 or not bpg or incompat & EXT4_INCOMPAT_META_BG:
+            return  # meta_bg spreads the descriptors over the disk, only the contiguous table is handled
+        is_64bit = incompat & EXT4_INCOMPAT_64BIT
+        desc_size = _ext_field(buf, "e3fs_desc_size") if is_64bit else EXT4_MIN_DESC_SIZE
+        if not EXT4_MIN_DESC_SIZE <= desc_size <= EXT4_MAX_DESC_SIZE:
+            return
+        bsize = 1024 << log_bsize
+        first_dblock = _ext_field(buf, "e2fs_first_dblock")
+        bcount = _ext_field(buf, "e2fs_bcount") | (_ext_field(buf, "e4fs_bcount_hi") << 32 if is_64bit else 0)
+        gdt = (first_dblock + 1) * bsize
+        ngroups = min(-(-max(bcount - first_dblock, 0) // bpg), max(len(buf) - gdt, 0) // desc_size, EXT4_MAX_GROUPS)
+        if not sb_touched and not self._touched(gdt, gdt + ngroups * desc_size):
+            return
+        uuid = buf.read(SBLOCK_EXT2 + EXT.get_offset_in_sb("e2fs_uuid")[0], 16)
+        if metadata_csum:
+            if incompat & EXT4_INCOMPAT_CSUM_SEED:
+                seed = _ext_field(buf, "e4fs_chksum_seed")
+            else:
+                seed = crc32c(0xFFFFFFFF, uuid)
+        else:
+            seed = crc16(0xFFFF, uuid)
+        for group in range(ngroups):
+            loc = gdt + group * desc_size
+            if not sb_touched and not self._touched(loc, loc + desc_size):
+                continue
+            desc = buf.read(loc, desc_size)
+            le_group = struct.pack("<I", group)
+            tail = desc[EXT4_BG_CHECKSUM_OFF + 2 :]
+            if metadata_csum:
+                csum = crc32c(crc32c(crc32c(seed, le_group), desc[:EXT4_BG_CHECKSUM_OFF]), b"\x00\x00")
+                csum = crc32c(csum, tail) & 0xFFFF
+            else:
+                csum = crc16(crc16(seed, le_group), desc[:EXT4_BG_CHECKSUM_OFF])
+                if is_64bit:
+                    csum = crc16(csum, tail)
+            self._write(buf, loc + EXT4_BG_CHECKSUM_OFF, struct.pack("<H", csum), "bg_checksum[{}]".format(group))
+
+    def _fix_ufs2(self, buf):
+        sb_locs, cg_locs = get_ufs_locations(self.fs, self.mime)
+        # the kernel verifies whatever fs_metackhash asks for, mutated or not
+        primary = SBLOCK_UFS2
+        ckhash = _field(buf, primary, SB_FIELDS, "fs_metackhash")
+        sb_touched = self._touched(primary, primary + SBLOCKSIZE)
+        if ckhash & CK_CYLGRP:
+            cgsize = _field(buf, primary, SB_FIELDS, "fs_cgsize")
+            if 0 < cgsize <= 1 << 20:
+                for loc in cg_locs:
+                    # the primary superblock defines the hashed length, once it changed all groups are rehashed
+                    if sb_touched or self._touched(loc, loc + cgsize):
+                        self._fix_ufs2_hash(buf, loc, cgsize, CG_FIELDS["cg_ckhash"], "cg_ckhash@{}".format(hex(loc)))
+        if ckhash & CK_SUPERBLOCK:
+            for loc in sb_locs:
+                sbsize = _field(buf, loc, SB_FIELDS, "fs_sbsize")
+                if 0 < sbsize <= SBLOCKSIZE and self._touched(loc, loc + sbsize):
+                    self._fix_ufs2_hash(buf, loc, sbsize, SB_FIELDS["fs_ckhash"], "fs_ckhash@{}".format(hex(loc)))
+
+    def _fix_ufs2_hash(self, buf, loc, size, field, name):
+        # the check hash is computed with the hash field itself zeroed
+        data = bytearray(buf.read(loc, size))
+        if len(data) < size:
+            return  # cut off at the end of the image
+        data[field.offset : field.offset + field.size] = bytes(field.size)
+        self._write(buf, loc + field.offset, struct.pack("<I", crc32c(0xFFFFFFFF, data)), name)
@@ -0,0 +1,210 @@
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+
+# Binary patch format, little endian:
+# header: magic(8) | seed sha256(32) | image size(u64) | #patches(u32)
+# patch:  offset(u64) | length(u32) | old bytes(length) | new bytes(length)
+DELTA_MAGIC = b"FSFZDLT1"
+DELTA_HEADER = struct.Struct("<8s32sQI")
+DELTA_PATCH = struct.Struct("<QI")
+DIFF_BLOCK_SIZE = 4096
+SHELL_CHUNK_SIZE = 1024  # bytes per printf | dd pair, keeps every command line far below ARG_MAX
+HASH_CHUNK_SIZE = 1 << 20
+# a patch stores old and new bytes, past this share of changed bytes copying the image is cheaper
+MAX_DELTA_SHARE = 0.5
+
+_image_ids = {}
+
+
+def clone_file(src, dst):
+    # Reflink (CoW) clone if the host fs supports it, otherwise a sparse copy.
+    # Either way untouched blocks are shared or skipped instead of being rewritten
+    if subprocess.call(["cp", "--reflink=auto", "--sparse=always", str(src), str(dst)], stderr=subprocess.DEVNULL):
+        shutil.copyfile(src, dst)
+    return dst
+
+
+def get_image_id(fs, mm=None):
+    # sha256 of the image content, cached per inode (hardlinks included) as long as the file does not change.
+    # mm is an open mapping of fs, hashing it saves reading the file a second time
+    st = os.stat(fs)
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    if key not in _image_ids:
+        sha = hashlib.sha256()
+        if mm is not None:
+            for off in range(0, len(mm), HASH_CHUNK_SIZE):
+                sha.update(mm[off : off + HASH_CHUNK_SIZE])
+        else:
+            with open(fs, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    sha.update(chunk)
+        _image_ids[key] = sha.hexdigest()
+    return _image_ids[key]
+
+
+class Delta:
+    """
+    Compact, replayable representation of a mutated image: the seed image id,
+    the resulting image size and a list of (offset, old bytes, new bytes) patches.
+    """
+
+    def __init__(self, seed_id, size, patches=None):
+        self.seed_id = seed_id
+        self.size = size
+        self.patches = patches if patches else []
+
+    def __len__(self):
+        return len(self.patches)
+
+    def add(self, offset, old, new):
+        self.patches.append((offset, bytes(old), bytes(new)))
+
+    def mutated_bytes(self):
+        return sum(len(new) for _, _, new in self.patches)
+
+    def to_bytes(self):
+        out = [DELTA_HEADER.pack(DELTA_MAGIC, bytes.fromhex(self.seed_id), self.size, len(self.patches))]
+        for offset, old, new in self.patches:
+            out.append(DELTA_PATCH.pack(offset, len(new)))
+            out.append(old)
+            out.append(new)
+        return b"".join(out)
+
+    @staticmethod
+    def from_bytes(data):
+        magic, seed_id, size, n_patches = DELTA_HEADER.unpack_from(data, 0)
+        if magic != DELTA_MAGIC:
+            raise ValueError("Not a delta file, bad magic: {}".format(magic))
+        delta = Delta(seed_id.hex(), size)
+        pos = DELTA_HEADER.size
+        for _ in range(n_patches):
+            offset, length = DELTA_PATCH.unpack_from(data, pos)
+            pos += DELTA_PATCH.size
+            delta.add(offset, data[pos : pos + length], data[pos + length : pos + 2 * length])
+            pos += 2 * length
+        return delta
+
+    def to_shell_script(self, seed, out):
+        """
+        The delta as POSIX sh script for guests without python3 (OpenBSD/NetBSD base):
+        copies the seed, sets the image size and writes every patch with printf | dd.
+        Prints MISSING_SEED or OK just like utility/apply_delta.py.
+        """
+        lines = [
+            "[ -f {0} ] || {{ echo MISSING_SEED; exit 2; }}".format(seed),
+            "touch {0} && cp {0} {1} || exit 1".format(seed, out),
+            # without conv=notrunc dd truncates (or extends) the output at the seek offset
+            "dd if=/dev/null of={} bs=1 seek={} 2>/dev/null || exit 1".format(out, self.size),
+        ]
+        for offset, _, new in self.patches:
+            for pos in range(0, len(new), SHELL_CHUNK_SIZE):
+                data = "".join("\\{:03o}".format(b) for b in new[pos : pos + SHELL_CHUNK_SIZE])
+                lines.append(
+                    "printf '{}' | dd of={} bs=1 seek={} conv=notrunc 2>/dev/null || exit 1".format(data, out, offset + pos)
+                )
+        lines.append("echo OK")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+        return path
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            return Delta.from_bytes(f.read())
+
+    def apply(self, f):
+        f.truncate(self.size)
+        for offset, _, new in self.patches:
+            f.seek(offset)
+            f.write(new)
+
+    def materialize(self, seed, mfs):
+        # Sparse/reflinked clone of the seed, so only the patched blocks hit the disk
+        if get_image_id(seed) != self.seed_id:
+            raise ValueError("Seed {} does not match delta seed id {}".format(seed, self.seed_id))
+        clone_file(seed, mfs)
+        with open(mfs, "r+b") as f:
+            self.apply(f)
+        return mfs
+
+
+class FullImage:
+    """
+    Stands in for a Delta once the mutated image shares too little with its seed:
+    the image stays on disk and is copied instead of being patched.
+    """
+
+    def __init__(self, seed_id, path):
+        self.seed_id = seed_id
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def __len__(self):
+        # no patches, callers fall back to copying the materialized image just like for an empty delta
+        return 0
+
+    def mutated_bytes(self):
+        return self.size
+
+    def materialize(self, seed, mfs):
+        return clone_file(self.path, mfs)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _diff_region(seed, mutated, start, end, delta):
+    # trim the common prefix and suffix of a differing block, returns the number of changed bytes
+    while start < end and seed[start] == mutated[start]:
+        start += 1
+    while end > start and seed[end - 1] == mutated[end - 1]:
+        end -= 1
+    if start < end:
+        delta.add(start, seed[start:end], mutated[start:end])
+    return end - start
+
+
+def diff_images(seed, mutated_data, max_bytes=None):
+    """
+    Builds a delta between the seed image on disk and a mutated image held in memory.
+    Equal blocks are skipped via memoryview comparison, only differing runs are inspected byte wise.
+    Returns None as soon as more than max_bytes differ.
+    """
+    delta = Delta(get_image_id(seed), len(mutated_data))
+    changed = 0
+    with open(seed, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        seed_view, mutated_view = memoryview(mm), memoryview(mutated_data)
+        common = min(len(seed_view), len(mutated_view))
+        for off in range(0, common, DIFF_BLOCK_SIZE):
+            end = min(off + DIFF_BLOCK_SIZE, common)
+            if seed_view[off:end] != mutated_view[off:end]:
+                changed += _diff_region(seed_view, mutated_view, off, end, delta)
+                if max_bytes is not None and changed > max_bytes:
+                    delta = None
+                    break
+        if delta is not None and len(mutated_view) > common:
+            # growth beyond the seed, the seed is zero extended when the delta is applied
+            if max_bytes is not None and changed + len(mutated_view) - common > max_bytes:
+                delta = None
+            else:
+                delta.add(common, bytes(len(mutated_view) - common), mutated_view[common:])
+        seed_view.release()
+        mutated_view.release()
+    return delta
+
+
+def diff_image_file(seed, mfs, max_bytes=None):
+    # diff_images for a mutated image on disk, it is mapped instead of read into memory
+    with open(mfs, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return diff_images(seed, b"", max_bytes)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return diff_images(seed, mm, max_bytes)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# python3 exec_log.py <exec log>  (prints the log in the old text form)
+
+import collections
+import hashlib
+import os
+import struct
+import sys
+
+# Binary execution log, little endian:
+# header: magic(8)
+# record: status(u8) | exit code(i32) | latency in us(u32) | output hash(16) | command length(u16) | command(utf-8)
+EXEC_LOG_MAGIC = b"FSFZXLG1"
+EXEC_RECORD = struct.Struct("<BiI16sH")
+WRITE_BUFFER_SIZE = 1 << 16
+NO_OUTPUT = bytes(16)
+
+EXEC_OK = 0
+EXEC_FAILED = 1
+EXEC_CRASHED = 2  # the guest went down while running the command
+MOUNT_CRASHED = 3  # the guest went down while mounting, there is no command
+STATUS_PREFIX = {EXEC_OK: "[+]", EXEC_FAILED: "[-]", EXEC_CRASHED: "[!]", MOUNT_CRASHED: "[!]"}
+
+ExecRecord = collections.namedtuple("ExecRecord", ["status", "exit_code", "latency", "output_hash", "command"])
+
+
+def hash_output(output):
+    if not isinstance(output, str):
+        return NO_OUTPUT  # None or one of the _exec error codes
+    return hashlib.blake2b(output.encode(errors="replace"), digest_size=16).digest()
+
+
+class ExecLog:
+    """
+    Append-only log of the commands run against a mounted image: status, exit code, latency,
+    output hash and the command itself. Records go through a buffered writer, commit() is the only
+    durability point (flush + fsync). The fuzzer commits right before every step that may take the
+    guest down, so whatever ran up to a crash is on disk when the crash is collected.
+    The file is always created anew, a crash directory may still hold a hard link to the last one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.lexists(path):
+            os.remove(path)
+        self.f = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        self.f.write(EXEC_LOG_MAGIC)
+        self.dirty = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, command, status, exit_code=None, latency=0, output=None):
+        raw = command.encode(errors="replace")[:0xFFFF]
+        self.f.write(
+            EXEC_RECORD.pack(
+                status, -1 if exit_code is None else exit_code, int(latency * 1e6), hash_output(output), len(raw)
+            )
+        )
+        self.f.write(raw)
+        self.dirty = True
+
+    def commit(self):
+        if self.dirty:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.dirty = False
+
+    def close(self):
+        if not self.f.closed:
+            self.commit()
+            self.f.close()
+
+
+def read_exec_log(path):
+    # A torn record at the end (fuzzer killed between two commits) is skipped
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(EXEC_LOG_MAGIC):
+        raise ValueError("Not an exec log, bad magic: {}".format(data[: len(EXEC_LOG_MAGIC)]))
+    pos = len(EXEC_LOG_MAGIC)
+    while pos + EXEC_RECORD.size <= len(data):
+        status, exit_code, latency, output_hash, length = EXEC_RECORD.unpack_from(data, pos)
+        pos += EXEC_RECORD.size
+        if pos + length > len(data):
+            break
+        yield ExecRecord(status, exit_code, latency / 1e6, output_hash, data[pos : pos + length].decode(errors="replace"))
+        pos += length
+
+
+def is_exec_log(path):
+    with open(path, "rb") as f:
+        return f.read(len(EXEC_LOG_MAGIC)) == EXEC_LOG_MAGIC
+
+
+def get_command_chain(path):
+    # commands that ran successfully and the one that crashed the guest, in execution order
+    if not is_exec_log(path):
+        return get_legacy_command_chain(path)
+    return [r.command for r in read_exec_log(path) if r.status in [EXEC_OK, EXEC_CRASHED]]
+
+
+def get_legacy_command_chain(syscall_log):
+    # text syscall logs of crashes found before the exec log
+    command_chain = []
+    with open(syscall_log, "r") as f:
+        for line in f:
+            if line.startswith("[+]") or line.startswith("[!]") and not line.startswith("[!] mount"):
+                command_chain.append(line.split("] ")[1].strip())
+    return command_chain
+
+
+def main():
+    for r in read_exec_log(sys.argv[1]):
+        command = "mount" if r.status == MOUNT_CRASHED else r.command
+        print("{} {} (exit {}, {:.3f}s, {})".format(STATUS_PREFIX[r.status], command, r.exit_code, r.latency, r.output_hash.hex()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
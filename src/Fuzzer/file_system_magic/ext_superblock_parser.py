@@ -4,11 +4,11 @@ import argparse
 import os
 import pathlib
 import pprint as pp
-import re
 import sys
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from ctypes import Structure, sizeof, c_uint8, c_char, c_uint32, c_uint64, c_uint16
 from .fs_util import get_int
+from .layout_index import find
 
 # xxd EXT_FS | 'ef53'
 # at offset 1080
@@ -16,6 +16,17 @@ EXT_MAGIC = b"\x53\xef"
 
 SBLOCK_EXT2 = 1024  # First 1024 bytes are unused, block group 0 starts with a superblock @ offset 1024d
 MAGIC_BYTES_OFF = 56
+UUID_OFF = 104
+
+# feature flags deciding where the backup superblocks and descriptor tables live (linux fs/ext4/ext4.h)
+EXT_COMPAT_SPARSE_SUPER2 = 0x200
+EXT_RO_COMPAT_SPARSE_SUPER = 0x1
+EXT_INCOMPAT_META_BG = 0x10
+EXT_INCOMPAT_64BIT = 0x80
+EXT_MIN_DESC_SIZE = 32
+EXT_DESC_INODE_TABLE = (8, 0x28)  # bg_inode_table_lo, bg_inode_table_hi in struct ext4_group_desc
+
+ExtGeometry = namedtuple("ExtGeometry", ["bsize", "first_dblock", "bpg", "ngroups", "desc_size", "is_64bit", "meta_bg"])
 
 EXT_SB = [
     ("e2fs_icount", c_uint32),
@@ -67,7 +78,7 @@ EXT_SB = [
     ("e3fs_default_mount_opts", c_uint32),
     ("e3fs_first_meta_bg", c_uint32),
     ("e3fs_mkfs_time", c_uint32),
-    ("e3fs_jnl_blks", c_uint32),
+    ("e3fs_jnl_blks", c_uint32 * 17),  # arr[17]
     ("e4fs_bcount_hi", c_uint32),
     ("e4fs_rbcount_hi", c_uint32),
     ("e4fs_fbcount_hi", c_uint32),
@@ -117,7 +128,7 @@ class EXT(Structure):
     def __init__(self, fs, fst):
         super(Structure).__init__()
         self.sb = OrderedDict()
-        self.sb_expected_len = 960
+        self.sb_expected_len = 1024
         self.fs = fs
         self.fst = fst
         self.sb_locs = []
@@ -146,19 +157,95 @@ class EXT(Structure):
             for field in self.fields_sb:
                 self.sb[field[0]] = f.read(sizeof(field[1]))
 
-    def find_all_superblocks(self):
+    def _field(self, name):
+        return get_int(self.sb[name])
+
+    def get_geometry(self):
+        # Returns the ExtGeometry of the primary superblock, None if it is unusable
         self.read_superblock_in_dict()
+        log_bsize, bpg = self._field("e2fs_log_bsize"), self._field("e2fs_bpg")
+        if self.sb["e2fs_magic"] != EXT_MAGIC or log_bsize > 6 or not bpg:
+            return None
+        bsize = 1024 << log_bsize
+        first_dblock = self._field("e2fs_first_dblock")
+        incompat = self._field("e2fs_features_incompat")
+        is_64bit = bool(incompat & EXT_INCOMPAT_64BIT)
+        bcount = self._field("e2fs_bcount") | (self._field("e4fs_bcount_hi") << 32 if is_64bit else 0)
+        desc_size = self._field("e3fs_desc_size") if is_64bit else EXT_MIN_DESC_SIZE
+        if bcount <= first_dblock or desc_size < EXT_MIN_DESC_SIZE:
+            return None
+        # groups starting beyond the end of the image are left out
+        ngroups = min(-(-(bcount - first_dblock) // bpg), -(-os.path.getsize(self.fs) // (bpg * bsize)))
+        return ExtGeometry(bsize, first_dblock, bpg, ngroups, desc_size, is_64bit, bool(incompat & EXT_INCOMPAT_META_BG))
+
+    def _group_has_superblock(self, group):
+        if group == 0:
+            return True
+        if self._field("e2fs_features_compat") & EXT_COMPAT_SPARSE_SUPER2:
+            backup_bgs = self.sb["e4fs_backup_bgs"]
+            return group in [get_int(backup_bgs[:4]), get_int(backup_bgs[4:])]
+        if self._field("e2fs_features_rocompat") & EXT_RO_COMPAT_SPARSE_SUPER:
+            return group == 1 or any(_is_power_of(group, base) for base in [3, 5, 7])
+        return True
+
+    def _group_start(self, geo, group):
+        return (geo.first_dblock + group * geo.bpg) * geo.bsize
+
+    def calc_superblock_locations(self, geo=None):
+        geo = geo or self.get_geometry()
+        if not geo:
+            return []
+        return [
+            SBLOCK_EXT2 if group == 0 else self._group_start(geo, group)
+            for group in range(geo.ngroups)
+            if self._group_has_superblock(group)
+        ]
+
+    def calc_group_descriptor_locations(self, geo=None):
+        # start of the descriptor table behind every superblock, meta_bg spreads the table over the disk and is not handled
+        geo = geo or self.get_geometry()
+        if not geo or geo.meta_bg:
+            return []
+        return [self._group_start(geo, group) + geo.bsize for group in range(geo.ngroups) if self._group_has_superblock(group)]
+
+    def calc_inode_table_locations(self, geo=None):
+        # inode tables as referenced by the primary descriptor table
+        geo = geo or self.get_geometry()
+        gdt = self.calc_group_descriptor_locations(geo)
+        if not gdt:
+            return []
+        locs = []
         with open(self.fs, "rb") as f:
-            f.seek(0)
-            data = f.read()
+            f.seek(gdt[0])
+            table = f.read(geo.ngroups * geo.desc_size)
+        lo, hi = EXT_DESC_INODE_TABLE
+        for group in range(len(table) // geo.desc_size):
+            desc = table[group * geo.desc_size : (group + 1) * geo.desc_size]
+            block = get_int(desc[lo : lo + 4])
+            if geo.is_64bit and geo.desc_size > hi:
+                block |= get_int(desc[hi : hi + 4]) << 32
+            locs.append(block * geo.bsize)
+        return locs
+
+    def _has_superblock_at(self, f, loc):
+        f.seek(loc + MAGIC_BYTES_OFF)
+        magic = f.read(len(EXT_MAGIC))
+        f.seek(loc + UUID_OFF)
+        return magic == EXT_MAGIC and f.read(16) == self.sb["e2fs_uuid"]
+
+    def find_all_superblocks(self):
+        # computed from the primary superblock geometry, the uuid scan is the fallback for damaged images
+        locs = self.calc_superblock_locations()
+        with open(self.fs, "rb") as f:
+            if locs and all(self._has_superblock_at(f, loc) for loc in locs):
+                self.sb_locs = locs
+                return self.sb_locs
+            self.sb_locs = []
             # Using uuid because the EXT2 magic is too short to yield good results
-            matches = re.finditer(self.sb["e2fs_uuid"], data)
-            for m in matches:
-                bytearr = bytearray()
-                sb = m.span()[0] - 104
-                bytearr.append(data[sb + MAGIC_BYTES_OFF])
-                bytearr.append(data[sb + MAGIC_BYTES_OFF + 1])
-                if bytearr == EXT_MAGIC:
+            for m in find(self.fs, "ext"):
+                sb = m - UUID_OFF
+                f.seek(sb + MAGIC_BYTES_OFF)
+                if sb >= 0 and f.read(len(EXT_MAGIC)) == EXT_MAGIC:
                     self.sb_locs.append(sb)
         return self.sb_locs
 
@@ -190,6 +277,12 @@ class EXT(Structure):
             self.dump_superblock(n=i)
 
 
+def _is_power_of(n, base):
+    while n > 1 and n % base == 0:
+        n //= base
+    return n == 1
+
+
 def main():
     parser = argparse.ArgumentParser(description="EXT file system parser")
     parser.add_argument(
@@ -38,12 +38,6 @@ def make_rnd(size):
     return token_bytes(size)
 
 
-def get_bytearray(fs):
-    with open(fs, "rb") as f:
-        byte_array = re.findall(b".", f.read())
-    return byte_array
-
-
 def set_mime(fs):
     file_mime = magic.from_file(fs)
     if "Unix Fast" in file_mime and "[v1]" in file_mime:
@@ -56,13 +50,10 @@ def set_mime(fs):
         return "zfs"
 
 
-def write_to_file(fs, nbytes, mode, byte_array):
+def get_mutated_fs_path(fs, nbytes, mode):
     name = pathlib.Path(fs).name
     _path = pathlib.Path(fs).parent
-    mfs = os.path.join(_path, "{}b_{}_".format(nbytes, mode) + name)
-    with open(mfs, "wb") as g:
-        g.write(b"".join(x for x in byte_array))
-    return mfs
+    return os.path.join(_path, "{}b_{}_".format(nbytes, mode) + name)
 
 
 def get_mutated_bytes(nbytes, mode=None):
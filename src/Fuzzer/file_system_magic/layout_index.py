@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# python3 -m file_system_magic.layout_index <image>  (from src/Fuzzer, prints the offsets of every pattern)
+
+import collections
+import mmap
+import os
+import re
+import sys
+
+from delta import get_image_id
+
+SCAN_CHUNK_SIZE = 1 << 20
+MAX_CACHED_INDEXES = 64  # a few times the seed corpus size
+
+LayoutIndex = collections.namedtuple("LayoutIndex", ["image_id", "size", "matches"])
+
+_indexes = collections.OrderedDict()
+
+
+def _get_patterns(mm):
+    # the parsers look their structures up in this index, so their constants are imported late
+    from .ext_superblock_parser import EXT_MAGIC, MAGIC_BYTES_OFF, SBLOCK_EXT2
+    from .ufs_superblock_parser import CG_MAGIC, UFS1_MAGIC, UFS_MAGIC
+    from .zfs_uberblock_parser import MMP_MAGIC, ZBT_MAGIC, ZFS_MAGIC
+
+    patterns = {"ufs": UFS_MAGIC, "ufs1": UFS1_MAGIC, "cg": CG_MAGIC, "zfs": ZFS_MAGIC, "zbt": ZBT_MAGIC, "mmp": MMP_MAGIC}
+    # The ext2 magic is too short to yield good results, the uuid of the primary superblock is used instead
+    magic = SBLOCK_EXT2 + MAGIC_BYTES_OFF
+    uuid = mm[SBLOCK_EXT2 + 104 : SBLOCK_EXT2 + 120]
+    if mm[magic : magic + len(EXT_MAGIC)] == EXT_MAGIC and len(uuid) == 16 and any(uuid):
+        patterns["ext"] = uuid
+    return patterns
+
+
+def scan(mm, patterns):
+    """
+    Offsets of all patterns in one pass over the image. Each chunk is searched for every pattern
+    while it is hot in the cache, windows overlap by the longest pattern so nothing at a chunk
+    border is missed. Matches of one pattern do not overlap, as with re.finditer.
+    """
+    compiled = {name: re.compile(re.escape(p)) for name, p in patterns.items()}
+    matches = {name: [] for name in patterns}
+    overlap = max(len(p) for p in patterns.values()) - 1
+    size = len(mm)
+    for start in range(0, size, SCAN_CHUNK_SIZE):
+        end = start + SCAN_CHUNK_SIZE
+        for name, rx in compiled.items():
+            found = matches[name]
+            pos = max(start, found[-1] + len(patterns[name]) if found else 0)
+            for m in rx.finditer(mm, pos, min(size, end + overlap)):
+                if m.start() >= end:
+                    break
+                found.append(m.start())
+    return matches
+
+
+def get_layout_index(fs, image_id=None):
+    """
+    Offsets of the UFS2/UFS1 superblock and cylinder group, ext superblock (by uuid) and ZFS uberblock/ZBT/MMP magics.
+    Cached by image hash, every parser and mutation engine asking for the same seed shares one scan.
+    image_id (sha256 of the image) saves hashing if the caller already knows it, otherwise
+    delta.get_image_id hashes the mapping once per inode.
+    """
+    with open(fs, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return LayoutIndex(image_id, 0, collections.defaultdict(list))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            image_id = image_id or get_image_id(fs, mm)
+            if image_id in _indexes:
+                _indexes.move_to_end(image_id)
+                return _indexes[image_id]
+            index = LayoutIndex(image_id, len(mm), scan(mm, _get_patterns(mm)))
+    _indexes[image_id] = index
+    if len(_indexes) > MAX_CACHED_INDEXES:
+        _indexes.popitem(last=False)
+    return index
+
+
+def find(fs, name, image_id=None):
+    # offsets of one pattern, a copy the caller may change
+    return list(get_layout_index(fs, image_id).matches.get(name, []))
+
+
+def main():
+    index = get_layout_index(sys.argv[1])
+    print("[+] Image {} ({} bytes)".format(index.image_id, index.size))
+    for name, offsets in index.matches.items():
+        print("[+] {}: {}".format(name, ", ".join(hex(o) for o in offsets)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,14 +4,15 @@ import argparse
 import os
 import pathlib
 import pprint as pp
-import re
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 from ctypes import Structure, sizeof, c_int32, c_int64, c_uint8, c_char, c_int8, c_uint32, c_int16, c_void_p, c_uint64, c_size_t
 from .fs_util import get_int
+from .layout_index import find
 
 # xxd UFS_FS | grep '1901 5419'
 # multiple offsets
 UFS_MAGIC = b"\x19\x01\x54\x19"
+UFS1_MAGIC = b"\x54\x19\x01\x00"
 CG_MAGIC = b"\x55\x02\x09"
 SBLOCK_PIGGY = 262144
 SBLOCKSIZE = 8192
@@ -23,6 +24,8 @@ MAXFRAG = 8
 SBLOCK_UFS1 = 8192
 SBLOCK_UFS2 = 65536
 
+UfsGeometry = namedtuple("UfsGeometry", ["fsize", "fpg", "ncg", "sblkno", "cblkno", "old_cgoffset", "old_cgmask"])
+
 ufs_time_t = c_int64
 ufs2_daddr_t = c_int64
 
@@ -223,27 +226,72 @@ class UFS(Structure):
             for field in self.fields_cg:
                 self.cg[field[0]] = f.read(sizeof(field[1]))
 
+    def get_geometry(self):
+        # Returns the UfsGeometry of the primary superblock, None if it is unusable
+        self._read_superblock_in_dict(self.sbo)
+        if self.sb["fs_magic"] != (UFS_MAGIC if self.fst == "ufs2" else UFS1_MAGIC):
+            return None
+        fields = ["fs_fsize", "fs_fpg", "fs_ncg", "fs_sblkno", "fs_cblkno", "fs_old_cgoffset", "fs_old_cgmask"]
+        geo = UfsGeometry(*[get_int(self.sb[fn], signed=True) for fn in fields])
+        if geo.fsize < 512 or geo.fsize & (geo.fsize - 1) or geo.fpg <= 0 or geo.ncg <= 0 or geo.sblkno < 0 or geo.cblkno < 0:
+            return None
+        return geo
+
+    def _cg_start(self, geo, cg):
+        # cgstart(), UFS1 staggers the metadata of the cylinder groups
+        start = geo.fpg * cg
+        if self.fst == "ufs1":
+            start += geo.old_cgoffset * (cg & ~geo.old_cgmask)
+        return start * geo.fsize
+
+    def _calc_locations(self, geo, blkno):
+        size = os.path.getsize(self.fs)
+        locs = []
+        for cg in range(geo.ncg):
+            loc = self._cg_start(geo, cg) + blkno * geo.fsize
+            if loc >= size:
+                break  # cylinder groups beyond the end of the image
+            locs.append(loc)
+        return locs
+
+    def calc_superblock_locations(self, geo=None):
+        # the primary superblock and the backup in every cylinder group (cgsblock)
+        geo = geo or self.get_geometry()
+        if not geo:
+            return []
+        return [self.sbo] + [loc for loc in self._calc_locations(geo, geo.sblkno) if loc != self.sbo]
+
+    def calc_cylinder_group_locations(self, geo=None):
+        # cgtod
+        geo = geo or self.get_geometry()
+        return self._calc_locations(geo, geo.cblkno) if geo else []
+
+    def _has_magic_at(self, f, loc, magic):
+        f.seek(loc)
+        return f.read(len(magic)) == magic
+
     def find_all_superblocks(self):
+        # computed from the primary superblock geometry, the magic scan is the fallback for damaged images
+        locs = self.calc_superblock_locations()
+        magic = UFS_MAGIC if self.fst == "ufs2" else UFS1_MAGIC
         with open(self.fs, "rb") as f:
-            data = f.read()
-            matches = re.finditer(UFS_MAGIC, data)
-            for m in matches:
-                sb = m.span()[0] - (self.sb_expected_len - 4)
-                self.sb_locs.append(sb)
-        self.sb_locs = self.sb_locs[1:]
-        if (not self.sb_locs or SBLOCK_UFS2 not in self.sb_locs) and self.fst == "ufs2":
-            self.sb_locs = [SBLOCK_UFS2] + self.sb_locs
-        elif (not self.sb_locs or SBLOCK_UFS1 not in self.sb_locs) and self.fst == "ufs1":
-            self.sb_locs = [SBLOCK_UFS1] + self.sb_locs
+            if locs and all(self._has_magic_at(f, loc + self.sb_expected_len - 4, magic) for loc in locs):
+                self.sb_locs = locs
+                return self.sb_locs
+        # fs_magic sits at the same offset in UFS1 and UFS2, only the value differs
+        matches = find(self.fs, "ufs" if self.fst == "ufs2" else "ufs1")
+        # the primary superblock always comes first, even if its magic is damaged
+        magic_off = self.sb_expected_len - 4
+        self.sb_locs = [self.sbo] + [m - magic_off for m in matches if m - magic_off != self.sbo]
         return self.sb_locs
 
     def find_all_cylinder_groups(self):
+        locs = self.calc_cylinder_group_locations()
         with open(self.fs, "rb") as f:
-            data = f.read()
-            matches = re.finditer(CG_MAGIC, data)
-            for m in matches:
-                cg = m.span()[0] - 4
-                self.cg_locs.append(cg)
+            if locs and all(self._has_magic_at(f, loc + 4, CG_MAGIC) for loc in locs):
+                self.cg_locs = locs
+                return self.cg_locs
+        self.cg_locs = [m - 4 for m in find(self.fs, "cg")]
         return self.cg_locs
 
     def print_superblock(self):
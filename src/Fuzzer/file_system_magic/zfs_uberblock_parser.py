@@ -3,9 +3,12 @@
 import argparse
 import os
 import pathlib
-import re
+import pprint as pp
+import struct
 from collections import OrderedDict
-from ctypes import Structure, sizeof, c_uint64, c_uint8, c_uint16
+from ctypes import Structure, sizeof, c_uint64, c_uint8
+from .fs_util import get_int
+from .layout_index import find
 
 # xxd ZFS_FS | grep '0cb1 ba00'
 # multiple offsets
@@ -15,38 +18,198 @@ ZBT_MAGIC = b"\x11\x7a\x0c\xb1\x7a\xda\x10\x02"
 # xxf test_zfs | grep '11ea 1ca1 0000 0000'
 MMP_MAGIC = b"\x11\xea\x1c\xa1\x00\x00\x00\x00"
 
-# TODO: Finish ZFS implementation https://github.com/freebsd/freebsd/blob/master/sys/cddl/boot/zfs/zfsimpl.h
+# vdev label layout (vdev_impl.h): 4 labels of 256K, two at the start and two at the end of the vdev,
+# each with a 128K uberblock ring in its second half. Uberblocks take 1K or 1 << ashift, whichever is larger
+VDEV_LABEL_SIZE = 256 << 10
+VDEV_LABELS = 4
+VDEV_UBERBLOCK_RING_OFF = 128 << 10
+VDEV_UBERBLOCK_RING_SIZE = 128 << 10
+UBERBLOCK_MIN_SIZE = 1 << 10
+
+# vdev_phys (label offset 16K): packed nvlist with the pool config, followed by its zio_eck_t trailer
+VDEV_PHYS_OFF = 16 << 10
+VDEV_PHYS_SIZE = 112 << 10
+ZIO_ECK_SIZE = 40
+# DVA offsets count from the end of the two front labels and the boot block
+VDEV_LABEL_START_SIZE = 2 * VDEV_LABEL_SIZE + (7 << 19)
+UBERBLOCK_SHIFT = 10
+MAX_UBERBLOCK_SHIFT = 13
+UB_USED_SIZE = 208  # fields in front of the zero padding, see ZFS_UB
+BLKPTR_SIZE = 128
+
+# packed nvlist (libnvpair), only the XDR encoding is used on disk
+NV_ENCODE_XDR = 1
+NVLIST_MAX_DEPTH = 16
+DATA_TYPE_BOOLEAN = 1
+DATA_TYPE_BYTE_ARRAY = 10
+DATA_TYPE_STRING = 9
+DATA_TYPE_STRING_ARRAY = 17
+DATA_TYPE_NVLIST = 19
+DATA_TYPE_NVLIST_ARRAY = 20
+# XDR widens everything below 32 bit to an int
+NV_SCALARS = {2: ">I", 3: ">i", 4: ">I", 5: ">i", 6: ">I", 7: ">q", 8: ">Q", 18: ">q", 21: ">i", 22: ">i", 23: ">I", 27: ">d"}
+NV_ARRAYS = {11: ">i", 12: ">I", 13: ">i", 14: ">I", 15: ">q", 16: ">Q", 24: ">i", 25: ">i", 26: ">I"}
+
+ZIO_COMPRESS = [
+    "inherit", "on", "off", "lzjb", "empty", "gzip-1", "gzip-2", "gzip-3", "gzip-4", "gzip-5",
+    "gzip-6", "gzip-7", "gzip-8", "gzip-9", "zle", "lz4", "zstd",
+]
+ZIO_CHECKSUM = [
+    "inherit", "on", "off", "label", "gang_header", "zilog", "fletcher2", "fletcher4",
+    "sha256", "zilog2", "noparity", "sha512", "skein", "edonr", "blake3",
+]
+
+# https://github.com/openzfs/zfs/blob/master/include/sys/uberblock_impl.h and include/sys/spa.h (blkptr_t)
+# The zio_eck_t trailer sits at the end of the slot, so the ub_eck_* fields only match 1K slots (ashift <= 10)
 ZFS_UB = [
     ("ub_magic", c_uint64),
     ("ub_version", c_uint64),
     ("ub_txg", c_uint64),
     ("ub_guid_sum", c_uint64),
     ("ub_timestamp", c_uint64),
-    # ("blk_dva0", c_uint64),
-    # ("blk_dva1", c_uint64),
-    # ("blk_prop", c_uint64),
-    # ("blk_pad0", c_uint64),
-    # ("blk_pad1", c_uint64),
-    # ("blk_phys_birth", c_uint64),
-    # ("blk_birth", c_uint64),
-    # ("blk_fill", c_uint64),
-    # ("blk_cksum0", c_uint64),
-    # ("blk_cksum1", c_uint64),
-    # ("blk_cksum2", c_uint64),
-    # ("blk_cksum3", c_uint64),
-    ("TODO_resolve_data_fields", c_uint64 * 117),
+    ("ub_rootbp_dva0", c_uint64 * 2),
+    ("ub_rootbp_dva1", c_uint64 * 2),
+    ("ub_rootbp_dva2", c_uint64 * 2),
+    ("ub_rootbp_prop", c_uint64),
+    ("ub_rootbp_pad", c_uint64 * 2),
+    ("ub_rootbp_phys_birth", c_uint64),
+    ("ub_rootbp_birth", c_uint64),
+    ("ub_rootbp_fill", c_uint64),
+    ("ub_rootbp_cksum", c_uint64 * 4),
     ("ub_software_version", c_uint64),
     ("ub_mmp_magic", c_uint64),
     ("ub_mmp_delay", c_uint64),
     ("ub_mmp_config", c_uint64),
-    ("ub_mmp_config_VALID", c_uint8),
-    ("ub_mmp_config_write_interval", c_uint8 * 3),
-    ("ub_mmp_config_seq", c_uint16),
-    ("ub_mmp_config_fail_intervals", c_uint16),
     ("ub_checkpoint_txg", c_uint64),
+    ("ub_pad", c_uint8 * (1024 - UB_USED_SIZE - ZIO_ECK_SIZE)),
+    ("ub_eck_magic", c_uint64),
+    ("ub_eck_cksum", c_uint64 * 4),
 ]
 
 
+class XdrReader:
+    # big-endian stream of a packed nvlist, running past the end raises ValueError
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def unpack(self, fmt):
+        try:
+            value = struct.unpack_from(fmt, self.data, self.pos)[0]
+        except struct.error:
+            raise ValueError("nvlist truncated at {}".format(self.pos))
+        self.pos += struct.calcsize(fmt)
+        return value
+
+    def opaque(self, n):
+        if n < 0 or self.pos + n > len(self.data):
+            raise ValueError("nvlist truncated at {}".format(self.pos))
+        value = bytes(self.data[self.pos : self.pos + n])
+        self.pos += (n + 3) & ~3
+        return value
+
+    def string(self):
+        return self.opaque(self.unpack(">I")).decode("utf-8", "replace")
+
+    def array(self, fmt):
+        n = self.unpack(">I")
+        if n * struct.calcsize(fmt) > len(self.data) - self.pos:
+            raise ValueError("nvlist array of {} elements at {}".format(n, self.pos))
+        return [self.unpack(fmt) for _ in range(n)]
+
+
+def _unpack_nvlist(r, depth=0):
+    if depth > NVLIST_MAX_DEPTH:
+        raise ValueError("nvlist nested too deep")
+    r.unpack(">i")  # nvl_version
+    r.unpack(">I")  # nvl_nvflag
+    nvl = OrderedDict()
+    while True:
+        start = r.pos
+        encode_size, decode_size = r.unpack(">i"), r.unpack(">i")
+        if not encode_size and not decode_size:
+            return nvl
+        if encode_size < 8 or start + encode_size > len(r.data):
+            raise ValueError("nvpair of {} bytes at {}".format(encode_size, start))
+        name = r.string()
+        dtype, nelem = r.unpack(">i"), r.unpack(">i")
+        nvl[name] = _unpack_value(r, dtype, nelem, depth)
+        # the encoded size covers the whole pair, unknown types are skipped
+        r.pos = start + encode_size
+
+
+def _unpack_value(r, dtype, nelem, depth):
+    if dtype == DATA_TYPE_BOOLEAN:
+        return True
+    if dtype in NV_SCALARS:
+        return r.unpack(NV_SCALARS[dtype])
+    if dtype in NV_ARRAYS:
+        return r.array(NV_ARRAYS[dtype])
+    if dtype == DATA_TYPE_STRING:
+        return r.string()
+    if dtype == DATA_TYPE_BYTE_ARRAY:
+        return r.opaque(nelem)
+    if dtype == DATA_TYPE_STRING_ARRAY:
+        return [r.string() for _ in range(max(nelem, 0))]
+    if dtype == DATA_TYPE_NVLIST:
+        return _unpack_nvlist(r, depth + 1)
+    if dtype == DATA_TYPE_NVLIST_ARRAY:
+        return [_unpack_nvlist(r, depth + 1) for _ in range(max(nelem, 0))]
+    return None
+
+
+def unpack_nvlist(data):
+    """
+    Decodes a packed nvlist as found in the vdev labels: 4 byte header (encoding, endianness),
+    then the XDR stream of nvpairs. Returns the nvlist as OrderedDict and the amount of bytes it takes.
+    """
+    if len(data) < 4 or data[0] != NV_ENCODE_XDR:
+        raise ValueError("not an XDR packed nvlist")
+    r = XdrReader(data, 4)
+    nvl = _unpack_nvlist(r)
+    return nvl, r.pos
+
+
+def decode_blkptr(data):
+    # blkptr_t: 3 DVAs, blk_prop, padding, birth txgs, fill count and checksum, all little endian words
+    w = struct.unpack_from("<16Q", data)
+    prop = w[6]
+    embedded = bool(prop >> 39 & 1)
+    bp = OrderedDict()
+    bp["dvas"] = []
+    for i in range(0 if embedded else 3):
+        w0, w1 = w[2 * i], w[2 * i + 1]
+        asize = (w0 & 0xFFFFFF) << 9
+        if asize:
+            dva = OrderedDict(vdev=w0 >> 32 & 0xFFFFFF, grid=w0 >> 24 & 0xFF, asize=asize)
+            dva["offset"] = (w1 & ~(1 << 63)) << 9
+            dva["gang"] = bool(w1 >> 63)
+            bp["dvas"].append(dva)
+    if embedded:
+        # the payload lives in the block pointer itself, lsize/psize are counted in bytes
+        bp["lsize"] = (prop & 0x1FFFFFF) + 1
+        bp["psize"] = (prop >> 25 & 0x7F) + 1
+    else:
+        bp["lsize"] = ((prop & 0xFFFF) + 1) << 9
+        bp["psize"] = ((prop >> 16 & 0xFFFF) + 1) << 9
+    compression = prop >> 32 & 0x7F
+    checksum = prop >> 40 & 0xFF
+    bp["compression"] = ZIO_COMPRESS[compression] if compression < len(ZIO_COMPRESS) else compression
+    bp["embedded"] = embedded
+    if not embedded:
+        bp["checksum"] = ZIO_CHECKSUM[checksum] if checksum < len(ZIO_CHECKSUM) else checksum
+    bp["type"] = prop >> 48 & 0xFF
+    bp["level"] = prop >> 56 & 0x1F
+    bp["encrypted"] = bool(prop >> 61 & 1)
+    bp["dedup"] = bool(prop >> 62 & 1)
+    bp["byteorder"] = "little" if prop >> 63 else "big"
+    bp["phys_birth"] = w[9]
+    bp["birth"] = w[10]
+    bp["fill"] = w[11]
+    bp["cksum"] = [hex(c) for c in w[12:16]]
+    return bp
+
+
 class ZFS(Structure):
     def __init__(self, fs, fst):
         super(Structure).__init__()
@@ -56,6 +219,7 @@ class ZFS(Structure):
         self.fst = fst
         self.sb_locs = []
         self.fields_sb = ZFS_UB
+        self.labels = None
 
     def _sanity_check(self):
         res_ub = 0
@@ -74,12 +238,119 @@ class ZFS(Structure):
             for field in self.fields_sb:
                 self.sb[field[0]] = f.read(sizeof(field[1]))
 
-    def find_all_superblocks(self):
+    def calc_label_locations(self):
+        # the vdev size is rounded down to whole labels
+        size = os.path.getsize(self.fs) & ~(VDEV_LABEL_SIZE - 1)
+        if size < VDEV_LABELS * VDEV_LABEL_SIZE:
+            return []
+        return [0, VDEV_LABEL_SIZE, size - 2 * VDEV_LABEL_SIZE, size - VDEV_LABEL_SIZE]
+
+    def read_labels(self):
+        # [(label offset, config nvlist or None, packed nvlist size)] of the four vdev labels
+        if self.labels is None:
+            self.labels = []
+            with open(self.fs, "rb") as f:
+                for label in self.calc_label_locations():
+                    f.seek(label + VDEV_PHYS_OFF)
+                    try:
+                        config, used = unpack_nvlist(f.read(VDEV_PHYS_SIZE - ZIO_ECK_SIZE))
+                    except ValueError:
+                        config, used = None, 0  # damaged label, the others may still be good
+                    self.labels.append((label, config, used))
+        return self.labels
+
+    def get_config(self):
+        # pool config of the first readable label
+        for _, config, _ in self.read_labels():
+            if config is not None:
+                return config
+        return None
+
+    def get_uberblock_size(self):
+        # uberblock slots take 1 << ashift of the top level vdev, at least 1K and at most 8K
+        config = self.get_config() or {}
+        ashift = config.get("vdev_tree", {}).get("ashift", UBERBLOCK_SHIFT)
+        if not isinstance(ashift, int):
+            ashift = UBERBLOCK_SHIFT
+        return 1 << min(max(ashift, UBERBLOCK_SHIFT), MAX_UBERBLOCK_SHIFT)
+
+    def calc_uberblock_locations(self):
+        # slots of the uberblock rings that hold an uberblock, 128 of 1K or fewer larger ones per label
+        locs = []
+        ub_size = self.get_uberblock_size()
         with open(self.fs, "rb") as f:
-            data = f.read()
-            matches = re.finditer(ZFS_MAGIC, data)
-            for m in matches:
-                self.sb_locs.append(m.span()[0])
+            for label in self.calc_label_locations():
+                f.seek(label + VDEV_UBERBLOCK_RING_OFF)
+                ring = f.read(VDEV_UBERBLOCK_RING_SIZE)
+                for off in range(0, len(ring), ub_size):
+                    if ring[off : off + len(ZFS_MAGIC)] == ZFS_MAGIC:
+                        locs.append(label + VDEV_UBERBLOCK_RING_OFF + off)
+        return locs
+
+    def read_uberblock(self, loc):
+        # decoded uberblock at loc, None without the uberblock magic
+        self._read_superblock_in_dict(loc)
+        if self.sb["ub_magic"] != ZFS_MAGIC or len(self.sb["ub_checkpoint_txg"]) < 8:
+            return None
+        ub = OrderedDict()
+        for name in ["version", "txg", "guid_sum", "timestamp", "software_version", "checkpoint_txg"]:
+            ub[name] = get_int(self.sb["ub_" + name])
+        ub["rootbp"] = decode_blkptr(b"".join(v for k, v in self.sb.items() if k.startswith("ub_rootbp_")))
+        if self.sb["ub_mmp_magic"] == MMP_MAGIC:
+            config = get_int(self.sb["ub_mmp_config"])
+            ub["mmp"] = OrderedDict(delay=get_int(self.sb["ub_mmp_delay"]))
+            # the low byte flags which of the packed values are valid
+            if config & 0x1:
+                ub["mmp"]["write_interval"] = config >> 8 & 0xFFFFFF
+            if config & 0x2:
+                ub["mmp"]["seq"] = config >> 32 & 0xFFFF
+            if config & 0x4:
+                ub["mmp"]["fail_intervals"] = config >> 48 & 0xFFFF
+        return ub
+
+    def get_active_uberblock(self):
+        # (location, uberblock) the pool imports from: highest txg, then newest timestamp
+        best = None
+        for loc in self.calc_uberblock_locations():
+            ub = self.read_uberblock(loc)
+            if ub and (best is None or (ub["txg"], ub["timestamp"]) > (best[1]["txg"], best[1]["timestamp"])):
+                best = (loc, ub)
+        return best
+
+    def calc_rootbp_locations(self):
+        # [(offset, psize)] of the MOS objset copies the active uberblock points to, on this vdev only
+        active = self.get_active_uberblock()
+        if not active:
+            return []
+        bp = active[1]["rootbp"]
+        vdev = (self.get_config() or {}).get("vdev_tree", {}).get("id", 0)
+        size = os.path.getsize(self.fs)
+        locs = []
+        for dva in bp["dvas"]:
+            off = dva["offset"] + VDEV_LABEL_START_SIZE
+            # gang blocks point to a gang header instead of the data
+            if dva["vdev"] == vdev and not dva["gang"] and off + bp["psize"] <= size:
+                locs.append((off, bp["psize"]))
+        return locs
+
+    def get_metadata_regions(self):
+        """
+        [(offset, length)] of the ZFS metadata worth mutating, computed from the labels without a scan:
+        the packed config nvlists, the used part of every uberblock and the MOS objset of the active one.
+        """
+        regions = [(label + VDEV_PHYS_OFF, used) for label, _, used in self.read_labels() if used]
+        regions += [(loc, UB_USED_SIZE) for loc in self.find_all_superblocks()]
+        return regions + self.calc_rootbp_locations()
+
+    def get_preserved_regions(self):
+        # [(offset, length)] a pool needs to import: the vdev_phys of every label and all uberblock slots in use
+        regions = [(label + VDEV_PHYS_OFF, VDEV_PHYS_SIZE) for label, config, _ in self.read_labels() if config]
+        ub_size = self.get_uberblock_size()
+        return regions + [(loc, ub_size) for loc in self.find_all_superblocks()]
+
+    def find_all_superblocks(self):
+        # computed from the vdev label layout, the magic scan is the fallback for damaged images
+        self.sb_locs = self.calc_uberblock_locations() or find(self.fs, "zfs")
         return self.sb_locs
 
     def dump_superblock(self, n=0):
@@ -116,6 +387,22 @@ def main():
         dest="find_all",
         help="Finds all superblock locations and prints them to stdout. Default: %(default)s",
     )
+    parser.add_argument(
+        "--labels",
+        "-l",
+        action="store_true",
+        default=False,
+        dest="labels",
+        help="Prints the config nvlists of the vdev labels. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--uberblock",
+        "-u",
+        action="store_true",
+        default=False,
+        dest="uberblock",
+        help="Prints the active uberblock and its root block pointer. Default: %(default)s",
+    )
     parser.add_argument("--file_system", "-f", required=True, type=pathlib.Path, help="UFS Filesystem")
     parser.add_argument(
         "--file_system_type", "-ft", type=str, default="zfs2", dest="fst", help="[zfs1, zfs2]. Default: %(default)s"
@@ -132,6 +419,19 @@ def main():
         zfs.find_all_superblocks()
         res = ", ".join(hex(e) for e in zfs.sb_locs)
         print(f"[+] Found superblock offsets: {res}")
+    if args.labels:
+        for label, config, used in zfs.read_labels():
+            print(f"[+] Label {hex(label)} ({used} bytes nvlist):")
+            pp.pprint(config)
+    if args.uberblock:
+        active = zfs.get_active_uberblock()
+        if active:
+            print(f"[+] Active uberblock at {hex(active[0])}:")
+            pp.pprint(active[1])
+            res = ", ".join(f"{hex(off)} ({size} bytes)" for off, size in zfs.calc_rootbp_locations())
+            print(f"[+] MOS objset at: {res}")
+        else:
+            print("[!] No uberblock found")
 
 
 if __name__ == "__main__":
@@ -3,9 +3,10 @@ import random
 import sys
 
 from file_system_magic.ext_superblock_parser import EXT
-from file_system_magic.fs_util import get_bytearray, set_mime, write_to_file, get_mutated_bytes
+from file_system_magic.fs_util import get_mutated_fs_path, set_mime, get_mutated_bytes
 from file_system_magic.ufs_superblock_parser import UFS
 from file_system_magic.zfs_uberblock_parser import ZFS
+from mutation_buffer import MutationBuffer
 
 
 class MetaMutation:
@@ -13,6 +14,7 @@ class MetaMutation:
         self.nbytes = nbytes
         self.fs = fs
         self.mfs = None
+        self.delta = None
         self.mime = None
         self.mode = mode
         self.s_locs = None
@@ -21,7 +23,6 @@ class MetaMutation:
         self.rnd.seed(random.getrandbits(1024))
 
     def mutation(self):
-        barray = get_bytearray(self.fs)
         self.mime = set_mime(self.fs)
         if "ufs" in self.mime:
             fs_p = UFS(fs=self.fs, fst=self.mime)
@@ -34,19 +35,25 @@ class MetaMutation:
             sys.exit(1)
         self.s_locs = fs_p.find_all_superblocks()
 
+        if self.mime == "zfs":
+            # config nvlists, uberblock fields and the MOS objset, not the zero padding of the uberblock slots
+            regions = fs_p.get_metadata_regions()
+        else:
+            regions = [(i, fs_p.sb_expected_len) for i in self.s_locs]
         good_locs = []
-        for i in self.s_locs:
-            for j in range(fs_p.sb_expected_len):
+        for i, size in regions:
+            for j in range(size):
                 good_locs.append(i + j)
 
-        ctr = 0
-        while ctr < self.nbytes:
-            try:
-                rnd_pos = random.choice(good_locs)
-                muta_byte_seq = get_mutated_bytes(1)
-                barray[rnd_pos] = muta_byte_seq
-                ctr += 1
-            except IndexError as e:
-                logging.error(e)
-                return None
-        return write_to_file(self.fs, self.nbytes, self.mode, barray)
+        with MutationBuffer(self.fs, get_mutated_fs_path(self.fs, self.nbytes, self.mode), materialize=False) as buf:
+            ctr = 0
+            while ctr < self.nbytes:
+                try:
+                    rnd_pos = random.choice(good_locs)
+                    buf.write(rnd_pos, get_mutated_bytes(1))
+                    ctr += 1
+                except IndexError as e:
+                    logging.error(e)
+                    return None
+        self.mfs, self.delta = buf.mfs, buf.delta
+        return self.mfs
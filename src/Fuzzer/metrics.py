@@ -0,0 +1,146 @@
+import bisect
+import contextlib
+import http.server
+import json
+import logging
+import os
+import threading
+import time
+
+# upper bounds in seconds, roughly 2.5x apart, from a single guest command up to a full VM restore
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 150, 300, 600]
+METRIC_NAME = "fsfuzz_stage_seconds"
+# producer side of the pipeline, recorded under "host" or the name of the fs generator VM
+PRODUCER_STAGES = ["seed_generation", "seed_download", "mutation", "checksum_fixup"]
+
+
+def format_stages(summaries):
+    # [(name, summary)] as one status line
+    return " | ".join("{} {}x avg {}s".format(name, x["count"], round(x["avg"], 2)) for name, x in summaries) or "-"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-quantile, good enough to tell the stages apart
+        if not self.count:
+            return 0
+        rank, seen = q * self.count, 0
+        for idx, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return self.buckets[idx] if idx < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class StageMetrics:
+    """
+    Latency histograms per (vm, stage) of the fuzzing loop: seed generation and download, mutation,
+    upload, mount, every user emulation command (cmd_<name>), unmount, crash fetch, reset and
+    the whole iteration. One instance is shared by the controller and all workers of a pool.
+    Exported as Prometheus text (serve) and/or as a rolling JSONL file (log_to).
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, vm, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get((vm, stage))
+            if histogram is None:
+                histogram = self.histograms[(vm, stage)] = Histogram()
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, vm, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(vm, stage, time.time() - start)
+
+    def summaries(self, vm=None, stages=None):
+        # {(vm, stage): summary} ordered by the total time spent in a stage
+        with self.lock:
+            summaries = {
+                key: h.summary()
+                for key, h in self.histograms.items()
+                if (vm is None or key[0] == vm) and (stages is None or key[1] in stages)
+            }
+        return dict(sorted(summaries.items(), key=lambda item: item[1]["sum"], reverse=True))
+
+    def to_prometheus(self):
+        lines = ["# HELP {} Latency of the fuzzing stages".format(METRIC_NAME), "# TYPE {} histogram".format(METRIC_NAME)]
+        with self.lock:
+            for (vm, stage), h in sorted(self.histograms.items()):
+                labels = 'vm="{}",stage="{}"'.format(vm, stage)
+                cumulative = 0
+                for le, n in zip([str(b) for b in h.buckets] + ["+Inf"], h.counts):
+                    cumulative += n
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(METRIC_NAME, labels, le, cumulative))
+                lines.append("{}_sum{{{}}} {}".format(METRIC_NAME, labels, h.sum))
+                lines.append("{}_count{{{}}} {}".format(METRIC_NAME, labels, h.count))
+        return "\n".join(lines) + "\n"
+
+    def to_json_lines(self):
+        now = time.time()
+        return "".join(
+            json.dumps({"time": round(now, 3), "vm": vm, "stage": stage, **summary}) + "\n"
+            for (vm, stage), summary in self.summaries().items()
+        )
+
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics_http", daemon=True).start()
+        logging.info("Serving stage metrics on http://{}:{}/metrics".format(host, port))
+        return server
+
+    def log_to(self, path, interval=60, max_bytes=16 << 20):
+        # appends a snapshot of every histogram each interval, the file is rotated to <path>.1 at max_bytes
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    if os.path.exists(path) and os.path.getsize(path) > max_bytes:
+                        os.replace(path, path + ".1")
+                    with open(path, "a") as f:
+                        f.write(self.to_json_lines())
+                except OSError as e:
+                    logging.error("Writing stage metrics to {} failed: {}".format(path, e))
+
+        threading.Thread(target=run, name="metrics_jsonl", daemon=True).start()
@@ -0,0 +1,84 @@
+import mmap
+
+from delta import Delta, clone_file, get_image_id
+
+
+class MutationBuffer:
+    """
+    mmap backed view on a file system image that all mutation engines patch.
+    Every write is recorded as (offset, old bytes, new bytes) in self.delta.
+    With materialize=True the seed fs is cloned to mfs and patched in place, otherwise
+    the seed is mapped read-only and mfs is only written once materialize() is called.
+    Without an mfs such a buffer only records the delta and cannot be materialized.
+    Cost of a mutation scales with the amount of mutated bytes, not with the image size.
+    """
+
+    def __init__(self, fs, mfs=None, materialize=True):
+        self.fs = fs
+        self.mfs = mfs if mfs else fs
+        self.materialized = materialize
+        if not materialize and mfs and str(mfs) == str(fs):
+            raise ValueError("Deferred writes cannot go to the seed {} itself".format(fs))
+        self.delta = Delta(get_image_id(fs), 0)
+        if materialize:
+            if str(self.mfs) != str(self.fs):
+                clone_file(self.fs, self.mfs)
+            self._map(self.mfs, writable=True)
+        else:
+            self._map(self.fs, writable=False)
+        self.delta.size = len(self._mm)
+
+    def _map(self, path, writable):
+        self._fd = open(path, "r+b" if writable else "rb")
+        self._mm = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.view = memoryview(self._mm)
+
+    def _unmap(self):
+        self.view.release()
+        if self.materialized:
+            self._mm.flush()
+        self._mm.close()
+        self._fd.close()
+        self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self.delta.size
+
+    def read(self, offset, size):
+        data = bytearray(self.view[offset : offset + size])
+        if not self.materialized:
+            # overlay already recorded but not yet written patches
+            for p_off, _, new in self.delta.patches:
+                lo, hi = max(offset, p_off), min(offset + len(data), p_off + len(new))
+                if lo < hi:
+                    data[lo - offset : hi - offset] = new[lo - p_off : hi - p_off]
+        return bytes(data)
+
+    def write(self, offset, data):
+        if offset < 0 or offset + len(data) > self.delta.size:
+            raise IndexError("Mutation of {} bytes at {} exceeds image size {}".format(len(data), offset, self.delta.size))
+        self.delta.add(offset, self.read(offset, len(data)), data)
+        if self.materialized:
+            self.view[offset : offset + len(data)] = data
+
+    def materialize(self):
+        # writes mfs and continues on it, further writes go straight into the image
+        if not self.materialized:
+            if str(self.mfs) == str(self.fs):
+                raise ValueError("No mfs to materialize the delta of {} into".format(self.fs))
+            self.delta.materialize(self.fs, self.mfs)
+            self._unmap()
+            self._map(self.mfs, writable=True)
+            self.materialized = True
+        return self.mfs
+
+    def close(self):
+        if self._mm is not None:
+            self._unmap()
+        return self.mfs
@@ -0,0 +1,144 @@
+import logging
+import queue
+import threading
+import time
+
+
+class TestCase:
+    def __init__(self, index, fs_name, seed_id, fs_log, lpath_mfs, delta, radamsa_seed=None):
+        self.index = index  # running number, keeps staged files on the guest apart
+        self.fs_name = fs_name
+        self.seed_id = seed_id  # image id of the seed in the seed corpus
+        self.fs_log = fs_log
+        self.lpath_mfs = lpath_mfs  # host path the mutated fs is materialized to on demand
+        self.delta = delta
+        self.radamsa_seed = radamsa_seed
+        self.rpath_mfs = None  # guest path once the test case is staged
+        self.seed_uploaded = False  # staging had to push the seed into the guest seed cache
+        self.fixup_group = None  # "fixed" or "control" if the checksum fixup applies to the image
+        self.generation = None
+
+
+class Pipeline:
+    """
+    generate/mutate -> stage on guest -> execute
+    A producer thread creates test cases, a stager thread pushes them to the fuzzing VM and the
+    caller executes them via get(). Bounded queues keep at most depth test cases per stage in flight.
+    Staging and execution share the SSH connection of the VM, VmManager.ssh_lock serializes them.
+    pause() blocks further staging while the VM is reset, drain() discards everything in flight.
+    With depth=0 both stages run synchronously inside get().
+    """
+
+    def __init__(self, produce, stage, discard=None, depth=2):
+        self.produce = produce
+        self.stage = stage
+        self.discard = discard
+        self.depth = depth
+        self.mutated = queue.Queue(maxsize=max(depth, 1))
+        self.staged = queue.Queue(maxsize=max(depth, 1))
+        self.generation = 0
+        self.running = threading.Event()
+        self.running.set()
+        self.stage_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.error = None
+        self.threads = []
+
+    def start(self):
+        if self.depth <= 0:
+            return
+        for target, name in [(self._producer, "tc_producer"), (self._stager, "tc_stager")]:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        self.running.set()
+
+    def pause(self):
+        self.running.clear()
+        with self.stage_lock:
+            pass  # waits for an in-flight stage to finish
+
+    def resume(self):
+        self.running.set()
+
+    def drain(self):
+        self.generation += 1
+        for q in [self.mutated, self.staged]:
+            while True:
+                try:
+                    self._discard(q.get_nowait())
+                except queue.Empty:
+                    break
+
+    def _discard(self, test_case):
+        if test_case and self.discard:
+            self.discard(test_case)
+
+    def _put(self, q, test_case):
+        while not self.stopped.is_set():
+            try:
+                q.put(test_case, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _producer(self):
+        while not self.stopped.is_set():
+            self.running.wait()
+            generation = self.generation
+            try:
+                test_case = self.produce()
+            except SystemExit as e:
+                self.error = e
+                return
+            except Exception as e:
+                logging.error("Test case production failed: {}".format(e))
+                time.sleep(1)
+                continue
+            if test_case:
+                test_case.generation = generation
+                self._put(self.mutated, test_case)
+
+    def _stager(self):
+        while not self.stopped.is_set():
+            try:
+                test_case = self.mutated.get(timeout=1)
+            except queue.Empty:
+                continue
+            staged = None
+            while not self.stopped.is_set():
+                self.running.wait()
+                with self.stage_lock:
+                    if not self.running.is_set():
+                        continue
+                    if test_case.generation == self.generation:
+                        try:
+                            staged = self.stage(test_case)
+                        except Exception as e:
+                            logging.error("Staging test case on guest failed: {}".format(e))
+                break
+            if staged and staged.generation == self.generation:
+                self._put(self.staged, staged)
+            else:
+                self._discard(test_case)
+
+    def get(self):
+        if self.depth <= 0:
+            while True:
+                test_case = self.produce()
+                if test_case and self.stage(test_case):
+                    return test_case
+                self._discard(test_case)
+        while True:
+            if self.error:
+                raise self.error
+            try:
+                test_case = self.staged.get(timeout=1)
+            except queue.Empty:
+                continue
+            if test_case.generation == self.generation:
+                return test_case
+            self._discard(test_case)
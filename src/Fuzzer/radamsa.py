@@ -2,14 +2,16 @@ import logging
 import os
 import pathlib
 import random
-import re
 import subprocess
 import sys
+import tempfile
 
 from file_system_magic.ufs_superblock_parser import UFS, UFS_MAGIC
-from file_system_magic.ext_superblock_parser import EXT, EXT_MAGIC
+from file_system_magic.ext_superblock_parser import EXT, EXT_MAGIC, MAGIC_BYTES_OFF
 from file_system_magic.zfs_uberblock_parser import ZFS, ZFS_MAGIC
 from file_system_magic.fs_util import get_offset_in_sb, set_mime
+from file_system_magic.layout_index import find
+from delta import MAX_DELTA_SHARE, FullImage, diff_image_file, get_image_id
 
 
 class Radamsa:
@@ -17,30 +19,20 @@ class Radamsa:
         self.radamsa_seed = None
         self.path_to_file_system = path_to_file_system
         self.path_to_mutated_file_system = None
+        self.mutated_image = None  # radamsa output, a temporary file next to the seed
+        self.delta = None
         self.mime = None
 
     @staticmethod
     def _get_ufs_zfs_magic_pos(path_to_file_system, file_system_type=None):
-        with open(path_to_file_system, "rb") as f:
-            data = f.read()
-            magic_positions = []
-            if file_system_type == "ufs":
-                magic_sequence = UFS_MAGIC
-            elif file_system_type == "zfs":
-                magic_sequence = ZFS_MAGIC
-            else:
-                return False
-            matches = re.finditer(magic_sequence, data)
-            for m in matches:
-                magic_positions.append(m.span()[0])
-            return magic_positions
+        if file_system_type not in ["ufs", "zfs"]:
+            return False
+        return find(path_to_file_system, file_system_type)
 
     @staticmethod
     def _get_ext_magic_pos(path_to_file_system):
-        with open(path_to_file_system, "rb") as f:
-            data = f.read()
-            match = data.find(EXT_MAGIC)
-            return [match]
+        sb_locs = EXT(fs=path_to_file_system, fst="ext").find_all_superblocks()
+        return [sb_locs[0] + MAGIC_BYTES_OFF] if sb_locs else [-1]
 
     def _set_magic(self, mgc_offs, mime=None):
         # logging.error("[*] Restoring magic bytes in {}".format(self.path_to_mutated_file_system))
@@ -53,10 +45,16 @@ class Radamsa:
         else:
             print("[!] Unknown mime type - Cannot restore magic bytes - radamsa")
             sys.exit(1)
-        with open(self.path_to_mutated_file_system, "rb+") as f:
-            for m in mgc_offs:
-                f.seek(m)
-                f.write(mgc_seq)
+        self._patch_mutated_file_system([(m, mgc_seq) for m in mgc_offs])
+
+    def _patch_mutated_file_system(self, patches):
+        # radamsa may shrink the file, locations beyond the new EOF are skipped
+        with open(self.mutated_image, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            for off, data in patches:
+                if 0 <= off and off + len(data) <= size:
+                    f.seek(off)
+                    f.write(data)
 
     def _restore_magic_bytes(self):
         if "ufs" in self.mime:
@@ -64,7 +62,7 @@ class Radamsa:
             fn = "fs_magic"
         elif self.mime == "ext":
             fs_p = EXT(fs=self.path_to_file_system, fst=self.mime)
-            fn = "ext2fs_magic"
+            fn = "e2fs_magic"
         elif self.mime == "zfs":
             fs_p = ZFS(fs=self.path_to_file_system, fst=self.mime)
             fn = "ub_magic"
@@ -93,39 +91,54 @@ class Radamsa:
         else:
             logging.error("Could not detect file system type correctly")
             return 0
-        sb_locs = fsp.find_all_superblocks()
+        if self.mime == "zfs":
+            # labels (config nvlist) and uberblock slots, the 1K read at every magic missed the config
+            regions = fsp.get_preserved_regions()
+        else:
+            regions = [(loc, fsp.sb_expected_len) for loc in fsp.find_all_superblocks()]
         with open(self.path_to_file_system, "rb") as f:
-            for loc in sb_locs:
-                f.seek(loc)
-                sbs += f.read(fsp.expected_sb_len)
-        with open(self.path_to_mutated_file_system, "wb") as f:
-            for i, loc in enumerate(sb_locs):
+            for loc, size in regions:
                 f.seek(loc)
-                f.write(sbs[i])
+                sbs.append((loc, f.read(size)))
+        self._patch_mutated_file_system(sbs)
 
     def mutation(self, preserve_magic=True, preserve_uberblock=False, determinism=True):
         self.mime = set_mime(self.path_to_file_system)
         name = pathlib.Path(self.path_to_file_system).name
         _path = pathlib.Path(self.path_to_file_system).parent
         self.path_to_mutated_file_system = os.path.join(_path, "radamsa_" + name)
+        cmd = ["radamsa", str(self.path_to_file_system)]
         if determinism:
             self.radamsa_seed = random.getrandbits(100)
-            cmd = "radamsa {} -s {} > {}".format(self.path_to_file_system, self.radamsa_seed, self.path_to_mutated_file_system,)
-        else:
-            cmd = "radamsa {} > {}".format(self.path_to_file_system, self.path_to_mutated_file_system)
+            cmd += ["-s", str(self.radamsa_seed)]
         if preserve_uberblock:
             preserve_magic = False
-        subprocess.call(cmd, shell=True)
+        # unique name, test cases of the same seed may still be in flight
+        fd, self.mutated_image = tempfile.mkstemp(prefix="radamsa_{}.".format(name), dir=str(_path))
+        with os.fdopen(fd, "wb") as f:
+            subprocess.run(cmd, stdout=f)
         if preserve_magic:
             self._restore_magic_bytes()
         if preserve_uberblock:
             self._restore_uberblock()
+        # Only the differences to the seed are kept, the image is materialized on demand.
+        # Radamsa often rewrites most of the image, then the image itself is kept instead
+        max_bytes = int(os.path.getsize(self.mutated_image) * MAX_DELTA_SHARE)
+        self.delta = diff_image_file(self.path_to_file_system, self.mutated_image, max_bytes)
+        if self.delta is None:
+            self.delta = FullImage(get_image_id(self.path_to_file_system), self.mutated_image)
+        else:
+            os.remove(self.mutated_image)
+        self.mutated_image = None
         return self.radamsa_seed, self.path_to_mutated_file_system
 
 
 def main():
     rad = Radamsa(sys.argv[1])
     rad.mutation(preserve_magic=True)
+    rad.delta.materialize(rad.path_to_file_system, rad.path_to_mutated_file_system)
+    if isinstance(rad.delta, FullImage):
+        rad.delta.remove()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from delta import get_image_id
+
+
+def get_corpus_key(fs_type, fs_size, n_files, max_file_size):
+    return "{}_{}MB_{}_{}".format(fs_type, fs_size, n_files, max_file_size)
+
+
+def get_generation_seed(fs_log):
+    # first seed makeFS2 logged while populating the file system
+    match = re.search(r"\"seed\":\s*(\d+)", str(fs_log))
+    return int(match.group(1)) if match else None
+
+
+class SeedCorpus:
+    """
+    Local, content-addressed store of makeFS2 generated seed images.
+    Images are saved under their image id, the index groups them by
+    (fs type, size, #files, max file size) and keeps their generation seed and usage.
+    A seed is retired after mutations_per_seed mutations, the corpus holds at most max_seeds images.
+    Picked seeds stay pinned until release() so in-flight test cases never lose their seed.
+    """
+
+    def __init__(self, path, max_seeds=32, mutations_per_seed=100):
+        self.path = path
+        self.max_seeds = max_seeds
+        self.mutations_per_seed = mutations_per_seed
+        self.index_path = os.path.join(self.path, "index.json")
+        os.makedirs(self.path, exist_ok=True)
+        self.index = self._load_index()
+        self.pinned = Counter()
+        self.lock = threading.RLock()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        # drop entries whose image vanished from disk
+        return {k: v for k, v in index.items() if os.path.isfile(self.get_seed_path(k))}
+
+    def _save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=4)
+        os.replace(tmp, self.index_path)
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_seed_path(self, seed_id):
+        return os.path.join(self.path, seed_id)
+
+    def add(self, image, fs_type, fs_size, n_files, max_file_size, fs_log=None):
+        with self.lock:
+            return self._add(image, fs_type, fs_size, n_files, max_file_size, fs_log)
+
+    def _add(self, image, fs_type, fs_size, n_files, max_file_size, fs_log):
+        seed_id = get_image_id(image)
+        os.replace(image, self.get_seed_path(seed_id))
+        if seed_id not in self.index:
+            self.index[seed_id] = {
+                "key": get_corpus_key(fs_type, fs_size, n_files, max_file_size),
+                "fs_type": fs_type,
+                "fs_size": fs_size,
+                "n_files": n_files,
+                "max_file_size": max_file_size,
+                "seed": get_generation_seed(fs_log),
+                "fs_log": fs_log,
+                "uses": 0,
+                "added": time.time(),
+            }
+        self._evict()
+        self._save_index()
+        return seed_id
+
+    def available(self, key):
+        with self.lock:
+            return [k for k, v in self.index.items() if v["key"] == key and v["uses"] < self.mutations_per_seed]
+
+    def pick(self, key):
+        with self.lock:
+            candidates = self.available(key)
+            if not candidates:
+                return None, None
+            seed_id = random.choice(candidates)
+            entry = self.index[seed_id]
+            entry["uses"] += 1
+            entry["last_used"] = time.time()
+            self.pinned[seed_id] += 1
+            self._save_index()
+            return seed_id, entry
+
+    def release(self, seed_id):
+        with self.lock:
+            self.pinned[seed_id] -= 1
+            if self.pinned[seed_id] <= 0:
+                del self.pinned[seed_id]
+
+    def _remove(self, seed_id):
+        logging.debug("Evicting seed {} from corpus".format(seed_id))
+        try:
+            os.remove(self.get_seed_path(seed_id))
+        except FileNotFoundError:
+            pass
+        del self.index[seed_id]
+
+    def _evict(self):
+        # exhausted seeds go first, afterwards the ones with the least remaining mutation budget
+        unpinned = [k for k in self.index if k not in self.pinned]
+        for seed_id in [k for k in unpinned if self.index[k]["uses"] >= self.mutations_per_seed]:
+            self._remove(seed_id)
+            unpinned.remove(seed_id)
+        while len(self.index) > self.max_seeds and unpinned:
+            seed_id = max(unpinned, key=lambda k: (self.index[k]["uses"], -self.index[k]["added"]))
+            self._remove(seed_id)
+            unpinned.remove(seed_id)
+
+    def retire_exhausted(self):
+        with self.lock:
+            self._evict()
+            self._save_index()
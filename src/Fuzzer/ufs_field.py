@@ -0,0 +1,195 @@
+import collections
+import logging
+import random
+import re
+from ctypes import c_char, sizeof
+
+from delta import get_image_id
+from file_system_magic.fs_util import get_mutated_fs_path, set_mime
+from file_system_magic.ufs_superblock_parser import UFS, UFS_CG, UFS_SB
+from metadata import MetaMutation
+from mutation_buffer import MutationBuffer
+
+# in-memory pointers and padding, the kernel never interprets them
+SKIPPED_FIELDS = re.compile(r"^\*|spare|_pad$|^cg_space$")
+DEFAULT_WEIGHT = 1
+# geometry and offsets, corrupting them reaches the allocation and lookup code instead of the magic check
+FIELD_WEIGHTS = {
+    "fs_sblkno": 4,
+    "fs_cblkno": 4,
+    "fs_iblkno": 4,
+    "fs_dblkno": 4,
+    "fs_ncg": 4,
+    "fs_bsize": 4,
+    "fs_fsize": 4,
+    "fs_frag": 4,
+    "fs_bmask": 3,
+    "fs_fmask": 3,
+    "fs_bshift": 4,
+    "fs_fshift": 4,
+    "fs_fragshift": 4,
+    "fs_fsbtodb": 4,
+    "fs_sbsize": 4,
+    "fs_nindir": 4,
+    "fs_inopb": 4,
+    "fs_cssize": 4,
+    "fs_cgsize": 4,
+    "fs_ipg": 4,
+    "fs_fpg": 4,
+    "fs_maxcontig": 3,
+    "fs_maxbpg": 3,
+    "fs_csaddr": 4,
+    "fs_size": 4,
+    "fs_dsize": 4,
+    "fs_maxbsize": 4,
+    "fs_contigsumsize": 3,
+    "fs_maxsymlinklen": 3,
+    "fs_maxfilesize": 3,
+    "fs_qbmask": 2,
+    "fs_qfmask": 2,
+    "fs_flags": 3,
+    "fs_old_inodefmt": 2,
+    "fs_sblockloc": 3,
+    "fs_magic": 0.1,
+    "fs_ckhash": 0.1,
+    "fs_metackhash": 2,
+    "cg_magic": 0.1,
+    "cg_cgx": 3,
+    "cg_ndblk": 3,
+    "cg_rotor": 3,
+    "cg_frotor": 3,
+    "cg_irotor": 3,
+    "cg_frsum": 3,
+    "cg_iusedoff": 4,
+    "cg_freeoff": 4,
+    "cg_nextfreeoff": 4,
+    "cg_clustersumoff": 4,
+    "cg_clusteroff": 4,
+    "cg_nclusterblks": 4,
+    "cg_niblk": 4,
+    "cg_initediblk": 4,
+    "cg_ckhash": 0.1,
+}
+PRIMARY_SB_SHARE = 0.5  # the rest goes to cylinder groups and backup superblocks
+MAX_CACHED_LOCATIONS = 64  # a few times the seed corpus size
+
+Field = collections.namedtuple("Field", ["name", "offset", "size", "count", "is_char", "weight"])
+
+_locations = collections.OrderedDict()  # (image id, fst) -> superblock and cylinder group offsets
+
+
+def get_field_layout(fields):
+    # offsets and widths of a packed ctypes field table
+    layout, offset = [], 0
+    for name, ctype in fields:
+        count = getattr(ctype, "_length_", 1)
+        elem = ctype._type_ if hasattr(ctype, "_length_") else ctype
+        weight = 0 if SKIPPED_FIELDS.search(name) else FIELD_WEIGHTS.get(name, DEFAULT_WEIGHT)
+        layout.append(Field(name, offset, sizeof(elem), count, elem is c_char, weight))
+        offset += sizeof(ctype)
+    return layout
+
+
+SB_LAYOUT = get_field_layout(UFS_SB)
+CG_LAYOUT = get_field_layout(UFS_CG)
+
+
+def get_ufs_locations(fs, fst):
+    # computed from the superblock geometry once per seed, no scan of the image
+    key = (get_image_id(fs), fst)
+    if key in _locations:
+        _locations.move_to_end(key)
+    else:
+        ufs = UFS(fs=fs, fst=fst)
+        _locations[key] = (ufs.find_all_superblocks(), ufs.find_all_cylinder_groups())
+        if len(_locations) > MAX_CACHED_LOCATIONS:
+            _locations.popitem(last=False)
+    sb_locs, cg_locs = _locations[key]
+    return list(sb_locs), list(cg_locs)
+
+
+def interesting_values(size, current, rnd):
+    # 0, -1, signed/unsigned extremes, powers of two and off-by-one around the current value
+    bits = size * 8
+    mask = (1 << bits) - 1
+    values = [
+        0,
+        1,
+        mask,
+        mask >> 1,
+        1 << (bits - 1),
+        (mask >> 1) + 2,
+        1 << rnd.randrange(bits),
+        (1 << rnd.randrange(bits)) - 1,
+        current + 1,
+        current - 1,
+        current << 1,
+        current >> 1,
+        current ^ (1 << rnd.randrange(bits)),
+    ]
+    return [v & mask for v in values]
+
+
+class UfsFieldMutation:
+    """
+    Structure-aware engine for UFS1/2, driven by the UFS_SB and UFS_CG field tables.
+    Each mutation picks a superblock or cylinder group, a field by weight (geometry and
+    offsets first, pointers and padding never) and writes an interesting value of the
+    field's width: 0, -1, min/max, powers of two or off-by-one of the current value.
+    nfields is the amount of fields corrupted per image. Non-UFS images fall back to MetaMutation.
+    """
+
+    def __init__(self, fs, nfields=1, mode="ufsfield"):
+        self.nfields = max(1, nfields)
+        self.fs = fs
+        self.mfs = None
+        self.delta = None
+        self.mime = None
+        self.mode = mode
+        self.mutated_fields = []
+        self.rnd = random.Random()
+        self.rnd.seed(random.getrandbits(1024))
+
+    def mutation(self):
+        self.mime = set_mime(self.fs)
+        if "ufs" not in str(self.mime):
+            logging.warning("ufs_field engine on a {} image, falling back to metadata mutation".format(self.mime))
+            engine = MetaMutation(self.fs, self.nfields, mode=self.mode)
+            self.mfs = engine.mutation()
+            self.delta = engine.delta
+            return self.mfs
+        sb_locs, cg_locs = get_ufs_locations(self.fs, self.mime)
+        self.mutated_fields = []
+        if not sb_locs:
+            # damaged seed, neither the geometry nor the fallback scan found a superblock
+            logging.warning("No UFS superblock found in {}, skipping the mutation".format(self.fs))
+            self.mfs, self.delta = None, None
+            return self.mfs
+        with MutationBuffer(self.fs, get_mutated_fs_path(self.fs, self.nfields, self.mode), materialize=False) as buf:
+            for _ in range(self.nfields):
+                loc, layout = self._pick_structure(sb_locs, cg_locs)
+                field = self.rnd.choices(layout, weights=[f.weight for f in layout])[0]
+                try:
+                    self._mutate_field(buf, loc, field)
+                except IndexError as e:
+                    logging.debug(e)  # structure cut off at the end of the image
+        self.mfs, self.delta = buf.mfs, buf.delta
+        return self.mfs
+
+    def _pick_structure(self, sb_locs, cg_locs):
+        others = [(loc, SB_LAYOUT) for loc in sb_locs[1:]] + [(loc, CG_LAYOUT) for loc in cg_locs]
+        if not others or self.rnd.random() < PRIMARY_SB_SHARE:
+            return sb_locs[0], SB_LAYOUT
+        return self.rnd.choice(others)
+
+    def _mutate_field(self, buf, loc, field):
+        idx = self.rnd.randrange(field.count)
+        offset = loc + field.offset + idx * field.size
+        if field.is_char:
+            value = bytes([self.rnd.choice([0, 0xFF, ord("/"), self.rnd.randrange(256)])])
+        else:
+            current = int.from_bytes(buf.read(offset, field.size), byteorder="little")
+            new = self.rnd.choice(interesting_values(field.size, current, self.rnd))
+            value = new.to_bytes(field.size, byteorder="little")
+        buf.write(offset, value)
+        self.mutated_fields.append("{}[{}]@{}".format(field.name, idx, hex(loc)))
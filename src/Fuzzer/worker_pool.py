@@ -0,0 +1,130 @@
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+import colorama as clr
+
+from pipeline import Pipeline
+from Manager.Manager import VmManager
+
+
+def ensure_clones(vm_name, n_clones, vm_user, vm_password):
+    # virt-clone needs the original VM shut off, so clones are created before anything is booted
+    vm = VmManager()
+    vm.setup(name=vm_name, vm_user=vm_user, vm_password=vm_password)
+    clones = ["{}_clone{}".format(vm_name, i) for i in range(n_clones)]
+    missing = [c for c in clones if c not in vm.get_installed_vm_names()]
+    if missing:
+        conn, dom = vm.get_domain_object()
+        if dom.isActive():
+            dom.shutdown()
+            for _ in range(60):
+                if not dom.isActive():
+                    break
+                time.sleep(1)
+            else:
+                dom.destroy()
+        conn.close()
+        for clone in missing:
+            print(clr.Fore.LIGHTYELLOW_EX + "[*] Cloning {} to {}".format(vm_name, clone) + clr.Fore.RESET)
+            vm.clone_vm(clone)
+    return clones
+
+
+class WorkerPool:
+    """
+    Drives several fuzzing VMs from one process.
+    The controller Fuzzer is the only one generating seeds and mutating them, its test cases land in
+    a shared queue. Every VM is driven by a worker Fuzzer with its own stager, so staging and execution
+    still overlap per VM. Idle workers pull the next test case themselves, which balances the load.
+    Seed corpus, guest seed cache layout and crash database are shared by all workers.
+    """
+
+    def __init__(self, controller, fuzz_vms, fs_maker_vm, stats_interval=5):
+        self.controller = controller
+        self.fs_maker_vm = fs_maker_vm
+        self.stats_interval = stats_interval
+        self.workers = [controller.make_worker(idx, vm) for idx, vm in enumerate(fuzz_vms)]
+        self.source = None
+        self.threads = []
+
+    def run(self):
+        controller = self.controller
+        controller.seed_corpus = controller.create_seed_corpus()
+        # the shared queue must never run synchronously, workers would mutate concurrently
+        self.source = Pipeline(
+            produce=lambda: controller.produce_test_case(self.fs_maker_vm),
+            stage=lambda tc: tc,
+            discard=controller.discard_test_case,
+            depth=max(controller.pipeline_depth, 1) * len(self.workers),
+        )
+        self.source.start()
+        for worker in self.workers:
+            worker.seed_corpus = controller.seed_corpus
+            thread = threading.Thread(
+                target=worker.fuzz, args=(worker.vm_object, self.fs_maker_vm, self.source), name=worker.name, daemon=True,
+            )
+            thread.start()
+            self.threads.append(thread)
+        signal.signal(signal.SIGINT, self.signal_handler)
+        while any(t.is_alive() for t in self.threads):
+            self._print_pool_statistics()
+            time.sleep(self.stats_interval)
+        self.source.stop()
+
+    def _print_pool_statistics(self):
+        os.system("clear")
+        controller = self.controller
+        print(
+            "Start date: {} | OS: {} | Mutation engine: {} | Filesystem: {} {}MB | Workers: {}".format(
+                str(controller.start)[:-4],
+                self.workers[0].host_os,
+                controller.mutation_engine,
+                controller.mfs_type,
+                controller.mfs_size,
+                len([t for t in self.threads if t.is_alive()]),
+            )
+        )
+        # the workers share one producer, its stages are shown once for the whole pool
+        print("Producer stages: {}".format(controller.format_producer_stages()))
+        for worker in self.workers:
+            print(
+                "{} @ {}: Iteration: {} | Avg. iteration time: {}s | # Crashes: {} | # New crashes: {} | "
+                "Successful mounts: {} | Last panic: {}\n    Checksum fixup: {}\n    Top stages: {}".format(
+                    worker.name,
+                    worker.vm_name,
+                    worker.iter,
+                    worker.avg_iter_time,
+                    worker.crashes,
+                    worker.ucrashes,
+                    worker.success_mounts,
+                    worker.last_panic,
+                    worker.format_fixup_stats(),
+                    worker.format_top_stages(),
+                )
+            )
+
+    def signal_handler(self, sig, frame):
+        print("Observed Ctrl+C! Exiting...")
+        for worker in self.workers:
+            if worker.lpath_mfs:
+                worker._save_stats()
+        logging.info("Saved stats of {} workers".format(len(self.workers)))
+        self.controller.get_crash_packer().shutdown()
+        sys.exit(1)
+
+
+def boot_pool_vms(vm_names, vm_user, vm_password):
+    vms = []
+    for vm_name in vm_names:
+        vm = VmManager()
+        vm.setup(vm_user=vm_user, vm_password=vm_password, name=vm_name)
+        vm.quick_boot(vm_name=vm_name)
+        # fresh clones carry no snapshot, the recovery paths need one to restore
+        if not vm.get_current_snapshot():
+            vm.create_snapshot_with_name("{}_base".format(vm_name))
+        vms.append(vm)
+    return vms
@@ -0,0 +1,165 @@
+import logging
+import socket
+import threading
+import time
+
+import libvirt
+
+VM_UP = "up"
+VM_DOWN = "down"
+
+
+class HealthMonitor:
+    """
+    In-process liveness tracking for a VmManager.
+    A probe looks at the libvirt domain state first (a shut off, crashed or paused domain is down
+    without touching the network). While the SSH transport of the VM is alive, its keepalive
+    vouches for the guest. Only without a transport, or after invalidate() (exec error, reset, ...),
+    a plain TCP connect to the SSH port decides, and never before the IP of the guest is known.
+    Results are cached for ttl seconds. While the VM is in use (start() until stop()) a background
+    poller keeps them fresh, so hot paths only read the cached state.
+    Subscribers are called with (event, vm_name) on every up/down transition.
+    """
+
+    def __init__(self, vm_object, ttl=2, poll_interval=1, connect_timeout=3):
+        self.vm_object = vm_object
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.connect_timeout = connect_timeout
+        self.state = None
+        self.checked_at = 0
+        self.verified = False  # the last state came from a port probe, the transport may vouch from here on
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.poller = None
+        self.stopped = threading.Event()
+        self.domain = None
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def start(self):
+        if self.poller and self.poller.is_alive():
+            return
+        # every poller gets its own stop event, a stopped one may still be sleeping
+        self.stopped = threading.Event()
+        self.poller = threading.Thread(
+            target=self._poll, args=(self.stopped,), name="health_{}".format(self.vm_object.name), daemon=True
+        )
+        self.poller.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.poller = None
+
+    def invalidate(self):
+        self.checked_at = 0
+        self.verified = False
+
+    def is_up(self):
+        if time.time() - self.checked_at > self.ttl:
+            self.probe()
+        return self.state == VM_UP
+
+    def _transport_alive(self):
+        # A failed keepalive tears down the paramiko transport, None without a session to judge from
+        rshell = self.vm_object.rshell
+        transport = rshell.get_transport() if rshell else None
+        return transport.is_active() if transport else None
+
+    def _domain_running(self):
+        try:
+            if not self.domain:
+                # the connection of the VmManager, the domain handle stays valid across restarts
+                self.domain = self.vm_object.get_libvirt_connection().lookupByName(self.vm_object.name)
+            state, _ = self.domain.state()
+            return state not in [
+                libvirt.VIR_DOMAIN_SHUTOFF,
+                libvirt.VIR_DOMAIN_CRASHED,
+                libvirt.VIR_DOMAIN_PAUSED,
+                libvirt.VIR_DOMAIN_SHUTDOWN,
+            ]
+        except libvirt.libvirtError as e:
+            # unknown domain or hypervisor hiccup, let the network probe decide
+            logging.debug("HealthMonitor libvirt query failed: {}".format(e))
+            self.domain = None
+            return True
+
+    def _port_open(self):
+        if self.vm_object.vm_ip is None:
+            return False  # not resolved yet, a connect to None would reach the host
+        try:
+            with socket.create_connection((self.vm_object.vm_ip, self.vm_object.port), timeout=self.connect_timeout):
+                return True
+        except (socket.timeout, OSError):
+            return False
+
+    def probe(self):
+        with self.lock:
+            if time.time() - self.checked_at <= self.ttl:
+                return self.state  # another thread probed while we waited
+            if not self._domain_running():
+                state, verified = VM_DOWN, False
+            elif self.verified and self._transport_alive():
+                state, verified = VM_UP, True
+            else:
+                state = VM_UP if self._port_open() else VM_DOWN
+                verified = state == VM_UP
+            previous, self.state, self.checked_at, self.verified = self.state, state, time.time(), verified
+        if previous is not None and previous != state:
+            self._publish(state)
+        return state
+
+    def _publish(self, state):
+        logging.debug("VM {} went {}".format(self.vm_object.name, state))
+        for callback in self.subscribers:
+            try:
+                callback(state, self.vm_object.name)
+            except Exception as e:
+                logging.error("Health event subscriber failed: {}".format(e))
+
+    def _poll(self, stopped):
+        while not stopped.wait(self.poll_interval):
+            if time.time() - self.checked_at > self.ttl:
+                self.probe()
+
+
+def ssh_banner_received(ip, port, timeout=2):
+    # sshd only sends its banner once the guest is far enough up to accept logins
+    try:
+        with socket.create_connection((ip, port), timeout=timeout) as s:
+            s.settimeout(timeout)
+            return s.recv(64).startswith(b"SSH-")
+    except (socket.timeout, OSError):
+        return False
+
+
+class ReadinessLatency:
+    """
+    Remembers how long a VM needed to become ready after a boot, reset, reboot, ...
+    The timeout for the next wait is derived from the slowest recent sample,
+    until enough samples exist the static default is used.
+    """
+
+    def __init__(self, default_timeout=120, min_timeout=30, history=20, min_samples=3, factor=2):
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.history = history
+        self.min_samples = min_samples
+        self.factor = factor
+        self.samples = {}
+
+    def record(self, reason, latency):
+        samples = self.samples.setdefault(reason, [])
+        samples.append(latency)
+        del samples[: -self.history]
+
+    def timeout(self, reason):
+        samples = self.samples.get(reason, [])
+        if len(samples) < self.min_samples:
+            return self.default_timeout
+        return max(self.min_timeout, round(max(samples) * self.factor))
+
+    def mean(self, reason):
+        samples = self.samples.get(reason, [])
+        return round(sum(samples) / len(samples), 2) if samples else None
@@ -8,6 +8,7 @@ import pathlib
 import socket
 import subprocess
 import sys
+import threading
 import time
 import zipfile
 from io import BytesIO
@@ -19,6 +20,9 @@ import paramiko
 import wget
 from PIL import Image, ImageFile
 
+from Manager.HealthMonitor import HealthMonitor, ReadinessLatency, ssh_banner_received
+from Manager.RetryPolicy import CircuitBreaker, RetryPolicy
+from Manager.ShellSession import BatchInterrupted, ShellSession
 from SnapshotTemplate import snapshot
 
 
@@ -121,13 +125,20 @@ class VmManager:
         self.copy_files_to = None  # path can set for copies between host<->guest if path shall stay static
         self.vm_user = None  # saved username for booted VM
         self.vm_password = None  # saved passwd for booted VM
-        self.vm_ip = "127.0.0.1"  # saved IPv4 for booted VM
+        self.vm_ip = None  # saved IPv4 for booted VM, unknown until libvirt reports a lease or interface address
         self.vm_memory = 4096  # RAM of booted VM
         self.vm_cpus = 2  # Number of cores of VM
         self.vm_hdd = 10  # VM HDD size in GB
         self.rshell = None  # remote shell object for host<-> operations
+        self.persistent_session = True  # multiplex commands over one long-lived guest shell instead of one channel each
+        self.session = None  # ShellSession bound to self.rshell
+        self.ssh_lock = threading.RLock()  # the stager thread and the main thread share rshell and session
+        self.batch_latencies = []  # per command latencies of the last exec_batch
+        self.health = HealthMonitor(self)  # cached liveness state, replaces forking nc on every check
+        self.libvirt_conn = None  # shared by the health monitor, see get_libvirt_connection
+        self.readiness = ReadinessLatency()  # observed boot/reset latencies, drives the readiness timeouts
         self.curr_crash_dir = None  # is set to path new directory path for current crash
-        self.conn_err_ctr = 0  # counter for connerr that might be a hint towards a broken VM
+        self.breaker = CircuitBreaker()  # shared by all retry paths, opens once the VM keeps failing
 
     def __exit__(self):
         return 1
@@ -159,31 +170,125 @@ class VmManager:
             logging.debug("Reusing stored vm credentials.")
 
     def invoke_remote_ssh_shell(self):
-        if not self.silent_vm_state():
-            self.reset_vm()
-        ssh_conn = self._get_basic_ssh_conn()
-        ssh_conn.get_transport().set_keepalive(200)
-        ssh_conn.get_transport().open_session()
-        ssh_conn.invoke_shell()
-        self.rshell = ssh_conn
-        return ssh_conn
-
-    def _exec(self, cmd, timeout=10):
+        with self.ssh_lock:
+            if not self.silent_vm_state():
+                self.reset_vm()
+            ssh_conn = self._get_basic_ssh_conn()
+            # the health monitor trusts a live transport, the keepalive is what tears a dead one down
+            ssh_conn.get_transport().set_keepalive(15)
+            ssh_conn.get_transport().open_session()
+            ssh_conn.invoke_shell()
+            self.rshell = ssh_conn
+            self.health.start()  # the VM is in use from here on
+            return ssh_conn
+
+    def close_rshell(self):
+        # drops the SSH connection and stops health polling until the next invoke_remote_ssh_shell
+        with self.ssh_lock:
+            self.close_session()
+            self.health.stop()
+            if self.rshell:
+                try:
+                    self.rshell.close()
+                except (paramiko.ssh_exception.SSHException, socket.error):
+                    pass
+            self.rshell = None
+            self.health.invalidate()
+
+    def _get_session(self):
         if not self.rshell:
             self.invoke_remote_ssh_shell()
+        if not self.session or self.session.ssh_conn is not self.rshell:
+            self.close_session()
+            self.session = ShellSession(self.rshell).open()
+        return self.session
+
+    def close_session(self):
+        with self.ssh_lock:
+            if self.session:
+                self.session.close()
+            self.session = None
+
+    @staticmethod
+    def _decode_stdout(raw):
         try:
-            # get_pty=True combines stdout/stderr
-            _, stdout, _ = self.rshell.exec_command(cmd, get_pty=True, timeout=timeout)
-            stdout_decoded = stdout.read().decode().strip()
-            if stdout_decoded != "":
-                return stdout_decoded
-            else:
-                return None
-        except (paramiko.ssh_exception.SSHException, socket.timeout, paramiko.ssh_exception.NoValidConnectionsError,) as e:
-            logging.debug("_EXEC ERROR: {}".format(e))
-            return 2
+            stdout_decoded = raw.decode().strip()
         except UnicodeDecodeError:
             return 1
+        if stdout_decoded != "":
+            return stdout_decoded
+        else:
+            return None
+
+    def exec_batch(self, cmds, timeout=10):
+        """
+        Runs all cmds in a single round trip over the persistent session.
+        Returns one (stdout, exit_code) tuple per command with the same stdout semantics as _exec.
+        Commands the guest never answered, e.g. because it panicked, are reported as (2, None),
+        the commands answered before keep their results.
+        The latency of every answered command ends up in self.batch_latencies.
+        """
+        with self.ssh_lock:
+            results = []
+            self.batch_latencies = []
+            try:
+                if not self.persistent_session:
+                    for cmd in cmds:
+                        start = time.time()
+                        results.append(self._exec_with_status(cmd, timeout))
+                        self.batch_latencies.append(time.time() - start)
+                    return results
+                session = self._get_session()
+                for raw, exit_code in session.run_batch(cmds, timeout=timeout):
+                    results.append((self._decode_stdout(raw), exit_code))
+                self.batch_latencies = session.latencies
+            except BatchInterrupted as e:
+                # these commands did run on the guest, rerunning or blaming them would corrupt the exec log
+                results = [(self._decode_stdout(raw), exit_code) for raw, exit_code in e.results]
+                self.batch_latencies = e.latencies
+                self._drop_session(e.error)
+            except (
+                paramiko.ssh_exception.SSHException,
+                paramiko.ssh_exception.NoValidConnectionsError,
+                socket.timeout,
+                socket.error,
+                EOFError,
+            ) as e:
+                self._drop_session(e)
+            return results + [(2, None)] * (len(cmds) - len(results))
+
+    def _drop_session(self, error):
+        logging.debug("EXEC_BATCH ERROR: {}".format(error))
+        self.close_session()
+        self.health.invalidate()
+
+    def _exec_with_status(self, cmd, timeout=10):
+        if not self.rshell:
+            self.invoke_remote_ssh_shell()
+        _, stdout, _ = self.rshell.exec_command(cmd, get_pty=True, timeout=timeout)
+        stdout_decoded = self._decode_stdout(stdout.read())
+        return stdout_decoded, stdout.channel.recv_exit_status()
+
+    def _exec(self, cmd, timeout=10):
+        if self.persistent_session:
+            return self.exec_batch([cmd], timeout=timeout)[0][0]
+        with self.ssh_lock:
+            if not self.rshell:
+                self.invoke_remote_ssh_shell()
+            try:
+                # get_pty=True combines stdout/stderr
+                _, stdout, _ = self.rshell.exec_command(cmd, get_pty=True, timeout=timeout)
+                stdout_decoded = stdout.read().decode().strip()
+                if stdout_decoded != "":
+                    return stdout_decoded
+                else:
+                    return None
+            except (paramiko.ssh_exception.SSHException, socket.timeout, paramiko.ssh_exception.NoValidConnectionsError,) as e:
+                logging.debug("_EXEC ERROR: {}".format(e))
+                self.health.invalidate()
+                return 2
+            except UnicodeDecodeError:
+                return 1
 
     def exec_cmd_quiet(self, cmd):
         stdout = self._exec(cmd)
@@ -201,6 +306,28 @@ class VmManager:
         else:
             return True
 
+    def exec_cmd_with_input(self, cmd, data, timeout=30):
+        # No PTY here, it would mangle binary data written to stdin
+        with self.ssh_lock:
+            if not self.rshell:
+                self.invoke_remote_ssh_shell()
+            try:
+                stdin, stdout, _ = self.rshell.exec_command("{} 2>&1".format(cmd), timeout=timeout)
+                stdin.write(data)
+                stdin.flush()
+                stdin.channel.shutdown_write()
+                stdout_decoded = stdout.read().decode().strip()
+                if stdout_decoded != "":
+                    return stdout_decoded
+                else:
+                    return None
+            except (paramiko.ssh_exception.SSHException, socket.timeout, paramiko.ssh_exception.NoValidConnectionsError,) as e:
+                logging.debug("_EXEC_WITH_INPUT ERROR: {}".format(e))
+                self.health.invalidate()
+                return 2
+            except UnicodeDecodeError:
+                return 1
+
     def interactive_shell(self):
         print(clr.Fore.RED + 'Exit remote shell via "exit"' + clr.Fore.RESET)
         while True:
@@ -232,19 +359,32 @@ class VmManager:
             list_of_files_to_copy[:] = [os.path.join(save_files_at, x) for x in list_of_files_to_copy]
         return list_of_files_to_copy
 
-    def _get_files(self, list_of_files_to_copy, save_files_at):
-        try:
+    def _transfer_files(self, list_of_files_to_copy, save_files_at, get):
+        with self.ssh_lock:
             if not self.rshell:
                 self.invoke_remote_ssh_shell()
             ftp_client = self.rshell.open_sftp()
-            for f in list_of_files_to_copy:
-                ftp_client.get(f, os.path.join(save_files_at, get_basename(f)))
-            ftp_client.close()
-        except paramiko.ssh_exception.SSHException as e:
-            logging.error("SSHException during get files: {}\nResetting and trying to invoke new rshell".format(e))
+            try:
+                for f in list_of_files_to_copy:
+                    if get:
+                        ftp_client.get(f, os.path.join(save_files_at, get_basename(f)))
+                    else:
+                        ftp_client.put(f, os.path.join(save_files_at, get_basename(f)))
+            finally:
+                # a failed attempt must not leave its channel open on the connection the retry reuses
+                ftp_client.close()
+
+    def _reset_and_new_rshell(self, e=None):
+        with self.ssh_lock:
             self.reset_vm()
             self.new_rshell()
-            self._get_files(list_of_files_to_copy, save_files_at)
+
+    def _get_files(self, list_of_files_to_copy, save_files_at):
+        RetryPolicy("Get files from {}".format(self.name), retry_on=(paramiko.ssh_exception.SSHException,)).run(
+            lambda: self._transfer_files(list_of_files_to_copy, save_files_at, get=True),
+            recover=self._reset_and_new_rshell,
+            breaker=self.breaker,
+        )
 
     def cp_to_host(self, save_files_at, get_files_from, list_of_files_to_copy, zipped=False):
         sanitized_list_of_files_to_copy = []
@@ -278,17 +418,11 @@ class VmManager:
             return None
 
     def _send_files(self, list_of_files_to_copy, save_files_at):
-        try:
-            if not self.rshell:
-                self.invoke_remote_ssh_shell()
-            ftp_client = self.rshell.open_sftp()
-            for f in list_of_files_to_copy:
-                ftp_client.put(f, os.path.join(save_files_at, get_basename(f)))
-            ftp_client.close()
-        except paramiko.ssh_exception.SSHException as e:
-            logging.error("SSHException during send files: {}\n Trying to invoke new rshell".format(e))
-            self.new_rshell()
-            self._send_files(list_of_files_to_copy, save_files_at)
+        RetryPolicy("Send files to {}".format(self.name), retry_on=(paramiko.ssh_exception.SSHException,)).run(
+            lambda: self._transfer_files(list_of_files_to_copy, save_files_at, get=False),
+            recover=lambda e: self.new_rshell(),
+            breaker=self.breaker,
+        )
 
     def cp_to_guest(self, get_files_from, list_of_files_to_copy, save_files_at, zipped=False):
         try:
@@ -358,7 +492,8 @@ class VmManager:
             latest_core_files = self._get_latest_core()
             logging.debug("LATEST CORES: {}".format(latest_core_files))
             if len(latest_core_files) == 2:
-                _timestamp_dir = os.path.join("crash_dumps", self._get_timestamp())
+                # the VM name keeps crash dirs of VMs crashing in the same second apart
+                _timestamp_dir = os.path.join("crash_dumps", "{}_{}".format(self._get_timestamp(), self.name))
                 self.curr_crash_dir = os.path.join(os.getcwd(), _timestamp_dir)
                 create_directory(self.curr_crash_dir)
                 for list_entry in latest_core_files:
@@ -393,61 +528,54 @@ class VmManager:
             logging.info("No core files found!")
 
     def check_vm_state(self):
-        try:
-            if not int(
-                subprocess.check_output(
-                    "timeout 3 nc -z {} 22; echo $?".format(self.vm_ip), shell=True, encoding="utf-8",
-                ).strip()
-            ):
-                print(clr.Fore.GREEN + "[+] VM status: {}".format("OK" + clr.Fore.RESET))
-                return 1
-            else:
-                print(clr.Fore.RED + "[!] VM status: {}".format("Not Responding" + clr.Fore.RESET))
-                return 0
-        except subprocess.TimeoutExpired:
+        if self.health.is_up():
+            print(clr.Fore.GREEN + "[+] VM status: {}".format("OK" + clr.Fore.RESET))
+            return 1
+        else:
             print(clr.Fore.RED + "[!] VM status: {}".format("Not Responding" + clr.Fore.RESET))
             return 0
 
     def silent_vm_state(self):
-        if not int(
-            subprocess.check_output("timeout 3 nc -z {} 22; echo $?".format(self.vm_ip), shell=True, encoding="utf-8",).strip()
-        ):
-            # ret code was 0, VM reachable
+        if self.health.is_up():
+            # VM reachable
             return 1
         else:
             return 0
 
     def crash_handler(self):
         print(clr.Fore.LIGHTYELLOW_EX + "[*] Checking for crash dump..!" + clr.Fore.RESET)
+        policy = RetryPolicy(
+            "Crash handler of {}".format(self.name),
+            max_attempts=2,
+            retry_on=(paramiko.ssh_exception.NoValidConnectionsError,),
+        )
         try:
-            self.reset_vm()
-            return self._return_core_path_if_present()
-        except paramiko.ssh_exception.NoValidConnectionsError as e:
-            logging.error("NoValidConnErr in Manager crash handler: {}\n self.cerr is {}".format(e, self.conn_err_ctr))
-            self.conn_err_ctr += 1
-            if self.conn_err_ctr == 2:
-                self.conn_err_ctr = 0
-                # Probably stuck in a boot loop at this point because of a broken system
-                # ext2: fsck /dev/ad0p2: Segmentation fault
-                # Unknown error1: help!
-                self.restore_snapshot(self.get_current_snapshot())
-                self.new_rshell()
-            else:
-                self.crash_handler()
+            return policy.run(self._reset_and_fetch_core, breaker=self.breaker)
+        except paramiko.ssh_exception.NoValidConnectionsError:
+            # Probably stuck in a boot loop at this point because of a broken system
+            # ext2: fsck /dev/ad0p2: Segmentation fault
+            # Unknown error1: help!
+            self.restore_snapshot(self.get_current_snapshot())
+            self.new_rshell()
+            return None
+
+    def _reset_and_fetch_core(self):
+        self.reset_vm()
+        return self._return_core_path_if_present()
 
     def _return_core_path_if_present(self):
         self.new_rshell()
         if self.fetch_latest_core_file():
             print(clr.Fore.LIGHTYELLOW_EX + "\t[*] Found core file" + clr.Fore.RESET)
-            self.conn_err_ctr = 0
             return self.curr_crash_dir
         else:
-            self.conn_err_ctr = 0
             return None
 
     def new_rshell(self):
-        self.rshell = None
-        self.invoke_remote_ssh_shell()
+        # retry recovery runs on the stager thread too, nobody may use the connection in between
+        with self.ssh_lock:
+            self.close_rshell()
+            self.invoke_remote_ssh_shell()
 
     ######################################################################################################
     #   LIBVIRT VM OPERATIONS                                                                            #
@@ -462,13 +590,60 @@ class VmManager:
             logging.error("QEMU and/or libvirt not properly installed!")
             sys.exit(1)
 
-    def _boot_sleep(self, sleep_timer_in_seconds):
+    def _refresh_ip_from_domain(self, dom):
+        # a freshly booted guest may have picked up a new DHCP lease, returns whether an address is known
+        for source in [libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_LEASE, libvirt.VIR_DOMAIN_INTERFACE_ADDRESSES_SRC_ARP]:
+            try:
+                for iface in (dom.interfaceAddresses(source) or {}).values():
+                    for addr in iface.get("addrs") or []:
+                        if addr["type"] == libvirt.VIR_IP_ADDR_TYPE_IPV4:
+                            self.vm_ip = addr["addr"]
+                            return True
+            except libvirt.libvirtError:
+                pass
+        return self.vm_ip is not None
+
+    def _wait_until_down(self, dom=None, timeout=60):
+        if dom:
+            self._refresh_ip_from_domain(dom)
+        if self.vm_ip is None:
+            return  # nothing to probe, the guest never had an address
+        start = time.time()
+        while time.time() - start < timeout and ssh_banner_received(self.vm_ip, self.port):
+            time.sleep(0.5)
+
+    def wait_until_ready(self, reason, dom=None, wait_for_down=False):
+        """
+        Probes the SSH port with exponential backoff until sshd sends its banner.
+        The port is only probed once the IP of the guest is known, anything answering before
+        would be the host itself and would poison the readiness samples.
+        The timeout adapts to the latencies previously observed for the same reason (boot, reset, ...).
+        Returns the readiness latency in seconds or None if the VM did not come up in time.
+        """
+        if wait_for_down:
+            # a graceful reboot keeps sshd answering for a while
+            self._wait_until_down(dom)
+        timeout = self.readiness.timeout(reason)
+        start = time.time()
+        delay = 0.25
         sys.stdout.write(clr.Fore.LIGHTYELLOW_EX + "\t[*] Please stand by." + clr.Fore.RESET)
-        for i in range(sleep_timer_in_seconds):
+        while time.time() - start < timeout:
+            if dom:
+                self._refresh_ip_from_domain(dom)
+            if self.vm_ip is not None and ssh_banner_received(self.vm_ip, self.port):
+                latency = round(time.time() - start, 2)
+                self.readiness.record(reason, latency)
+                self.health.invalidate()
+                sys.stdout.write("\n")
+                logging.debug("{} ready after {}s ({})".format(self.name, latency, reason))
+                return latency
             sys.stdout.write(clr.Fore.LIGHTYELLOW_EX + "." + clr.Fore.RESET)
             sys.stdout.flush()
-            time.sleep(1)
-        sys.stdout.write("\033[F")  # back to previous line
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
+        sys.stdout.write("\n")
+        self.health.invalidate()
+        return None
 
     @staticmethod
     def get_open_libvirt_connection():
@@ -479,6 +654,12 @@ class VmManager:
         else:
             return conn
 
+    def get_libvirt_connection(self):
+        # long-lived connection for frequent queries (health polling), reopened only once it died
+        if not self.libvirt_conn or not self.libvirt_conn.isAlive():
+            self.libvirt_conn = self.get_open_libvirt_connection()
+        return self.libvirt_conn
+
     def get_domain_object(self):
         conn = self.get_open_libvirt_connection()
         dom = conn.lookupByName(self.name)
@@ -509,26 +690,29 @@ class VmManager:
         conn.close()
 
     def get_ip_of_vm(self):
+        RetryPolicy("Fetch IPv4 of {}".format(self.name), max_attempts=10, retry_on=(ValueError,)).run(
+            self._fetch_ip_of_vm, recover=self._recover_ip_of_vm, breaker=self.breaker
+        )
+
+    def _fetch_ip_of_vm(self):
         # TODO: Fix by utilizing libvirts python API
         iface = subprocess.check_output("virsh domifaddr {}".format(self.name).split(), encoding="utf-8")
-        ipv4 = iface.split()[-1].split("/")[0].strip()
-        try:
-            if ipaddress.ip_address(ipv4):
-                self.vm_ip = ipv4
-        except ValueError as e:
-            logging.error("[!] Failed to fetch an IPv4 address of {}".format(self.name))
-            logging.error("Expected: xxy.xxy.xxy.xyz")
-            logging.error("Got : {}".format(e))
-            logging.error("[*] Trying to restore from snapshot")
-            cur_snap = self.get_current_snapshot()
-            if cur_snap:
-                self.restore_snapshot(cur_snap)
-                self.reset_vm()
-                self.quick_boot(self.name)
-            else:
-                logging.error("[!] No snapshot found. Trying to reset VM instead")
-                self.reset_vm()
-            self.get_ip_of_vm()
+        ipv4 = iface.split()[-1].split("/")[0].strip() if iface.split() else ""
+        self.vm_ip = str(ipaddress.ip_address(ipv4))
+
+    def _recover_ip_of_vm(self, e):
+        logging.error("[!] Failed to fetch an IPv4 address of {}".format(self.name))
+        logging.error("Expected: xxy.xxy.xxy.xyz")
+        logging.error("Got : {}".format(e))
+        logging.error("[*] Trying to restore from snapshot")
+        cur_snap = self.get_current_snapshot()
+        if cur_snap:
+            # restore_snapshot boots the domain itself, quick_boot would fetch the IP again from in here
+            self.restore_snapshot(cur_snap)
+            self.reset_vm()
+        else:
+            logging.error("[!] No snapshot found. Trying to reset VM instead")
+            self.reset_vm()
 
     def quick_boot(self, vm_name):
         try:
@@ -537,8 +721,8 @@ class VmManager:
             self.get_vm_credentials()
             if not dom.isActive():
                 dom.create()
-                # needs around 60 seconds until booting seq started network ifaces
-                self._boot_sleep(60)
+                self.health.invalidate()
+                self.wait_until_ready("boot", dom)
                 self.get_ip_of_vm()
                 print("\n[+] VM started @ {}!".format(self.vm_ip))
             else:
@@ -558,7 +742,8 @@ class VmManager:
                 self.get_ip_of_vm()
             else:
                 dom.create()
-                self._boot_sleep(60)
+                self.health.invalidate()
+                self.wait_until_ready("boot", dom)
                 self.get_ip_of_vm()
                 print("[+] VM started @ {}!".format(self.vm_ip))
             conn.close()
@@ -567,19 +752,24 @@ class VmManager:
             sys.exit(1)
 
     def shutdown_vm(self):
+        self.close_rshell()
         conn, dom = self.get_domain_object()
         dom.shutdown()
+        self.health.invalidate()
         conn.close()
 
     def suspend_vm(self):
+        self.close_rshell()
         conn, dom = self.get_domain_object()
         dom.suspend()
+        self.health.invalidate()
         conn.close()
 
     def resume_vm(self):
         conn, dom = self.get_domain_object()
-        self._boot_sleep(20)
         dom.resume()
+        self.health.invalidate()
+        self.wait_until_ready("resume", dom)
         conn.close()
 
     def reset_vm(self):
@@ -587,33 +777,25 @@ class VmManager:
         # hardware sees the RST line set and re-initializes internal state
         conn, dom = self.get_domain_object()
         dom.reset()
-        self._boot_sleep(40)
-        timer = 40
-        while True:
-            if timer > 120:
-                logging.error("\nCould not fully boot in {} seconds. Resetting VM again!".format(timer))
-                self.restore_snapshot(self.get_current_snapshot())
-                break
-            elif not self.silent_vm_state():
-                sys.stdout.write(".....")
-                sys.stdout.flush()
-                time.sleep(5)
-                timer += 5
-            else:
-                break
-        print("\n")
+        self.health.invalidate()
+        if not self.wait_until_ready("reset", dom):
+            logging.error("Could not fully boot in {} seconds. Resetting VM again!".format(self.readiness.timeout("reset")))
+            self.restore_snapshot(self.get_current_snapshot())
         conn.close()
 
     def reboot_vm(self):
         # The hypervisor will choose the method of shutdown it considers best
         conn, dom = self.get_domain_object()
         dom.reboot()
-        self._boot_sleep(60)
+        self.health.invalidate()
+        self.wait_until_ready("reboot", dom, wait_for_down=True)
         conn.close()
 
     def force_stop_vm(self):
+        self.close_rshell()
         conn, dom = self.get_domain_object()
         dom.destroy()
+        self.health.invalidate()
         conn.close()
 
     def delete_vm(self, vm_name):
@@ -636,6 +818,12 @@ class VmManager:
         dom.rename(new_name)
         conn.close()
 
+    def get_installed_vm_names(self):
+        conn = self.get_open_libvirt_connection()
+        names = [h.name() for h in conn.listAllDomains(0)]
+        conn.close()
+        return names
+
     def clone_vm(self, clone_name):
         # TODO: Fix by utilizing libvirts python API
         conn, dom = self.get_domain_object()
@@ -723,16 +911,31 @@ class VmManager:
         try:
             snap = dom.snapshotLookupByName(snap_name)
             dom.revertToSnapshot(snap)
+            self.health.invalidate()
             self.get_vm_credentials()
             if not dom.isActive():
                 dom.create()
-                # needs around 60 seconds until booting seq started network ifaces
-                self._boot_sleep(60)
+                self.health.invalidate()
+                self.wait_until_ready("restore", dom)
             conn.close()
             logging.warning("Successfully reset {} to snapshot: {}, VM status: {}".format(dom.name(), snap_name, dom.state()))
         except libvirt.libvirtError:
             logging.error("Failed to reset {} to snapshot: {}".format(dom.name(), snap_name))
 
+    def revert_to_running_snapshot(self, snap_name):
+        # A running-state snapshot resumes the guest right away, there is no boot to wait for
+        conn, dom = self.get_domain_object()
+        try:
+            dom.revertToSnapshot(dom.snapshotLookupByName(snap_name), libvirt.VIR_DOMAIN_SNAPSHOT_REVERT_RUNNING)
+            self.health.invalidate()
+            self.new_rshell()
+            return True
+        except libvirt.libvirtError as e:
+            logging.error("Failed to revert {} to snapshot {}: {}".format(self.name, snap_name, e))
+            return False
+        finally:
+            conn.close()
+
     def get_current_snapshot(self):
         conn, dom = self.get_domain_object()
         try:
@@ -879,6 +1082,7 @@ class QEMU(VmManager):
         self.qemu_process = None
         self.vm_memory = memory
         self.ip = ip
+        self.vm_ip = ip  # user networking forwards the guest's sshd to this host address
         self.path_to_iso_or_qcow = path_to_hdd
 
     def qemu_boot_qcow(self):
@@ -906,8 +1110,8 @@ class QEMU(VmManager):
             active_machine = subprocess.Popen(qemu_cmd.split(), stdout=subprocess.PIPE, preexec_fn=os.setsid)
             self.qemu_process = active_machine
             if self.qemu_process.poll() is None:
-                print("[*] Sleeping for 60s to wait for boot...")
-                self._boot_sleep(60)
+                print("[*] Waiting for boot...")
+                self.wait_until_ready("boot")
             else:
                 sys.exit(1)
             return active_machine
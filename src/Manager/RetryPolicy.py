@@ -0,0 +1,103 @@
+import logging
+import random
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff and jitter, replaces the self-recursive retry paths.
+    fn is called up to max_attempts times, recover(exception) runs between two attempts
+    (e.g. reset the VM and open a new shell). Once the attempts are used up the last
+    exception is raised again, so callers keep their existing error handling.
+    """
+
+    def __init__(self, name, max_attempts=5, base_delay=1, max_delay=60, factor=2, jitter=0.1, retry_on=(Exception,)):
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.retry_on = retry_on
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * self.factor ** (attempt - 1))
+        return delay + random.uniform(0, delay * self.jitter)
+
+    def run(self, fn, recover=None, breaker=None):
+        for attempt in range(1, self.max_attempts + 1):
+            if breaker:
+                waited = breaker.wait()
+                if waited:
+                    logging.warning("{}: circuit was open, waited {:.0f}s".format(self.name, waited))
+            try:
+                result = fn()
+            except self.retry_on as e:
+                if breaker and breaker.failure():
+                    logging.error("{}: circuit opened after {} failures in a row".format(self.name, breaker.failures))
+                if attempt == self.max_attempts:
+                    logging.error("{} failed {} times, giving up: {}".format(self.name, attempt, e))
+                    raise
+                logging.warning("{} failed ({}/{}): {}".format(self.name, attempt, self.max_attempts, e))
+                time.sleep(self.delay(attempt))
+                if recover:
+                    recover(e)
+            else:
+                if breaker:
+                    breaker.success()
+                return result
+
+
+class CircuitBreaker:
+    """
+    Stops a VM from being hammered with recovery attempts while it is broken.
+    closed: calls pass, consecutive failures are counted
+    open: failure_threshold failures in a row, callers wait until reset_timeout has passed
+    half_open: one trial call, success closes the breaker, failure opens it again
+    Waiting instead of failing is on purpose, a fuzzer has nothing else to do with a dead VM.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        # Returns the seconds spent waiting for an open circuit
+        with self.lock:
+            if self.state != OPEN:
+                return 0
+            remaining = max(0, self.opened_at + self.reset_timeout - time.time())
+        time.sleep(remaining)
+        with self.lock:
+            if self.state == OPEN:
+                self.state = HALF_OPEN
+        return remaining
+
+    def success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        # Returns True if this failure opened the circuit
+        with self.lock:
+            self.failures += 1
+            if self.state == OPEN or self.state == CLOSED and self.failures < self.failure_threshold:
+                return False
+            self.state = OPEN
+            self.opened_at = time.time()
+            self.trips += 1
+            return True
+
+    def is_open(self):
+        return self.state == OPEN
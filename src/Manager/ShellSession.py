@@ -0,0 +1,118 @@
+import socket
+import time
+import uuid
+
+import paramiko
+
+
+class BatchInterrupted(Exception):
+    """
+    The guest stopped answering in the middle of a batch.
+    results and latencies hold the commands that completed before, error is the cause.
+    """
+
+    def __init__(self, results, latencies, error):
+        super().__init__(str(error))
+        self.results = results
+        self.latencies = latencies
+        self.error = error
+
+
+class ShellSession:
+    """
+    Keeps a single /bin/sh process open on the guest and multiplexes commands over its stdin.
+    Every command is framed by a start and an end marker, the end marker carries the exit code:
+        <token> <id> BEGIN
+        ... output (stdout + stderr) ...
+        <token> <id> END <exit code>
+    Commands run in a subshell so a "cd" or "exit" in one of them cannot alter the session itself.
+    A whole batch of commands is written at once and answered in a single round trip.
+    """
+
+    def __init__(self, ssh_conn, timeout=10):
+        self.ssh_conn = ssh_conn
+        self.timeout = timeout
+        self.token = "__FSFZ_{}__".format(uuid.uuid4().hex)
+        self.channel = None
+        self.buffer = b""
+        self.cmd_id = 0
+        self.latencies = []  # seconds between two answers of the last batch, i.e. per command
+
+    def open(self):
+        self.channel = self.ssh_conn.get_transport().open_session()
+        # No PTY, the terminal would echo every framed command back
+        self.channel.exec_command("/bin/sh")
+        self.buffer = b""
+        return self
+
+    def is_alive(self):
+        return self.channel is not None and not self.channel.closed and not self.channel.exit_status_ready()
+
+    def close(self):
+        if self.channel:
+            try:
+                self.channel.close()
+            except (paramiko.ssh_exception.SSHException, socket.error):
+                pass
+        self.channel = None
+        self.buffer = b""
+
+    def _frame(self, cmd, cmd_id):
+        return "printf '%s %s BEGIN\\n' {token} {id}; ( {cmd}\n) </dev/null 2>&1; printf '\\n%s %s END %s\\n' {token} {id} $?\n".format(
+            token=self.token, id=cmd_id, cmd=cmd
+        )
+
+    def _read_until(self, marker, deadline):
+        while marker not in self.buffer:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise socket.timeout("no response from guest shell")
+            self.channel.settimeout(remaining)
+            data = self.channel.recv(1 << 16)
+            if not data:
+                raise EOFError("guest shell closed")
+            self.buffer += data
+        head, _, self.buffer = self.buffer.partition(marker)
+        return head
+
+    def _read_result(self, cmd_id, deadline):
+        begin = "{} {} BEGIN\n".format(self.token, cmd_id).encode()
+        end = "\n{} {} END ".format(self.token, cmd_id).encode()
+        self._read_until(begin, deadline)
+        output = self._read_until(end, deadline)
+        exit_code = self._read_until(b"\n", deadline)
+        return output, int(exit_code.strip() or -1)
+
+    def run_batch(self, cmds, timeout=None):
+        """
+        Returns a list of (stdout, exit_code) tuples, one per command.
+        Raises BatchInterrupted once the guest stops answering, it carries the results of the
+        commands that completed so callers know which commands never returned.
+        """
+        if not self.is_alive():
+            self.open()
+        timeout = timeout or self.timeout
+        ids = []
+        payload = ""
+        for cmd in cmds:
+            self.cmd_id += 1
+            ids.append(self.cmd_id)
+            payload += self._frame(cmd, self.cmd_id)
+        self.channel.sendall(payload.encode())
+        results = []
+        self.latencies = []
+        last = time.time()
+        try:
+            for cmd_id in ids:
+                # every command gets its own time budget, just like a single exec_command would
+                results.append(self._read_result(cmd_id, time.time() + timeout))
+                now = time.time()
+                self.latencies.append(now - last)
+                last = now
+        except (paramiko.ssh_exception.SSHException, socket.timeout, socket.error, EOFError) as e:
+            raise BatchInterrupted(results, list(self.latencies), e)
+        return results
+
+    def run(self, cmd, timeout=None):
+        return self.run_batch([cmd], timeout)[0]
+
@@ -20,7 +20,7 @@ make
 sudo make install
 
 echo "[*] Installing needed python packages..."
-sudo -EH python3 -m pip install libvirt-python wget paramiko pprint scp python-magic Pillow colorama seaborn
+sudo -EH python3 -m pip install libvirt-python wget paramiko pprint scp python-magic Pillow colorama seaborn pytest
 
 echo "[*] Setting up users..."
 sudo usermod -aG libvirt $USER
@@ -1,10 +1,14 @@
 import random
 
+# order of the sections file_traversal.py prints for "all"
+TRAVERSAL_SECTIONS = ["dir", "files", "file", "link"]
+
 
 class GenericUserEmulation:
     def __init__(self, vm_object, remote_mount_path):
         self.vm_object = vm_object
         self.rpath = remote_mount_path
+        self.traversal = None  # cached output of a single "all" traversal
 
     def get_users_and_groups_of_target_os(self):
         res = self.vm_object.exec_cmd_quiet("python3 /tmp/get_users_and_groups.py").split("<delim>")
@@ -12,8 +16,16 @@ class GenericUserEmulation:
         groups = res[1].split()
         return users, groups
 
+    def _traverse_mounted_file_system(self):
+        # one round trip per instance, every param is served from the same traversal
+        if self.traversal is None:
+            self.traversal = self.vm_object.exec_cmd_quiet(
+                "python3 /tmp/file_traversal.py {} all".format(self.rpath)
+            ).split("<delim>")
+        return self.traversal
+
     def get_files_of_mounted_file_system(self, param="all"):
-        res = self.vm_object.exec_cmd_quiet("python3 /tmp/file_traversal.py {} {}".format(self.rpath, param)).split("<delim>")
+        res = self._traverse_mounted_file_system()
         if param == "all":
             list_of_all_directories = res[0].split()
             list_of_all_files = res[1].split()
@@ -25,8 +37,11 @@ class GenericUserEmulation:
                 list_of_files_and_links,
                 list_of_all_links,
             )
-        else:
+        elif len(res) < len(TRAVERSAL_SECTIONS):
+            # traversal failed, pass on whatever the script printed (e.g. a Traceback)
             return res[0].split(",")
+        else:
+            return res[TRAVERSAL_SECTIONS.index(param)].split(",")
 
     @staticmethod
     def get_random_chmod_mode():
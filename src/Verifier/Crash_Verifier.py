@@ -1,173 +1,166 @@
+import json
 import logging
 import os
 import pathlib
+import queue
 import re
 import sys
 import threading
 import time
 import zipfile
-from collections import deque
 
 THIS_FILE = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(str(pathlib.Path(THIS_FILE).parent))
 sys.path.append(str(pathlib.Path(THIS_FILE)))
 from Manager.Manager_FreeBSD import FreeBSD
+from Manager.Manager_NetBSD import NetBSD
+from Manager.Manager_OpenBSD import OpenBSD
+from Manager.Manager_Ubuntu import Ubuntu
 from Manager.Manager import VmManager
-from utility import extract_core_features
+from Manager.RetryPolicy import RetryPolicy
+from utility import extract_core_features, crash_packer, blob_store
+from Fuzzer.delta import Delta
+from Fuzzer.exec_log import get_command_chain
+from utility.crash_store import CrashStore, CRASH_STORE_NAME
+from Minimizer import Minimizer, get_bucket
 from config import fuzzing_config
 
+# verify_result values
+NOT_REPRODUCED = 0
+REPRODUCED = 1
+MANUAL_REVIEW = 2
 
-class CrashVerifier(object):
-    def __init__(self, crash_db, target_os, interval=60):
-        self.interval = interval
-        self.crash_fifo = None
-        self.last_crash_line = 0
-        self.path_crash_db = crash_db
-        self.checked_crashes = []
-        self.target = target_os
-        self.vm_object = None
+TARGETS = {"freebsd": FreeBSD, "openbsd": OpenBSD, "netbsd": NetBSD, "linux": Ubuntu}
+MOUNT = "mount"  # crash point of a crash that happened while mounting
+VERIFICATION_NAME = "verification.json"
+
+
+class VerifyResult:
+    def __init__(self, result, reason, **details):
+        self.result = result
+        self.reason = reason
+        self.details = details
+
+    def to_json(self):
+        details = dict(self.details, result=self.result, reason=self.reason)
+        return json.dumps(details, indent=4, sort_keys=True)
+
+
+class VerifierWorker:
+    """
+    Owns one verifier VM and replays the crashes queued for its OS on it.
+    After every crash the VM goes back to its snapshot, so all runs start from the same state.
+    """
+
+    def __init__(self, service, vm_name, minimize=False, max_runs=200):
+        self.service = service
+        self.vm_name = vm_name
+        self.vm_object = VmManager()
+        self.vm_object.setup(vm_user=fuzzing_config.user, vm_password=fuzzing_config.pw, name=vm_name)
+        self.vm_object.quick_boot(vm_name=vm_name)
+        self.base_snapshot = self.vm_object.get_current_snapshot()
+        if not self.base_snapshot:
+            self.base_snapshot = "{}_base".format(vm_name)
+            self.vm_object.create_snapshot_with_name(self.base_snapshot)
+        self.target = str(self.vm_object.exec_cmd_quiet("uname")).lower()
         self.reprod_crash_file = None
-        self.orig_sha_sum = None
-        time.sleep(self.interval * 15)
-        self.init_crash_fifo()
-
-        thread = threading.Thread(target=self.run, name="crash_verifier", args=())
-        thread.daemon = True
-        thread.start()
-        thread.join()
-
-    @staticmethod
-    def get_vm_object():
-        verifier_vm = VmManager()
-        verifier_vm.setup(vm_user=fuzzing_config.user, vm_password=fuzzing_config.pw, name="verifier")
-        verifier_vm.quick_boot(vm_name="verifier")
-        return verifier_vm
+        self.minimizer = Minimizer(self, service.blob_store, max_runs) if minimize else None
 
     def run(self):
-        if len(list(self.crash_fifo)) >= 1:
-            self.verify()
-            self.run()
-        else:
-            time.sleep(self.interval * 15)
-            self.init_crash_fifo()
-            self.run()
-
-    def init_crash_fifo(self):
-        self.crash_fifo = deque()
-        crash_db_contents = self.read_crash_db()
-        self._fill_crash_fifo(crash_db_contents)
-
-    def _fill_crash_fifo(self, crash_db_contents):
-        for line in crash_db_contents:
-            if line.split(";")[-3].strip() not in self.checked_crashes:
-                crash_path = str(line.split("; ")[-3].strip())
-                origin_sha_sum = line.split("; ")[-4].strip()
-                self.crash_fifo.append((crash_path, origin_sha_sum))
-
-    def verify(self):
-        next_unverified_crash_tuple = self.crash_fifo.popleft()
-        next_unverified_crash = next_unverified_crash_tuple[0]
-        self.orig_sha_sum = next_unverified_crash_tuple[1]
-        sample = os.path.join(next_unverified_crash, "sample.zip")
-        syscall_log, sample_file_system = self.get_file_system_and_log_if_present(next_unverified_crash, sample)
-        command_chain = self.get_command_chain(syscall_log)
-        if self.target == "freebsd":
-            self._freebsd_verifier(command_chain, next_unverified_crash, sample_file_system)
-        self.checked_crashes.append(next_unverified_crash)
-        self._remove_archive_contents(next_unverified_crash, sample_file_system, syscall_log)
-        self.vm_object.restore_snapshot(self.vm_object.get_current_snapshot())
-
-    def _freebsd_verifier(self, command_chain, next_unverified_crash, sample_file_system):
-        self.vm_object = self.get_vm_object()
-        self.vm_object.cp_to_guest(
-            get_files_from=next_unverified_crash, list_of_files_to_copy=sample_file_system, save_files_at="/tmp/",
-        )
-        freebsd_target = FreeBSD(
-            mount_at=os.path.join("/mnt/", sample_file_system),
-            rfile=os.path.join("/tmp", sample_file_system),
-            vm_object=self.vm_object,
-        )
-        if command_chain and freebsd_target.mount_file_system() and self.vm_object.silent_vm_state():
-            self._execute_command_chain(command_chain, next_unverified_crash)
-        elif not command_chain and freebsd_target.mount_file_system() == 2:
-            with open(os.path.join(next_unverified_crash, "reprod.1"), "w") as f:
-                f.write("System crashed as expected during mount!\n")
-        else:
-            with open(os.path.join(next_unverified_crash, "reprod.0"), "w") as f:
-                f.write("Command chain was empty. Expected the system to crash during mount!\n")
+        while not self.service.stopped.is_set():
+            try:
+                crash_dir, orig_sha_sum = self.service.queues[self.target].get(timeout=1)
+            except queue.Empty:
+                continue
+            start = time.time()
+            try:
+                result = self.verify(crash_dir, orig_sha_sum)
+            except Exception as e:
+                logging.error("Verification of {} on {} failed: {}".format(crash_dir, self.vm_name, e))
+                result = VerifyResult(MANUAL_REVIEW, "verifier error: {}".format(e))
+            result.details.update(vm=self.vm_name, target_os=self.target, duration=round(time.time() - start, 2))
+            if self.minimizer and result.result == REPRODUCED and self.restore():
+                result.details["minimized"] = self.minimize(crash_dir)
+            self.service.record(crash_dir, result)
+            self.restore()
 
-    def _reset_verifier_vm(self):
-        self.vm_object.reset_vm()
+    def restore(self):
+        try:
+            RetryPolicy("Restore {}".format(self.vm_name), max_attempts=3).run(
+                self._restore_vm, breaker=self.vm_object.breaker
+            )
+            return True
+        except Exception as e:
+            # the worker stays alive, the open circuit delays the next attempt
+            logging.error("Restoring {} failed: {}".format(self.vm_name, e))
+            return False
+
+    def _restore_vm(self):
+        self.vm_object.restore_snapshot(self.base_snapshot)
         self.vm_object.new_rshell()
 
-    @staticmethod
-    def _remove_archive_contents(next_unverified_crash, sample_file_system, syscall_log):
-        pathlib.Path(syscall_log).unlink()
-        pathlib.Path(os.path.join(next_unverified_crash, sample_file_system)).unlink()
-        pathlib.Path(os.path.join(next_unverified_crash, "_".join(x for x in sample_file_system.split("_")[1:]),)).unlink()
+    def minimize(self, crash_dir):
+        # the bucket of the reproduced trace is the one every candidate has to hit
+        report = extract_core_features.parse_core_file(self.reprod_crash_file)
+        try:
+            return self.minimizer.minimize(crash_dir, get_bucket(report))
+        except Exception as e:
+            logging.error("Minimizing {} on {} failed: {}".format(crash_dir, self.vm_name, e))
+            return None
 
-    def _execute_command_chain(self, command_chain, next_unverified_crash):
+    def verify(self, crash_dir, orig_sha_sum):
+        syscall_log, sample_file_system, restored = self.service.restore_artifacts(crash_dir)
+        if not sample_file_system:
+            return VerifyResult(MANUAL_REVIEW, "no sample file system found")
+        try:
+            return self._reproduce(crash_dir, get_command_chain(syscall_log), sample_file_system, orig_sha_sum)
+        finally:
+            for f in restored:
+                if os.path.exists(f):
+                    os.remove(f)
+
+    def run_case(self, crash_dir, sample_file_system, command_chain):
+        # Mounts the image on the VM and replays the commands.
+        # Returns where it crashed (MOUNT or the command), None without a crash and False if mounting failed
+        self.vm_object.cp_to_guest(get_files_from=crash_dir, list_of_files_to_copy=sample_file_system, save_files_at="/tmp/")
+        target = TARGETS[self.target](
+            mount_at=os.path.join("/mnt/", sample_file_system),
+            rfile=os.path.join("/tmp", sample_file_system),
+            vm_object=self.vm_object,
+        )
+        mount_ret = target.mount_file_system()
+        if mount_ret == 2:
+            return MOUNT
+        if not mount_ret:
+            return False
         for command in command_chain:
             self.vm_object.exec_cmd_quiet(command)
-            if command != command_chain[-1] and self.vm_object.silent_vm_state():
-                continue
-            elif command != command_chain[-1] and not self.vm_object.silent_vm_state():
-                with open(os.path.join(next_unverified_crash, "reprod.2"), "w") as f:
-                    f.write("Command chain mismatch. Manual review necessary!\n")
-                    f.write("Originally crashed at: {}\n".format(command_chain[-1]))
-                    f.write("Now crashed at: {}".format(command))
-                    self._reset_verifier_vm()
-                    self._fetch_latest_core_file(next_unverified_crash)
-            elif command == command_chain[-1] and self.vm_object.silent_vm_state():
-                with open(os.path.join(next_unverified_crash, "reprod.0"), "w") as f:
-                    f.write("Could not verify crash with loaded command chain: \n{}".format(command_chain))
-            elif command == command_chain[-1] and not self.vm_object.silent_vm_state():
-                self._reset_verifier_vm()
-                new_sha_sum = self.get_shasum_of_repro_crash(next_unverified_crash)
-                if self.orig_sha_sum == new_sha_sum:
-                    with open(os.path.join(next_unverified_crash, "reprod.1"), "w") as f:
-                        f.write("System crashed after executing the same command chain!\n")
-                        f.write("sha256 sums are a match!")
-                else:
-                    with open(os.path.join(next_unverified_crash, "reprod.2"), "w") as f:
-                        f.write("System crashed after executing the same command chain!\n")
-                        f.write("sha256 sums are a mismatch:\n")
-                        f.write("> Original crash: {}\n".format(self.orig_sha_sum))
-                        f.write("> Reproduced crash: {}\n".format(new_sha_sum))
-                        f.write("Manual review necessary!")
-
-    @staticmethod
-    def get_command_chain(syscall_log):
-        command_chain = []
-        with open(syscall_log, "r") as f:
-            data = f.readlines()
-            for line in data:
-                if line.startswith("[+]") or line.startswith("[!]") and not line.startswith("[!] mount"):
-                    command_chain.append(line.split("] ")[1].strip())
-        return command_chain
-
-    def get_file_system_and_log_if_present(self, next_unverified_crash, sample):
-        if pathlib.Path(sample).is_file():
-            with zipfile.ZipFile(sample, "r") as zip_ref:
-                zip_ref.extractall(next_unverified_crash)
-            syscall_log, sample_fs = None, None
-            for file in pathlib.Path(next_unverified_crash).iterdir():
-                log_match = re.search(r".*fuzz[0-9]{1,2}_syscall.log", str(file))
-                fs_match = re.search(r".*_fuzz[0-9]_[a-zA-Z0-9]+_[0-9]+MB", str(file))
-                if log_match:
-                    syscall_log = log_match.group(0)
-                if fs_match:
-                    sample_fs = fs_match.group(0)
-                if syscall_log and sample_fs:
-                    return syscall_log, str(pathlib.Path(sample_fs).name)
-        else:
-            logging.error("No sample.zip found. Continuing!")
-            self.verify()
+            if not self.vm_object.silent_vm_state():
+                return command
+        return None
+
+    def _reproduce(self, crash_dir, command_chain, sample_file_system, orig_sha_sum):
+        expected_crash_at = command_chain[-1] if command_chain else MOUNT
+        details = {"original_trace": orig_sha_sum, "expected_crash_at": expected_crash_at, "commands": len(command_chain)}
+        crashed_at = self.run_case(crash_dir, sample_file_system, command_chain)
+        if crashed_at is False:
+            if command_chain:
+                return VerifyResult(MANUAL_REVIEW, "mounting failed", crashed_at=None, **details)
+            crashed_at = None
+        details["crashed_at"] = crashed_at
+        if not crashed_at:
+            return VerifyResult(NOT_REPRODUCED, "no crash", **details)
+        self.reset_verifier_vm()
+        details["reproduced_trace"] = self.get_shasum_of_repro_crash(crash_dir)
+        if crashed_at != expected_crash_at:
+            return VerifyResult(MANUAL_REVIEW, "command chain mismatch", **details)
+        if details["reproduced_trace"] != orig_sha_sum:
+            return VerifyResult(MANUAL_REVIEW, "sha256 mismatch", **details)
+        return VerifyResult(REPRODUCED, "sha256 match", **details)
 
-    def read_crash_db(self):
-        with open(self.path_crash_db, "r") as f:
-            contents = f.readlines()
-        return contents
+    def reset_verifier_vm(self):
+        self.vm_object.reset_vm()
+        self.vm_object.new_rshell()
 
     def _get_latest_core(self):
         try:
@@ -185,9 +178,10 @@ class CrashVerifier(object):
             return None
 
     def _fetch_latest_core_file(self, save_to):
+        self.reprod_crash_file = None
         try:
             self._get_latest_core()
-            logging.error("LATEST CORES: {}".format(self.reprod_crash_file))
+            logging.debug("LATEST CORES: {}".format(self.reprod_crash_file))
             if self.reprod_crash_file:
                 self.vm_object.cp_to_host(
                     save_files_at=save_to,
@@ -203,19 +197,123 @@ class CrashVerifier(object):
             logging.error("No core file(s) found. Continuing!")
             return 0
 
-    def get_shasum_of_repro_crash(self, save_to):
+    def get_report_of_repro_crash(self, save_to):
         if self._fetch_latest_core_file(save_to):
-            with open(self.reprod_crash_file, "rb") as f:
-                data = f.read()
-            return extract_core_features.get_sha256_sum(extract_core_features.get_core_details(data))
+            return extract_core_features.parse_core_file(self.reprod_crash_file)
+        return None
+
+    def get_shasum_of_repro_crash(self, save_to):
+        report = self.get_report_of_repro_crash(save_to)
+        if report:
+            return extract_core_features.get_sha256_sum(report.sanitized_trace())
         else:
             return "NONE"
 
 
+class CrashVerifier:
+    """
+    Verification service. A watcher polls the crash store for unique, not yet verified crashes
+    and queues them per target OS. Every verifier VM is driven by its own VerifierWorker thread,
+    so crashes are replayed in parallel on as many VMs as configured.
+    Results end up in the crash store (verify_result, verify_details) and in verification.json.
+    """
+
+    def __init__(self, crash_db, vm_names, poll_interval=10, minimize=False, max_runs=200):
+        self.poll_interval = poll_interval
+        self.crash_store = CrashStore(crash_db)
+        self.blob_store = blob_store.BlobStore(os.path.join(os.path.dirname(crash_db), blob_store.BLOB_STORE_NAME))
+        self.stopped = threading.Event()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.workers = [VerifierWorker(self, vm_name, minimize, max_runs) for vm_name in vm_names]
+        self.queues = {worker.target: queue.Queue() for worker in self.workers}
+        # crashes recorded before the target OS was stored were all found on FreeBSD
+        self.default_os = "freebsd" if "freebsd" in self.queues else self.workers[0].target
+        self.missing_os = set()
+
+    def run(self):
+        for worker in self.workers:
+            threading.Thread(target=worker.run, name="verifier_{}".format(worker.vm_name), daemon=True).start()
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            self.stopped.set()
+
+    def poll(self):
+        for crash_dir, orig_sha_sum, target_os in self.crash_store.unverified():
+            with self.lock:
+                if crash_dir in self.queued or not crash_packer.is_packed(crash_dir):
+                    continue
+                target_os = target_os or self.default_os
+                if target_os not in self.queues:
+                    if target_os not in self.missing_os:
+                        logging.warning("No verifier VM for {} crashes".format(target_os))
+                        self.missing_os.add(target_os)
+                    continue
+                self.queued.add(crash_dir)
+            self.queues[target_os].put((crash_dir, orig_sha_sum))
+
+    def record(self, crash_dir, result):
+        details = result.to_json()
+        with open(os.path.join(crash_dir, VERIFICATION_NAME), "w") as f:
+            f.write(details)
+        self.crash_store.mark_verified(crash_dir, result.result, details)
+        with self.lock:
+            self.queued.discard(crash_dir)
+        logging.info("Verified {}: {} ({})".format(crash_dir, result.result, result.reason))
+
+    def restore_artifacts(self, crash_dir):
+        # Returns syscall log, mutated image name and every file written into the crash directory
+        manifest = blob_store.read_manifest(crash_dir)
+        if manifest is None:
+            return get_legacy_sample(crash_dir)
+        log_name, log_blob = blob_store.get_artifact_by_role(manifest, "log")
+        seed_name, seed_blob = blob_store.get_artifact_by_role(manifest, "seed")
+        image_name, image_blob = blob_store.get_artifact_by_role(manifest, "image")
+        restored = []
+        for name, blob in [(log_name, log_blob), (seed_name, seed_blob), (image_name, image_blob)]:
+            if blob:
+                restored.append(self.blob_store.get(blob, os.path.join(crash_dir, name)))
+        if not image_blob:
+            # delta engines only keep the patch list, the image is rebuilt from the seed
+            delta_name, delta_blob = blob_store.get_artifact_by_role(manifest, "delta")
+            image_name = delta_name[: -len(blob_store.DELTA_SUFFIX)]
+            delta_path = self.blob_store.get(delta_blob, os.path.join(crash_dir, delta_name))
+            Delta.load(delta_path).materialize(os.path.join(crash_dir, seed_name), os.path.join(crash_dir, image_name))
+            os.remove(delta_path)
+            restored.append(os.path.join(crash_dir, image_name))
+        return os.path.join(crash_dir, log_name), image_name, restored
+
+
+def get_legacy_sample(crash_dir):
+    # crash directories from before the blob store carry a sample.zip
+    sample = os.path.join(crash_dir, "sample.zip")
+    if not pathlib.Path(sample).is_file():
+        logging.error("No sample.zip found in {}".format(crash_dir))
+        return None, None, []
+    with zipfile.ZipFile(sample, "r") as zip_ref:
+        restored = [os.path.join(crash_dir, name) for name in zip_ref.namelist()]
+        zip_ref.extractall(crash_dir)
+    syscall_log, sample_fs = None, None
+    for file in restored:
+        log_match = re.search(r".*fuzz[0-9]{1,2}_syscall.log", file)
+        fs_match = re.search(r".*_fuzz[0-9]_[a-zA-Z0-9]+_[0-9]+MB$", file)
+        if log_match:
+            syscall_log = log_match.group(0)
+        if fs_match:
+            sample_fs = fs_match.group(0)
+    return syscall_log, str(pathlib.Path(sample_fs).name) if sample_fs else None, restored
+
+
 def main():
     CrashVerifier(
-        crash_db="/home/dev/git/bsdfuzz/fsfuzz/src/crash_dumps/crash.db", target_os="freebsd",
-    )
+        crash_db=os.path.join(str(pathlib.Path(THIS_FILE).parent), "crash_dumps", CRASH_STORE_NAME),
+        vm_names=getattr(fuzzing_config, "verifier_vms", ["verifier"]),
+        minimize=getattr(fuzzing_config, "minimize_crashes", False),
+        max_runs=getattr(fuzzing_config, "minimize_max_runs", 200),
+    ).run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from Fuzzer.delta import Delta, diff_images
+from Fuzzer.exec_log import get_command_chain
+from utility import blob_store, crash_buckets
+
+MINIMIZED_NAME = "minimized.json"
+MIN_DELTA_ROLE = "min_delta"  # manifest role of the minimized delta
+MIN_SNAPSHOT = "{}_minimizer"  # running-state snapshot every minimization run starts from
+
+
+def _split(items, n):
+    # n nearly equal, contiguous chunks
+    chunks, start = [], 0
+    for i in range(n):
+        end = start + (len(items) - start) // (n - i)
+        chunks.append(items[start:end])
+        start = end
+    return [c for c in chunks if c]
+
+
+def ddmin(items, test):
+    """
+    Delta debugging (Zeller/Hildebrandt), iterative.
+    test(subset) is True as long as the subset still triggers the failure, items itself must.
+    Returns a 1-minimal subset: dropping any single element of it loses the failure.
+    Results are cached, ddmin tends to ask for the same subset more than once.
+    """
+    cache = {}
+
+    def passes(indices):
+        key = tuple(indices)
+        if key not in cache:
+            cache[key] = test([items[i] for i in indices])
+        return cache[key]
+
+    if passes([]):
+        return []
+    indices = list(range(len(items)))
+    granularity = 2
+    while len(indices) >= 2:
+        chunks = _split(indices, granularity)
+        reduced = False
+        for chunk in chunks:
+            if passes(chunk):
+                indices, granularity, reduced = chunk, 2, True
+                break
+        if not reduced:
+            for i in range(len(chunks)):
+                complement = [x for j, chunk in enumerate(chunks) if j != i for x in chunk]
+                if passes(complement):
+                    indices, granularity, reduced = complement, max(granularity - 1, 2), True
+                    break
+        if not reduced:
+            if granularity >= len(indices):
+                break
+            granularity = min(granularity * 2, len(indices))
+    return [items[i] for i in indices]
+
+
+def split_patches(delta):
+    # one patch per changed byte, so ddmin bisects mutated bytes rather than whole mutation runs
+    patches = []
+    for offset, old, new in delta.patches:
+        for i in range(len(new)):
+            if i >= len(old) or old[i] != new[i]:
+                patches.append((offset + i, old[i : i + 1], new[i : i + 1]))
+    return patches
+
+
+def get_bucket(report):
+    return crash_buckets.get_bucket_hash(report.panic, crash_buckets.get_frames(report.sanitized_trace()))
+
+
+class Minimizer:
+    """
+    Shrinks a reproduced crash to the mutated bytes and syscall log commands it really needs.
+    The test case is rebuilt from the stored seed and mutation delta, ddmin first bisects the
+    mutated bytes (with the full command chain), then the commands (with the minimal image).
+    A candidate passes if it crashes into the same trace bucket as the original crash.
+    Every run starts from a running-state snapshot of the verifier VM, so no run pays for a boot.
+    """
+
+    def __init__(self, worker, store, max_runs=200):
+        self.worker = worker
+        self.store = store
+        self.max_runs = max_runs
+        self.runs = 0
+        self.snapshot = MIN_SNAPSHOT.format(worker.vm_name)
+        self.workdir = None
+        self.seed = None
+        self.seed_id = None
+        self.size = 0
+        self.image_name = None
+
+    def minimize(self, crash_dir, bucket=None):
+        # Returns the summary written to minimized.json, None if the crash cannot be minimized
+        start = time.time()
+        self.runs = 0
+        self.workdir = tempfile.mkdtemp(prefix="minimize_", dir=crash_dir)
+        try:
+            delta, command_chain = self._load_test_case(crash_dir)
+            if delta is None:
+                logging.warning("No seed and delta for {}, nothing to minimize".format(crash_dir))
+                return None
+            patches = split_patches(delta)
+            vm = self.worker.vm_object
+            vm.delete_snapshot(self.snapshot)
+            vm.create_snapshot_with_name(self.snapshot)
+            bucket = bucket or self._run(patches, command_chain)
+            if not bucket or self._run(patches, command_chain) != bucket:
+                logging.warning("{} does not crash reliably into one bucket, skipping minimization".format(crash_dir))
+                return None
+            min_patches = ddmin(patches, lambda p: self._run(p, command_chain) == bucket)
+            min_commands = ddmin(list(command_chain), lambda c: self._run(min_patches, c) == bucket)
+            summary = {
+                "bucket": bucket,
+                "mutated_bytes": len(patches),
+                "min_mutated_bytes": len(min_patches),
+                "commands": len(command_chain),
+                "min_commands": min_commands,
+                "runs": self.runs,
+                "exhausted": self.runs >= self.max_runs,
+                "duration": round(time.time() - start, 2),
+            }
+            self._save(crash_dir, Delta(self.seed_id, self.size, min_patches), summary)
+            return summary
+        finally:
+            self.worker.vm_object.delete_snapshot(self.snapshot)
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _load_test_case(self, crash_dir):
+        # Returns the delta from the seed to the crashing image and the command chain of the exec log
+        manifest = blob_store.read_manifest(crash_dir)
+        if manifest is None:
+            return None, None  # legacy sample.zip crashes have no seed
+        seed_name, seed_blob = blob_store.get_artifact_by_role(manifest, "seed")
+        if not seed_blob:
+            return None, None
+        log_name, log_blob = blob_store.get_artifact_by_role(manifest, "log")
+        command_chain = get_command_chain(self.store.get(log_blob, os.path.join(self.workdir, log_name)))
+        self.seed = self.store.get(seed_blob, os.path.join(self.workdir, "seed_" + seed_name))
+        delta_name, delta_blob = blob_store.get_artifact_by_role(manifest, "delta")
+        if delta_blob:
+            delta = Delta.load(self.store.get(delta_blob, os.path.join(self.workdir, delta_name)))
+            self.image_name = delta_name[: -len(blob_store.DELTA_SUFFIX)]
+        else:
+            # engines writing full images, the delta against the seed is computed here
+            self.image_name, image_blob = blob_store.get_artifact_by_role(manifest, "image")
+            image = self.store.get(image_blob, os.path.join(self.workdir, self.image_name))
+            with open(image, "rb") as f:
+                delta = diff_images(self.seed, f.read())
+        self.seed_id, self.size = delta.seed_id, delta.size
+        return delta, command_chain
+
+    def _run(self, patches, command_chain):
+        # Returns the bucket of the crash the candidate runs into, None without a crash
+        if self.runs >= self.max_runs:
+            return None  # budget used up, ddmin stops reducing and keeps what it has
+        self.runs += 1
+        Delta(self.seed_id, self.size, patches).materialize(self.seed, os.path.join(self.workdir, self.image_name))
+        self.worker.vm_object.revert_to_running_snapshot(self.snapshot)
+        crashed_at = self.worker.run_case(self.workdir, self.image_name, command_chain)
+        logging.debug(
+            "Minimizer run {}: {} bytes, {} commands, crashed at {}".format(
+                self.runs, len(patches), len(command_chain), crashed_at
+            )
+        )
+        if not crashed_at:
+            return None
+        self.worker.reset_verifier_vm()
+        report = self.worker.get_report_of_repro_crash(self.workdir)
+        return get_bucket(report) if report else None
+
+    def _save(self, crash_dir, delta, summary):
+        name = self.image_name + ".min" + blob_store.DELTA_SUFFIX
+        path = delta.save(os.path.join(self.workdir, name))
+        manifest = blob_store.read_manifest(crash_dir)
+        previous = manifest.pop(name, None)
+        manifest[name] = {"blob": self.store.put(path), "role": MIN_DELTA_ROLE}
+        blob_store.write_manifest(crash_dir, manifest)
+        if previous:
+            self.store.release(previous["blob"])
+        with open(os.path.join(crash_dir, MINIMIZED_NAME), "w") as f:
+            f.write(json.dumps(summary, indent=4, sort_keys=True))
@@ -2,7 +2,7 @@
 # List of dictionaries specifying each fuzzing instance
 fuzzer = [
     {
-        "name": "fuzz1",  # Name for internal bookkeeping
+        "name": "fuzz1",  # Name for internal bookkeeping, must be unique (Fuzzer.py --fuzzer <name>)
         "fs_creator_vm": "genBox",  # Name as specified in libvirt for the VM handling the file system generation
         "fuzzing_vm": "fuzzBox",  # Name as specified in libvirt for the VM handling the file system generation
         "mutation_engine": "radamsa, 0",  # Mutation Engine that is to be used, and size of mutation
@@ -11,9 +11,30 @@ fuzzer = [
         "populate_with_files": 10,  # Amount of file that will be generated
         "max_file_size": 1024,  # Maximum file size in bytes for each generated file
         "enable_dyn_scaling": False,  # Dynamic scaling will increase the filesystem size periodically
+        "seed_corpus_size": 32,  # Max amount of pre generated file systems kept in the local seed corpus
+        "mutations_per_seed": 100,  # Amount of mutations spent on each seed before it is evicted from the corpus
+        "pipeline_depth": 2,  # Test cases generated, mutated and staged on the fuzzing VM ahead of time, 0 disables the pipeline
+        "snapshot_fuzzing": False,  # Revert to a running-state snapshot after every iteration instead of rebooting the VM
+        "worker_vms": [],  # Additional libvirt VMs fuzzing alongside fuzzing_vm, all driven from one process
+        "worker_clones": 0,  # Amount of clones of fuzzing_vm created via virt-clone and added to the worker pool
+        "crash_codec": "zstd",  # Codec for crash artifacts (zstd, lz4 or zip), zip is used if the python module is missing
+        "compression_workers": 2,  # Background processes compressing crash artifacts while fuzzing goes on
+        "dedup_vmcores": True,  # Drop the vmcore of a crash whose backtrace hash is already known
+        "metrics_port": 0,  # Serve per-stage latency histograms (Prometheus text format) on localhost:<port>, 0 disables it
+        "metrics_log": True,  # Append per-stage latency histograms to stats/<name>_metrics.jsonl every minute
+        "fix_checksums": ["radamsa", "byte_flip_seq", "byte_flip_rnd", "metadata", "ufs_field"],  # Engines whose mutations get ext4/UFS2 checksums recomputed, [] disables it
     },
 ]
 
+# [crash verification]
+# libvirt VMs replaying unique crashes in parallel (python3 Verifier/Crash_Verifier.py),
+# each crash is verified on a VM running the same OS as the fuzzing VM that found it
+verifier_vms = ["verifier"]
+# shrink reproduced crashes to the mutated bytes and commands they need (delta debugging),
+# minimize_max_runs bounds the VM runs spent on one crash
+minimize_crashes = False
+minimize_max_runs = 200
+
 # [credentials]
 # Credentials for the root user for the VMs
 # It is expected that these are the same across all instances
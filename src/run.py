@@ -29,17 +29,8 @@ def main():
 
     for i in range(len(fuzzing_config.fuzzer)):
         build_new_tmux_window()
-        cmd = "python3 Fuzzer/Fuzzer.py {} {} {} '{}' {} {} {} {} {}".format(
-            fuzzing_config.fuzzer[i]["name"],
-            fuzzing_config.fuzzer[i]["fs_creator_vm"],
-            fuzzing_config.fuzzer[i]["fuzzing_vm"],
-            fuzzing_config.fuzzer[i]["mutation_engine"],
-            fuzzing_config.fuzzer[i]["target_fs"],
-            fuzzing_config.fuzzer[i]["target_size"],
-            fuzzing_config.fuzzer[i]["populate_with_files"],
-            fuzzing_config.fuzzer[i]["max_file_size"],
-            fuzzing_config.fuzzer[i]["enable_dyn_scaling"],
-        )
+        # Fuzzer.py reads every setting of its entry from fuzzing_config itself, only the name is passed
+        cmd = "python3 Fuzzer/Fuzzer.py --fuzzer {}".format(fuzzing_config.fuzzer[i]["name"])
         print(cmd)
         fuzz_task = subprocess.Popen('tmux send-keys -t fsfuzzer "{}" C-m'.format(cmd), shell=True, stdout=subprocess.PIPE)
         if fuzz_task.poll() is not None:
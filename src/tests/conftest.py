@@ -0,0 +1,18 @@
+import pathlib
+import sys
+
+import pytest
+
+# The fuzzer modules import their siblings top-level (python3 Fuzzer/Fuzzer.py), the verifier and
+# utility modules go through the src directory. src comes first, Fuzzer is the package and not Fuzzer/Fuzzer.py
+SRC = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:] = [str(SRC), str(SRC / "Fuzzer")] + [p for p in sys.path if p not in [str(SRC), str(SRC / "Fuzzer")]]
+
+
+@pytest.fixture
+def seed(tmp_path):
+    # 64KiB of non-repeating bytes, big enough for several DIFF_BLOCK_SIZE blocks
+    path = tmp_path / "seed.img"
+    path.write_bytes(bytes((i * 7 + (i >> 8)) & 0xFF for i in range(64 << 10)))
+    return str(path)
+
@@ -0,0 +1,134 @@
+# Small file system images for the tests: ext via mkfs.ext4, UFS built field by field
+import shutil
+import subprocess
+
+from checksum_fixup import CG_FIELDS, SB_FIELDS, crc32c
+from file_system_magic.ufs_superblock_parser import SBLOCK_UFS1, SBLOCK_UFS2, SBLOCKSIZE
+
+HAS_E2FSPROGS = all(shutil.which(tool) for tool in ["mkfs.ext4", "e2fsck", "dumpe2fs"])
+UFS2_MAGIC = 0x19540119
+UFS1_MAGIC = 0x011954
+CG_MAGIC = 0x090255
+SB_SIZE = 1376  # struct fs as parsed by UFS
+CG_SIZE = 2048
+
+
+def make_ext(path, size_kb=8192, features=None, bpg=2048):
+    # 1KiB blocks so a few MiB hold several block groups
+    cmd = ["mkfs.ext4", "-q", "-F", "-b", "1024", "-g", str(bpg), "-N", "64", "-U", "3a2ae74e-5d1a-4e2b-a62d-4b5d7ad9d001"]
+    if features:
+        cmd += ["-O", features]
+    subprocess.run(cmd + [str(path), "{}k".format(size_kb)], check=True, capture_output=True)
+    return str(path)
+
+
+def dumpe2fs(path):
+    # (primary and backup superblock offsets, group descriptor table offsets, inode table offsets) in bytes
+    out = subprocess.run(["dumpe2fs", str(path)], check=True, capture_output=True, text=True).stdout
+    bsize = int(out.split("Block size:")[1].split()[0])
+    sbs, gdts, itables = [], [], []
+    for line in out.splitlines():
+        line = line.strip()
+        if "superblock at " in line:
+            sbs.append(int(line.split("superblock at ")[1].split(",")[0]))
+            if "Group descriptors at " in line:
+                gdts.append(int(line.split("Group descriptors at ")[1].split("-")[0]))
+        elif line.startswith("Inode table at "):
+            itables.append(int(line.split("Inode table at ")[1].split("-")[0]))
+    return [1024 if b <= 1 else b * bsize for b in sbs], [b * bsize for b in gdts], [b * bsize for b in itables]
+
+
+def e2fsck(path):
+    return subprocess.run(["e2fsck", "-fn", str(path)], capture_output=True, text=True)
+
+
+def set_field(img, base, fields, name, value):
+    f = fields[name]
+    img[base + f.offset : base + f.offset + f.size] = value.to_bytes(f.size, "little", signed=value < 0)
+
+
+def get_field(img, base, fields, name):
+    f = fields[name]
+    return int.from_bytes(img[base + f.offset : base + f.offset + f.size], "little")
+
+
+def ufs_hash(img, loc, size, field):
+    # check hash over size bytes with the hash field zeroed, ffs_calc_sbhash()/calc_cgckhash()
+    data = bytearray(img[loc : loc + size])
+    data[field.offset : field.offset + field.size] = bytes(field.size)
+    return crc32c(0xFFFFFFFF, data)
+
+
+class UfsImage:
+    """
+    Geometry of a synthetic UFS image: ncg cylinder groups of fpg fragments, a superblock
+    (backup) at fragment sblkno and a cylinder group header at fragment cblkno of every group.
+    UFS1 staggers the metadata by old_cgoffset fragments per group (old_cgmask selects the groups).
+    """
+
+    def __init__(self, fst="ufs2", ncg=4, fsize=2048, fpg=128, sblkno=None, cblkno=None, cgoffset=0, cgmask=-1, ckhash=0):
+        self.fst = fst
+        self.ncg = ncg
+        self.fsize = fsize
+        self.fpg = fpg
+        self.sbo = SBLOCK_UFS2 if fst == "ufs2" else SBLOCK_UFS1
+        self.sblkno = self.sbo // fsize if sblkno is None else sblkno
+        self.cblkno = self.sblkno + SBLOCKSIZE // fsize if cblkno is None else cblkno
+        self.cgoffset = cgoffset
+        self.cgmask = cgmask
+        self.ckhash = ckhash
+
+    def cg_start(self, cg):
+        start = self.fpg * cg
+        if self.fst == "ufs1":
+            start += self.cgoffset * (cg & ~self.cgmask)
+        return start * self.fsize
+
+    def sb_locs(self):
+        return [self.sbo] + [loc for loc in (self.cg_start(cg) + self.sblkno * self.fsize for cg in range(self.ncg)) if loc != self.sbo]
+
+    def cg_locs(self):
+        return [self.cg_start(cg) + self.cblkno * self.fsize for cg in range(self.ncg)]
+
+    def build(self, path):
+        img = bytearray(self.ncg * self.fpg * self.fsize + self.cgoffset * self.fsize * self.ncg)
+        for loc in self.sb_locs():
+            self._write_superblock(img, loc)
+        for cg, loc in enumerate(self.cg_locs()):
+            set_field(img, loc, CG_FIELDS, "cg_magic", CG_MAGIC)
+            set_field(img, loc, CG_FIELDS, "cg_cgx", cg)
+            set_field(img, loc, CG_FIELDS, "cg_ndblk", self.fpg)
+            img[loc + 200 : loc + CG_SIZE] = bytes((cg + i) & 0xFF for i in range(CG_SIZE - 200))  # bitmaps
+            if self.ckhash & 0x2:
+                set_field(img, loc, CG_FIELDS, "cg_ckhash", ufs_hash(img, loc, CG_SIZE, CG_FIELDS["cg_ckhash"]))
+        with open(path, "wb") as f:
+            f.write(img)
+        return str(path)
+
+    def _write_superblock(self, img, loc):
+        values = {
+            "fs_sblkno": self.sblkno,
+            "fs_cblkno": self.cblkno,
+            "fs_iblkno": self.cblkno + 1,
+            "fs_dblkno": self.cblkno + 2,
+            "fs_old_cgoffset": self.cgoffset,
+            "fs_old_cgmask": self.cgmask,
+            "fs_ncg": self.ncg,
+            "fs_bsize": self.fsize * 8,
+            "fs_fsize": self.fsize,
+            "fs_frag": 8,
+            "fs_sbsize": SB_SIZE,
+            "fs_cgsize": CG_SIZE,
+            "fs_fpg": self.fpg,
+            "fs_ipg": 64,
+            "fs_sblockloc": self.sbo,
+            "fs_size": self.ncg * self.fpg,
+            "fs_metackhash": self.ckhash,
+            "fs_magic": UFS2_MAGIC if self.fst == "ufs2" else UFS1_MAGIC,
+        }
+        for name, value in values.items():
+            set_field(img, loc, SB_FIELDS, name, value)
+        img[loc + SB_FIELDS["fs_fsmnt"].offset : loc + SB_FIELDS["fs_fsmnt"].offset + 5] = b"/mnt\x00"
+        if self.ckhash & 0x1:
+            set_field(img, loc, SB_FIELDS, "fs_ckhash", ufs_hash(img, loc, SB_SIZE, SB_FIELDS["fs_ckhash"]))
+
@@ -0,0 +1,157 @@
+import struct
+
+import pytest
+
+import images
+from checksum_fixup import CG_FIELDS, EXT4_BG_CHECKSUM_OFF, EXT4_INCOMPAT_64BIT, SB_FIELDS, ChecksumFixup, crc16, crc32c
+from delta import Delta
+from file_system_magic.ext_superblock_parser import EXT, SBLOCK_EXT2
+from mutation_buffer import MutationBuffer
+
+EXT_VARIANTS = [
+    "metadata_csum,^64bit",
+    "metadata_csum,64bit",
+    "metadata_csum,metadata_csum_seed",
+    "^metadata_csum,uninit_bg,^64bit",
+    "^metadata_csum,uninit_bg,64bit",
+]
+
+
+def _sb_offset(name):
+    return SBLOCK_EXT2 + EXT.get_offset_in_sb(name)[0]
+
+
+def _desc_size(fs):
+    with open(fs, "rb") as f:
+        sb = f.read(SBLOCK_EXT2 + 1024)
+    incompat = int.from_bytes(sb[_sb_offset("e2fs_features_incompat") :][:4], "little")
+    return int.from_bytes(sb[_sb_offset("e3fs_desc_size") :][:2], "little") if incompat & EXT4_INCOMPAT_64BIT else 32
+
+
+def _mutate(fs, patches):
+    # the delta of (offset, new bytes) patches plus what ChecksumFixup appended to it
+    with MutationBuffer(fs, materialize=False) as buf:
+        for offset, new in patches:
+            buf.write(offset, new)
+        delta = buf.delta
+    fixup = ChecksumFixup(fs, delta)
+    fixup.fix()
+    return delta, fixup.fixed
+
+
+def _materialize(delta, fs, tmp_path):
+    return delta.materialize(fs, str(tmp_path / "mfs.img"))
+
+
+def test_crc_check_values():
+    # CRC-32C (Castagnoli) and CRC-16/ARC check values of "123456789"
+    assert crc32c(0xFFFFFFFF, b"123456789") ^ 0xFFFFFFFF == 0xE3069283
+    assert crc16(0, b"123456789") == 0xBB3D
+    assert crc32c(crc32c(0xFFFFFFFF, b"1234"), b"56789") == crc32c(0xFFFFFFFF, b"123456789")
+
+
+@pytest.mark.skipif(not images.HAS_E2FSPROGS, reason="needs e2fsprogs")
+@pytest.mark.parametrize("features", EXT_VARIANTS)
+def test_ext_recomputes_mkfs_checksums(tmp_path, features):
+    # zeroed checksums of the superblock and of every group descriptor come back as mkfs wrote them
+    fs = images.make_ext(tmp_path / "seed.img", features=features)
+    _, gdts, _ = images.dumpe2fs(fs)
+    with open(fs, "rb") as f:
+        seed = f.read()
+    desc_size = _desc_size(fs)
+    patches = [(gdts[0] + group * desc_size + EXT4_BG_CHECKSUM_OFF, b"\x00\x00") for group in range(4)]
+    if "^metadata_csum" not in features:
+        patches.append((_sb_offset("e4fs_sbchksum"), bytes(4)))
+    delta, fixed = _mutate(fs, patches)
+    assert len(fixed) == len(patches)
+    with open(_materialize(delta, fs, tmp_path), "rb") as f:
+        assert f.read() == seed
+
+
+@pytest.mark.skipif(not images.HAS_E2FSPROGS, reason="needs e2fsprogs")
+@pytest.mark.parametrize("features", EXT_VARIANTS)
+def test_ext_mutated_image_passes_e2fsck(tmp_path, features):
+    fs = images.make_ext(tmp_path / "seed.img", features=features)
+    _, gdts, _ = images.dumpe2fs(fs)
+    desc_size = _desc_size(fs)
+    # fields e2fsck does not otherwise care about: e2fs_max_mnt_count and bg_exclude_bitmap_lo of group 1
+    patches = [(_sb_offset("e2fs_max_mnt_count"), struct.pack("<H", 37)), (gdts[0] + desc_size + 0x14, b"\x05\x00")]
+    delta, fixed = _mutate(fs, patches)
+    assert fixed
+    assert images.e2fsck(_materialize(delta, fs, tmp_path)).returncode == 0
+    # without the fixup e2fsck reports the checksums
+    broken = Delta(delta.seed_id, delta.size, delta.patches[: len(patches)])
+    assert images.e2fsck(broken.materialize(fs, str(tmp_path / "broken.img"))).returncode != 0
+
+
+@pytest.mark.skipif(not images.HAS_E2FSPROGS, reason="needs e2fsprogs")
+def test_ext_untouched(tmp_path):
+    fs = images.make_ext(tmp_path / "seed.img", features="metadata_csum")
+    # data blocks far from the superblock and the descriptors
+    delta, fixed = _mutate(fs, [(6 << 20, b"\xff" * 16)])
+    assert fixed == [] and len(delta) == 1
+
+
+@pytest.mark.skipif(not images.HAS_E2FSPROGS, reason="needs e2fsprogs")
+def test_ext_without_checksums(tmp_path):
+    fs = images.make_ext(tmp_path / "seed.img", features="^metadata_csum,^uninit_bg")
+    assert not ChecksumFixup(fs, None).supported()
+    delta, fixed = _mutate(fs, [(_sb_offset("e2fs_max_mnt_count"), b"\x05\x00")])
+    assert fixed == [] and len(delta) == 1
+
+
+def _ufs2(tmp_path, ckhash=0x3):
+    ufs = images.UfsImage("ufs2", ckhash=ckhash)
+    return ufs, ufs.build(tmp_path / "seed.img")
+
+
+def test_ufs2_superblock_hash(tmp_path):
+    ufs, fs = _ufs2(tmp_path)
+    sb = ufs.sb_locs()
+    field = SB_FIELDS["fs_maxbpg"]
+    delta, fixed = _mutate(fs, [(sb[0] + field.offset, struct.pack("<i", 77)), (sb[2] + field.offset, struct.pack("<i", 78))])
+    assert sorted(fixed) == sorted(["fs_ckhash@{}".format(hex(sb[0])), "fs_ckhash@{}".format(hex(sb[2]))])
+    with open(_materialize(delta, fs, tmp_path), "rb") as f:
+        img = f.read()
+    for loc in sb:
+        assert images.get_field(img, loc, SB_FIELDS, "fs_ckhash") == images.ufs_hash(img, loc, images.SB_SIZE, SB_FIELDS["fs_ckhash"])
+
+
+def test_ufs2_cylinder_group_hash(tmp_path):
+    ufs, fs = _ufs2(tmp_path)
+    cg = ufs.cg_locs()
+    with open(fs, "rb") as f:
+        seed = f.read()
+    # a free map byte of the last group
+    delta, fixed = _mutate(fs, [(cg[3] + 1000, b"\x00\xff")])
+    assert fixed == ["cg_ckhash@{}".format(hex(cg[3]))]
+    with open(_materialize(delta, fs, tmp_path), "rb") as f:
+        img = f.read()
+    assert images.get_field(img, cg[3], CG_FIELDS, "cg_ckhash") == images.ufs_hash(img, cg[3], images.CG_SIZE, CG_FIELDS["cg_ckhash"])
+    assert img[: cg[3]] == seed[: cg[3]]
+
+
+def test_ufs2_primary_superblock_rehashes_groups(tmp_path):
+    # the hashed cylinder group length comes from the primary superblock
+    ufs, fs = _ufs2(tmp_path)
+    delta, fixed = _mutate(fs, [(ufs.sbo + SB_FIELDS["fs_cgsize"].offset, struct.pack("<i", 1024))])
+    assert len([name for name in fixed if name.startswith("cg_ckhash")]) == ufs.ncg
+    assert "fs_ckhash@{}".format(hex(ufs.sbo)) in fixed
+
+
+def test_ufs2_restores_seed_hashes(tmp_path):
+    ufs, fs = _ufs2(tmp_path)
+    with open(fs, "rb") as f:
+        seed = f.read()
+    field = CG_FIELDS["cg_ckhash"]
+    delta, fixed = _mutate(fs, [(loc + field.offset, bytes(4)) for loc in ufs.cg_locs()])
+    assert len(fixed) == ufs.ncg
+    with open(_materialize(delta, fs, tmp_path), "rb") as f:
+        assert f.read() == seed
+
+
+def test_ufs2_without_ckhash(tmp_path):
+    ufs, fs = _ufs2(tmp_path, ckhash=0)
+    assert not ChecksumFixup(fs, None).supported()
+    _, fixed = _mutate(fs, [(ufs.sbo + SB_FIELDS["fs_maxbpg"].offset, b"\x01")])
+    assert fixed == []
@@ -0,0 +1,173 @@
+import pathlib
+
+from utility import crash_buckets
+from utility.crash_store import CrashStore
+from utility.extract_core_features import parse_core_file, parse_core_lines
+
+TEST_CORE = pathlib.Path(__file__).resolve().parent.parent / "utility" / "test_core.txt"
+
+FREEBSD_TRACE = """db_trace_self_wrapper() at db_trace_self_wrapper+0x2b/frame 0xfffffe001b81d280
+vpanic() at vpanic+0x1a3/frame 0xfffffe001b81d2e0
+panic() at panic+0x43/frame 0xfffffe001b81d340
+trap_fatal() at trap_fatal+0x35f/frame 0xfffffe001b81d390
+trap_pfault() at trap_pfault+0x49/frame 0xfffffe001b81d3f0
+trap() at trap+0x29f/frame 0xfffffe001b81d500
+calltrap() at calltrap+0x8/frame 0xfffffe001b81d500
+ffs_blkfree_cg() at ffs_blkfree_cg+0x1c/frame 0xfffffe001b81d630
+ffs_blkfree() at ffs_blkfree+0x{0}/frame 0xfffffe001b81d6a0
+ffs_indirtrunc() at ffs_indirtrunc+0x881/frame 0xfffffe001b81d7a0
+ffs_truncate() at ffs_truncate+0x{1}/frame 0xfffffe001b81d980
+ufs_setattr() at ufs_setattr+0x8b3/frame 0xfffffe001b81da10
+VOP_SETATTR_APV() at VOP_SETATTR_APV+0x7c/frame 0xfffffe001b81da40
+setfsize() at setfsize+0xa8/frame 0xfffffe001b81dac0
+kern_openat() at kern_openat+0x2f4/frame 0xfffffe001b81dc10
+amd64_syscall() at amd64_syscall+0x369/frame 0xfffffe001b81dd30
+"""
+
+LINUX_TRACE = """ dump_stack_lvl+0x4a/0x63
+ ext4_fill_super+0x1234/0x5678
+ mount_bdev+0x18c/0x1c0
+ legacy_get_tree+0x27/0x40
+ vfs_get_tree+0x25/0xb0
+ path_mount+0x431/0xa70
+ __x64_sys_mount+0x103/0x140
+ do_syscall_64+0x3b/0x90
+"""
+
+TOP = ["ffs_blkfree_cg", "ffs_blkfree", "ffs_indirtrunc", "ffs_truncate", "ufs_setattr"]
+
+
+def _frames(trace):
+    return crash_buckets.get_frames(trace)
+
+
+def test_frames_drop_panic_machinery():
+    frames = _frames(FREEBSD_TRACE.format("1a", "2b"))
+    assert frames[:5] == TOP
+    assert not set(frames) & crash_buckets.IGNORED_FRAMES
+    assert _frames(LINUX_TRACE) == [
+        "ext4_fill_super",
+        "mount_bdev",
+        "legacy_get_tree",
+        "vfs_get_tree",
+        "path_mount",
+        "__x64_sys_mount",
+    ]
+
+
+def test_frames_of_kgdb_lines():
+    trace = "#0 0xffffffff80bf0cb5 in doadump (textdump=<optimized out>)\n#1 ffs_blkfree (fs=0x0)\n"
+    assert _frames(trace) == ["ffs_blkfree"]
+
+
+def test_bucket_ignores_offsets_and_addresses():
+    a = _frames(FREEBSD_TRACE.format("1a", "2b"))
+    b = _frames(FREEBSD_TRACE.format("ff0", "3c").replace("0xfffffe001b81", "0xfffffe0042"))
+    assert crash_buckets.get_bucket_hash("page_fault", a) == crash_buckets.get_bucket_hash("page_fault", b)
+    assert crash_buckets.get_bucket_hash("page_fault", a) != crash_buckets.get_bucket_hash("ffs_blkfree", a)
+
+
+def test_bucket_uses_top_frames_only():
+    frames = _frames(FREEBSD_TRACE.format("1a", "2b"))
+    deeper = frames[:5] + ["other_caller"] + frames[6:]
+    assert crash_buckets.get_bucket_hash("page_fault", frames) == crash_buckets.get_bucket_hash("page_fault", deeper)
+    swapped = [frames[1], frames[0]] + frames[2:]
+    assert crash_buckets.get_bucket_hash("page_fault", frames) != crash_buckets.get_bucket_hash("page_fault", swapped)
+
+
+def test_core_report_bucket():
+    report = parse_core_file(str(TEST_CORE))
+    frames = _frames(report.sanitized_trace())
+    assert report.panic == "page_fault"
+    assert frames and not set(frames) & crash_buckets.IGNORED_FRAMES
+
+
+def test_bug_marker_at_line_start():
+    lines = [
+        "[    3.101] ext4: DEBUG: mount options: errors=remount-ro\n",
+        "[    3.214] [  T412] BUG: kernel NULL pointer dereference, address: 0000000000000018\n",
+    ]
+    assert parse_core_lines(lines).panic == "kernel_NULL_pointer_dereference,_address"
+    assert parse_core_lines(lines[:1]).panic is None
+    assert parse_core_lines(["BUG: unable to handle page fault for address: ffff\n"]).panic == "unable_to_handle_page_fault_for_address"
+
+
+def test_minhash():
+    frames = _frames(FREEBSD_TRACE.format("1a", "2b"))
+    sig = crash_buckets.get_minhash(frames)
+    assert len(sig) == crash_buckets.NUM_PERM
+    assert crash_buckets.get_minhash(list(frames)) == sig
+    assert crash_buckets.estimate_similarity(sig, sig) == 1.0
+    near = crash_buckets.get_minhash(frames[:6] + ["other_caller"] + frames[7:])
+    assert crash_buckets.estimate_similarity(sig, near) >= crash_buckets.SIMILARITY_THRESHOLD
+    other = crash_buckets.get_minhash(_frames(LINUX_TRACE))
+    assert crash_buckets.estimate_similarity(sig, other) < crash_buckets.SIMILARITY_THRESHOLD
+    assert crash_buckets.get_minhash([]) is None
+
+
+def test_signature_and_lsh_keys():
+    sig = crash_buckets.get_minhash(TOP)
+    assert crash_buckets.unpack_signature(crash_buckets.pack_signature(sig)) == sig
+    keys = crash_buckets.get_lsh_keys(sig)
+    assert len(keys) == len(set(keys)) == crash_buckets.LSH_BANDS
+    assert crash_buckets.get_lsh_keys(list(sig)) == keys
+
+
+def _record(store, panic, frames, trace_hash):
+    return store.record_crash(
+        trace_hash,
+        panic=panic,
+        crash_dir=trace_hash,
+        bucket=crash_buckets.get_bucket_hash(panic, frames),
+        signature=crash_buckets.get_minhash(frames),
+    )
+
+
+def test_store_clusters_near_duplicates(tmp_path):
+    store = CrashStore(str(tmp_path / "crashes.sqlite"))
+    frames = _frames(FREEBSD_TRACE.format("1a", "2b"))
+    # other offsets: a new trace hash in the same bucket
+    assert _record(store, "page_fault", frames, "t1")
+    assert not _record(store, "page_fault", _frames(FREEBSD_TRACE.format("ff0", "3c")), "t2")
+    # another top frame: a new bucket, clustered through the LSH index
+    near = ["ffs_blkfree_cg", "ffs_blkfree_cg_inlined"] + frames[1:]
+    assert crash_buckets.get_bucket_hash("page_fault", near) != crash_buckets.get_bucket_hash("page_fault", frames)
+    assert not _record(store, "page_fault", near, "t3")
+    # unrelated crash
+    assert _record(store, "ext4_fill_super", _frames(LINUX_TRACE), "t4")
+    clusters = store.clusters()
+    assert [row[2:] for row in clusters] == [(3, 3), (1, 1)]
+    assert [row[1] for row in clusters] == ["page_fault", "ext4_fill_super"]
+    assert [row[0] for row in store.unverified()] == ["t1", "t4"]
+    store.close()
+
+
+def test_store_keeps_panics_apart(tmp_path):
+    store = CrashStore(str(tmp_path / "crashes.sqlite"))
+    frames = _frames(FREEBSD_TRACE.format("1a", "2b"))
+    assert _record(store, "page_fault", frames, "t1")
+    # same frames, other panic: a new bucket that must not join the page_fault cluster through LSH
+    assert _record(store, "ffs_blkfree: freeing free block", frames, "t2")
+    near = ["ffs_blkfree_cg", "ffs_blkfree_cg_inlined"] + frames[1:]
+    assert not _record(store, "ffs_blkfree: freeing free block", near, "t3")
+    assert [row[2:] for row in store.clusters()] == [(2, 2), (1, 1)]
+    store.close()
+
+
+def test_store_without_frames(tmp_path):
+    store = CrashStore(str(tmp_path / "crashes.sqlite"))
+    # no frames: no signature and no LSH keys, crashes only share their exact bucket
+    assert _record(store, "page_fault", [], "t1")
+    assert _record(store, "ext4_fill_super", [], "t2")
+    assert not _record(store, "page_fault", [], "t3")
+    assert store.conn.execute("SELECT COUNT(*) FROM lsh").fetchone()[0] == 0
+    assert [row[0] for row in store.conn.execute("SELECT signature FROM buckets")] == [b"", b""]
+    store.close()
+
+
+def test_store_without_signature(tmp_path):
+    store = CrashStore(str(tmp_path / "crashes.sqlite"))
+    assert store.record_crash("t1", bucket="b1")
+    assert not store.record_crash("t2", bucket="b1")
+    assert store.record_crash("t3", bucket="b2")
+    store.close()
@@ -0,0 +1,89 @@
+import sqlite3
+
+from utility.crash_store import CrashStore, open_crash_store
+
+
+def _store(tmp_path):
+    return CrashStore(str(tmp_path / "crashes.sqlite"))
+
+
+def test_dedup_on_trace_hash(tmp_path):
+    store = _store(tmp_path)
+    assert store.record_crash("a" * 64, panic="page_fault", crash_dir="c1", found_at=10)
+    assert not store.record_crash("a" * 64, panic="page_fault", crash_dir="c2", found_at=20)
+    assert store.record_crash("b" * 64, panic="page_fault", crash_dir="c3", found_at=30)
+    assert len(store) == 3
+    assert store.is_known("a" * 64) and not store.is_known("c" * 64)
+    assert sorted(store.clusters()) == [("a" * 64, "page_fault", 2, 1), ("b" * 64, "page_fault", 1, 1)]
+    store.close()
+
+
+def test_verification(tmp_path):
+    store = _store(tmp_path)
+    store.record_crash("a" * 64, crash_dir="c1", target_os="freebsd")
+    store.record_crash("a" * 64, crash_dir="c2", target_os="freebsd")
+    store.record_crash("b" * 64, panic="ufs_dirbad", crash_dir="c3", target_os="netbsd")
+    # only the first crash of a cluster is verified
+    assert store.unverified() == [("c1", "a" * 64, "freebsd"), ("c3", "b" * 64, "netbsd")]
+    store.mark_verified("c3", 1, '{"reason": "reproduced"}')
+    assert store.unverified() == [("c1", "a" * 64, "freebsd")]
+    assert store.verification_results() == [("c3", "ufs_dirbad", 1, '{"reason": "reproduced"}')]
+    store.close()
+
+
+def test_crashes_per_panic(tmp_path):
+    store = _store(tmp_path)
+    for trace, panic, found_at in [("a", "x", 100), ("a", "x", 3500), ("b", "x", 3700), ("c", "y", 3800)]:
+        store.record_crash(trace * 64, panic=panic, found_at=found_at)
+    assert store.crashes_per_panic(3600) == [("x", 0, 2, 1), ("x", 3600, 1, 1), ("y", 3600, 1, 1)]
+    store.close()
+
+
+def test_import_legacy(tmp_path):
+    crash_dir = tmp_path / "crash_1"
+    crash_dir.mkdir()
+    (tmp_path / "crash.db").write_text(
+        "fuzz0; vm0; ufs2; 10M; radamsa; page_fault; {a}; {d}; 0:01:00; 12\n"
+        "fuzz0; vm0; ufs2; 10M; radamsa; page_fault; {a}; {d}; 0:02:00; 34\n"
+        "broken line\n"
+        "fuzz1; vm1; ext; 10M; byte_flip; ext2_dirbad; {b}; /gone; 0:03:00; n/a\n".format(a="a" * 64, b="b" * 64, d=crash_dir)
+    )
+    store = open_crash_store(str(tmp_path))
+    assert len(store) == 2
+    assert sorted(row[:3] for row in store.clusters()) == [("a" * 64, "page_fault", 1), ("b" * 64, "ext2_dirbad", 1)]
+    # a second open does not import again
+    store.close()
+    store = open_crash_store(str(tmp_path))
+    assert len(store) == 2
+    store.close()
+
+
+def test_migration(tmp_path):
+    # databases of the first schema release lack the bucket, cluster, target_os and verify_details columns
+    path = str(tmp_path / "crashes.sqlite")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE crashes (id INTEGER PRIMARY KEY, found_at REAL NOT NULL, fuzzer TEXT, vm TEXT, fs_type TEXT,"
+        " fs_size TEXT, engine TEXT, seed TEXT, panic TEXT, trace_hash TEXT NOT NULL, crash_dir TEXT, runtime TEXT,"
+        " iteration INTEGER, is_unique INTEGER NOT NULL DEFAULT 0, verify_result INTEGER);"
+        "INSERT INTO crashes (found_at, trace_hash, is_unique) VALUES (1, 'old', 1);"
+    )
+    conn.commit()
+    conn.close()
+    store = CrashStore(path)
+    columns = [row[1] for row in store.conn.execute("PRAGMA table_info(crashes)")]
+    assert {"bucket", "cluster", "target_os", "verify_details"} <= set(columns)
+    assert "panic" in [row[1] for row in store.conn.execute("PRAGMA table_info(buckets)")]
+    assert store.record_crash("new", crash_dir="c1")
+    assert len(store) == 2
+    store.close()
+
+
+def test_shared_between_connections(tmp_path):
+    # several fuzzer processes open the same file
+    first, second = _store(tmp_path), _store(tmp_path)
+    assert first.record_crash("a" * 64)
+    assert not second.record_crash("a" * 64)
+    assert len(first) == len(second) == 2
+    first.close()
+    second.close()
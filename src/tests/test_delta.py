@@ -0,0 +1,189 @@
+import hashlib
+import mmap
+import pathlib
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from delta import Delta, FullImage, diff_image_file, diff_images, get_image_id
+from mutation_buffer import MutationBuffer
+
+SRC = pathlib.Path(__file__).resolve().parent.parent
+PATCHES = [(0, b"\xff\xfe"), (4095, b"ab"), (10000, bytes(300)), (65535, b"z")]
+
+
+def mutate(path, patches, size=None):
+    # the image content of path resized to size, with (offset, new bytes) patches applied
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    if size is not None:
+        data = data[:size] + bytes(max(size - len(data), 0))
+    for offset, new in patches:
+        data[offset : offset + len(new)] = new
+    return bytes(data)
+
+
+def _materialize(delta, seed, tmp_path):
+    out = tmp_path / "out.img"
+    delta.materialize(seed, str(out))
+    return out.read_bytes()
+
+
+def test_bytes_round_trip(seed):
+    delta = Delta(get_image_id(seed), 1 << 16)
+    delta.add(12, b"ab", b"cd")
+    delta.add(1 << 40, b"", b"")
+    loaded = Delta.from_bytes(delta.to_bytes())
+    assert loaded.seed_id == delta.seed_id
+    assert loaded.size == delta.size
+    assert loaded.patches == delta.patches
+
+
+def test_save_load(seed, tmp_path):
+    delta = Delta(get_image_id(seed), 123, [(1, b"x", b"y")])
+    loaded = Delta.load(delta.save(str(tmp_path / "x.delta")))
+    assert (loaded.seed_id, loaded.size, loaded.patches) == (delta.seed_id, 123, [(1, b"x", b"y")])
+
+
+def test_bad_magic():
+    with pytest.raises(ValueError):
+        Delta.from_bytes(b"NOTDELTA" + bytes(44))
+
+
+@pytest.mark.parametrize("size", [64 << 10, (64 << 10) + 5000, 30000])
+def test_diff_materialize(seed, tmp_path, size):
+    mutated = mutate(seed, [p for p in PATCHES if p[0] + len(p[1]) <= size], size)
+    delta = diff_images(seed, mutated)
+    assert delta.size == size
+    assert _materialize(Delta.from_bytes(delta.to_bytes()), seed, tmp_path) == mutated
+
+
+def test_diff_is_minimal(seed):
+    mutated = mutate(seed, [(100, b"\x00\x01\x02")])
+    old = mutate(seed, [])[100:103]
+    delta = diff_images(seed, mutated)
+    assert delta.patches == [(100, old, b"\x00\x01\x02")]
+    assert delta.mutated_bytes() == 3
+
+
+def test_diff_unchanged(seed):
+    assert len(diff_images(seed, mutate(seed, []))) == 0
+
+
+def test_diff_max_bytes(seed, tmp_path):
+    mutated = mutate(seed, [(100, b"\x00\x01\x02"), (5000, bytes(100))])
+    assert diff_images(seed, mutated, max_bytes=103).mutated_bytes() == 103
+    assert diff_images(seed, mutated, max_bytes=102) is None
+    # growth beyond the seed counts as well
+    grown = mutate(seed, [], (64 << 10) + 50)
+    assert diff_images(seed, grown, max_bytes=50).mutated_bytes() == 50
+    assert diff_images(seed, grown, max_bytes=49) is None
+    assert len(diff_images(seed, mutate(seed, []), max_bytes=0)) == 0
+
+
+def test_diff_image_file(seed, tmp_path):
+    mfs = tmp_path / "mfs.img"
+    mfs.write_bytes(mutate(seed, PATCHES))
+    assert diff_image_file(seed, str(mfs)).patches == diff_images(seed, mfs.read_bytes()).patches
+    mfs.write_bytes(b"")
+    assert diff_image_file(seed, str(mfs)).size == 0
+
+
+def test_full_image(seed, tmp_path):
+    image = tmp_path / "full.img"
+    image.write_bytes(bytes(1000))
+    full = FullImage(get_image_id(seed), str(image))
+    # no patches to apply, callers copy the image instead
+    assert not full and full.mutated_bytes() == full.size == 1000
+    assert _materialize(full, seed, tmp_path) == bytes(1000)
+    full.remove()
+    full.remove()
+    assert not image.exists()
+
+
+def test_image_id_of_mapping(seed, tmp_path):
+    copy = tmp_path / "copy.img"
+    shutil.copyfile(seed, copy)
+    with open(copy, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        assert get_image_id(str(copy), mm) == hashlib.sha256(mm[:]).hexdigest() == get_image_id(seed)
+
+
+def test_materialize_wrong_seed(seed, tmp_path):
+    delta = Delta("00" * 32, 16)
+    with pytest.raises(ValueError):
+        delta.materialize(seed, str(tmp_path / "out.img"))
+
+
+def test_mutation_buffer(seed, tmp_path):
+    mfs = tmp_path / "mfs.img"
+    with MutationBuffer(seed, str(mfs), materialize=False) as buf:
+        buf.write(10, b"abc")
+        buf.write(11, b"XY")
+        assert buf.read(9, 5) == mutate(seed, [(10, b"aXY")])[9:14]
+        with pytest.raises(IndexError):
+            buf.write(len(buf) - 1, b"12")
+        delta = buf.delta
+        buf.materialize()
+    assert mfs.read_bytes() == mutate(seed, [(10, b"aXY")])
+    # the delta replays onto the seed, later patches win
+    assert _materialize(delta, seed, tmp_path) == mfs.read_bytes()
+
+
+def test_mutation_buffer_after_materialize(seed, tmp_path):
+    mfs = tmp_path / "mfs.img"
+    original = pathlib.Path(seed).read_bytes()
+    with MutationBuffer(seed, str(mfs), materialize=False) as buf:
+        buf.write(10, b"abc")
+        buf.materialize()
+        # the buffer now works on mfs
+        assert buf.read(10, 3) == b"abc"
+        buf.write(20, b"xyz")
+        assert buf.read(20, 3) == b"xyz"
+        delta = buf.delta
+    assert mfs.read_bytes() == mutate(seed, [(10, b"abc"), (20, b"xyz")])
+    assert _materialize(delta, seed, tmp_path) == mfs.read_bytes()
+    assert pathlib.Path(seed).read_bytes() == original
+
+
+def test_mutation_buffer_without_mfs(seed):
+    original = pathlib.Path(seed).read_bytes()
+    with pytest.raises(ValueError):
+        MutationBuffer(seed, seed, materialize=False)
+    # without an mfs the buffer only records the delta
+    with MutationBuffer(seed, materialize=False) as buf:
+        buf.write(0, b"a")
+        with pytest.raises(ValueError):
+            buf.materialize()
+    assert pathlib.Path(seed).read_bytes() == original
+
+
+def test_guest_applier(seed, tmp_path):
+    # utility/apply_delta.py is the python3 guest side of Delta
+    mutated = mutate(seed, PATCHES, 70000)
+    delta_file = diff_images(seed, mutated).save(str(tmp_path / "x.delta"))
+    out = tmp_path / "out.img"
+    result = subprocess.run(
+        [sys.executable, str(SRC / "utility" / "apply_delta.py"), seed, delta_file, str(out)], capture_output=True, text=True
+    )
+    assert result.stdout.strip() == "OK"
+    assert out.read_bytes() == mutated
+
+
+@pytest.mark.skipif(not shutil.which("dd"), reason="no dd")
+@pytest.mark.parametrize("size", [64 << 10, 70000, 30000])
+def test_shell_script(seed, tmp_path, size):
+    mutated = mutate(seed, [(0, bytes(range(256)) * 5)] + [p for p in PATCHES if p[0] + len(p[1]) <= size], size)
+    delta = diff_images(seed, mutated)
+    out = tmp_path / "out.img"
+    script = delta.to_shell_script(seed, str(out))
+    result = subprocess.run(["sh", "-s"], input=script, capture_output=True, text=True)
+    assert result.stdout.strip() == "OK"
+    assert out.read_bytes() == mutated
+
+
+def test_shell_script_missing_seed(seed, tmp_path):
+    script = Delta(get_image_id(seed), 1).to_shell_script(str(tmp_path / "gone"), str(tmp_path / "out"))
+    result = subprocess.run(["sh", "-s"], input=script, capture_output=True, text=True)
+    assert (result.returncode, result.stdout.strip()) == (2, "MISSING_SEED")
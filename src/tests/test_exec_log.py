@@ -0,0 +1,98 @@
+import pytest
+
+from exec_log import (
+    EXEC_CRASHED,
+    EXEC_FAILED,
+    EXEC_OK,
+    MOUNT_CRASHED,
+    NO_OUTPUT,
+    ExecLog,
+    get_command_chain,
+    hash_output,
+    is_exec_log,
+    read_exec_log,
+)
+
+
+def _write_log(path):
+    with ExecLog(str(path)) as log:
+        log.append("mkdir /mnt/a", EXEC_OK, 0, 0.0015, "")
+        log.append("rm /mnt/nope", EXEC_FAILED, 1, 0.25, "No such file or directory")
+        log.append("ls /mnt/ä", EXEC_OK, 0, 1.5, "ä\n")
+        log.append("cat /mnt/a/b", EXEC_CRASHED)
+    return str(path)
+
+
+def test_round_trip(tmp_path):
+    records = list(read_exec_log(_write_log(tmp_path / "exec.log")))
+    assert [r.command for r in records] == ["mkdir /mnt/a", "rm /mnt/nope", "ls /mnt/ä", "cat /mnt/a/b"]
+    assert [r.status for r in records] == [EXEC_OK, EXEC_FAILED, EXEC_OK, EXEC_CRASHED]
+    assert [r.exit_code for r in records] == [0, 1, 0, -1]
+    assert [r.latency for r in records] == [0.0015, 0.25, 1.5, 0.0]
+    assert records[1].output_hash == hash_output("No such file or directory")
+    assert records[3].output_hash == NO_OUTPUT
+
+
+def test_hash_output():
+    assert hash_output(None) == NO_OUTPUT
+    assert hash_output(2) == NO_OUTPUT  # _exec error codes
+    assert hash_output("") != NO_OUTPUT
+    assert len(hash_output("x")) == 16
+
+
+def test_command_chain(tmp_path):
+    # failed commands are left out, the crashing one is the last of the chain
+    assert get_command_chain(_write_log(tmp_path / "exec.log")) == ["mkdir /mnt/a", "ls /mnt/ä", "cat /mnt/a/b"]
+
+
+def test_mount_crash(tmp_path):
+    path = str(tmp_path / "exec.log")
+    with ExecLog(path) as log:
+        log.append("", MOUNT_CRASHED)
+    assert [r.status for r in read_exec_log(path)] == [MOUNT_CRASHED]
+    assert get_command_chain(path) == []
+
+
+def test_torn_record(tmp_path):
+    path = _write_log(tmp_path / "exec.log")
+    with open(path, "rb") as f:
+        data = f.read()
+    for cut in [1, 5, 30]:
+        with open(path, "wb") as f:
+            f.write(data[:-cut])
+        assert [r.command for r in read_exec_log(path)] == ["mkdir /mnt/a", "rm /mnt/nope", "ls /mnt/ä"]
+
+
+def test_recreated(tmp_path):
+    # a crash directory may still hold a hard link to the previous log
+    path = _write_log(tmp_path / "exec.log")
+    link = tmp_path / "crash.log"
+    link.hardlink_to(path)
+    with ExecLog(path) as log:
+        log.append("true", EXEC_OK, 0)
+    assert len(list(read_exec_log(str(link)))) == 4
+    assert len(list(read_exec_log(path))) == 1
+
+
+def test_commit_is_durable(tmp_path):
+    path = str(tmp_path / "exec.log")
+    log = ExecLog(path)
+    log.append("sync", EXEC_OK, 0)
+    log.commit()
+    assert [r.command for r in read_exec_log(path)] == ["sync"]
+    log.close()
+
+
+def test_bad_magic(tmp_path):
+    path = tmp_path / "syscall.log"
+    path.write_text("[+] mkdir /mnt/a\n")
+    assert not is_exec_log(str(path))
+    with pytest.raises(ValueError):
+        list(read_exec_log(str(path)))
+    assert is_exec_log(_write_log(tmp_path / "exec.log"))
+
+
+def test_legacy_command_chain(tmp_path):
+    path = tmp_path / "syscall.log"
+    path.write_text("[+] mkdir /mnt/a\n[-] rm /mnt/nope\n[!] mount /dev/md0 /mnt\n[+] ls /mnt\n[!] cat /mnt/a/b\n")
+    assert get_command_chain(str(path)) == ["mkdir /mnt/a", "ls /mnt", "cat /mnt/a/b"]
@@ -0,0 +1,167 @@
+import subprocess
+
+import pytest
+
+import images
+from file_system_magic.ext_superblock_parser import EXT, MAGIC_BYTES_OFF
+from file_system_magic.ufs_superblock_parser import UFS
+
+needs_e2fsprogs = pytest.mark.skipif(not images.HAS_E2FSPROGS, reason="needs e2fsprogs")
+
+EXT_VARIANTS = [
+    # (mkfs.ext4 -O, image size in KiB)
+    ("sparse_super,^64bit", 28 << 10),
+    ("sparse_super,64bit", 28 << 10),
+    ("^sparse_super,^resize_inode", 8 << 10),
+    ("sparse_super2", 12 << 10),
+    ("^metadata_csum,^64bit", 28 << 10),
+]
+
+
+def _ext(fs):
+    return EXT(fs, "ext")
+
+
+@needs_e2fsprogs
+@pytest.mark.parametrize("features,size_kb", EXT_VARIANTS)
+def test_ext_matches_dumpe2fs(tmp_path, features, size_kb):
+    fs = images.make_ext(tmp_path / "seed.img", size_kb=size_kb, features=features)
+    sbs, gdts, itables = images.dumpe2fs(fs)
+    ext = _ext(fs)
+    geo = ext.get_geometry()
+    assert geo.ngroups == -(-(size_kb - 1) // 2048)
+    assert ext.calc_superblock_locations(geo) == sbs
+    assert ext.calc_group_descriptor_locations(geo) == gdts
+    assert ext.calc_inode_table_locations(geo) == itables
+    assert ext.find_all_superblocks() == sbs
+
+
+@needs_e2fsprogs
+def test_ext_4k_blocks(tmp_path):
+    fs = str(tmp_path / "seed.img")
+    subprocess.run(["mkfs.ext4", "-q", "-F", "-b", "4096", "-g", "1024", fs, "16M"], check=True, capture_output=True)
+    sbs, gdts, itables = images.dumpe2fs(fs)
+    ext = _ext(fs)
+    geo = ext.get_geometry()
+    assert (geo.bsize, geo.first_dblock, geo.ngroups) == (4096, 0, 4)
+    assert ext.calc_superblock_locations(geo) == sbs == [1024, 4 << 20, 12 << 20]
+    assert ext.calc_group_descriptor_locations(geo) == gdts
+    assert ext.calc_inode_table_locations(geo) == itables
+
+
+@needs_e2fsprogs
+def test_ext_meta_bg(tmp_path):
+    fs = images.make_ext(tmp_path / "seed.img", features="meta_bg,^resize_inode")
+    ext = _ext(fs)
+    assert ext.get_geometry().meta_bg
+    assert ext.calc_superblock_locations() == images.dumpe2fs(fs)[0]
+    assert ext.calc_group_descriptor_locations() == []
+    assert ext.calc_inode_table_locations() == []
+
+
+@needs_e2fsprogs
+def test_ext_truncated_image(tmp_path):
+    # groups starting beyond the end of the image are left out
+    fs = images.make_ext(tmp_path / "seed.img", size_kb=28 << 10)
+    sbs = images.dumpe2fs(fs)[0]
+    with open(fs, "r+b") as f:
+        f.truncate(10 << 20)
+    ext = _ext(fs)
+    assert ext.get_geometry().ngroups == 5
+    assert ext.calc_superblock_locations() == [loc for loc in sbs if loc < 10 << 20]
+
+
+@needs_e2fsprogs
+def test_ext_damaged_backup_falls_back_to_uuid_scan(tmp_path):
+    fs = images.make_ext(tmp_path / "seed.img", size_kb=28 << 10)
+    sbs = images.dumpe2fs(fs)[0]
+    with open(fs, "r+b") as f:
+        # the backup of group 3 loses its magic, group 5 its uuid, groups 1, 7 and 9 stay intact
+        f.seek(sbs[2] + MAGIC_BYTES_OFF)
+        f.write(b"\x00\x00")
+        f.seek(sbs[3] + 104)
+        f.write(b"\x00" * 16)
+    assert _ext(fs).find_all_superblocks() == sbs[:2] + sbs[4:]
+
+
+@needs_e2fsprogs
+def test_ext_unusable_geometry(tmp_path):
+    fs = images.make_ext(tmp_path / "seed.img")
+    sbs = images.dumpe2fs(fs)[0]
+    with open(fs, "r+b") as f:
+        f.seek(1024 + EXT.get_offset_in_sb("e2fs_bpg")[0])
+        f.write(b"\x00" * 4)
+    ext = _ext(fs)
+    assert ext.get_geometry() is None
+    assert ext.calc_superblock_locations() == []
+    assert ext.find_all_superblocks() == sbs
+
+
+UFS_VARIANTS = [
+    images.UfsImage("ufs2"),
+    images.UfsImage("ufs2", ncg=6, fsize=4096, fpg=64, sblkno=24, cblkno=32),
+    images.UfsImage("ufs1"),
+    images.UfsImage("ufs1", ncg=5, cgoffset=16, cgmask=-4),
+]
+
+
+def _damage(fs, offset, data):
+    with open(fs, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+@pytest.mark.parametrize("ufs", UFS_VARIANTS, ids=lambda u: "{}-{}cg".format(u.fst, u.ncg))
+def test_ufs_geometry(tmp_path, ufs):
+    fs = ufs.build(tmp_path / "seed.img")
+    parser = UFS(fs, ufs.fst)
+    geo = parser.get_geometry()
+    assert (geo.fsize, geo.fpg, geo.ncg) == (ufs.fsize, ufs.fpg, ufs.ncg)
+    assert parser.calc_superblock_locations(geo) == ufs.sb_locs()
+    assert parser.calc_cylinder_group_locations(geo) == ufs.cg_locs()
+    assert parser.find_all_superblocks() == ufs.sb_locs()
+    assert parser.find_all_cylinder_groups() == ufs.cg_locs()
+
+
+def test_ufs1_staggered_groups():
+    ufs = images.UfsImage("ufs1", ncg=5, fsize=2048, fpg=128, cgoffset=16, cgmask=-4)
+    # cgstart() moves the metadata of every group by cgoffset * (cg mod 4) fragments
+    assert [ufs.cg_start(cg) // 2048 for cg in range(5)] == [0, 144, 288, 432, 512]
+
+
+@pytest.mark.parametrize("ufs", UFS_VARIANTS, ids=lambda u: "{}-{}cg".format(u.fst, u.ncg))
+def test_ufs_damaged_backup_falls_back_to_magic_scan(tmp_path, ufs):
+    fs = ufs.build(tmp_path / "seed.img")
+    sb = ufs.sb_locs()
+    _damage(fs, sb[2] + images.SB_SIZE - 4, b"\x00" * 4)
+    assert UFS(fs, ufs.fst).find_all_superblocks() == sb[:2] + sb[3:]
+
+
+@pytest.mark.parametrize("ufs", UFS_VARIANTS, ids=lambda u: "{}-{}cg".format(u.fst, u.ncg))
+def test_ufs_damaged_primary(tmp_path, ufs):
+    # unusable geometry: every backup is found by its magic, the primary location always comes first
+    fs = ufs.build(tmp_path / "seed.img")
+    _damage(fs, ufs.sbo + images.SB_FIELDS["fs_fsize"].offset, b"\x00\x03\x00\x00")
+    parser = UFS(fs, ufs.fst)
+    assert parser.get_geometry() is None
+    assert parser.find_all_superblocks() == ufs.sb_locs()
+    assert parser.find_all_cylinder_groups() == ufs.cg_locs()
+
+
+def test_ufs_other_version_magic_is_ignored(tmp_path):
+    # a UFS2 backup pasted into a UFS1 image is not one of its superblocks
+    ufs = images.UfsImage("ufs1")
+    fs = ufs.build(tmp_path / "seed.img")
+    sb = ufs.sb_locs()
+    _damage(fs, sb[1] + images.SB_SIZE - 4, images.UFS2_MAGIC.to_bytes(4, "little"))
+    assert UFS(fs, "ufs1").find_all_superblocks() == sb[:1] + sb[2:]
+
+
+def test_ufs_truncated_image(tmp_path):
+    ufs = images.UfsImage("ufs2", ncg=4)
+    fs = ufs.build(tmp_path / "seed.img")
+    with open(fs, "r+b") as f:
+        f.truncate(ufs.cg_start(2) + 4096)
+    parser = UFS(fs, "ufs2")
+    assert parser.calc_superblock_locations() == ufs.sb_locs()[:2]
+    assert parser.calc_cylinder_group_locations() == ufs.cg_locs()[:2]
@@ -0,0 +1,171 @@
+import itertools
+import json
+import os
+
+from Fuzzer.delta import Delta, diff_images
+from Fuzzer.exec_log import EXEC_CRASHED, EXEC_OK, ExecLog
+from Verifier.Minimizer import MIN_DELTA_ROLE, MINIMIZED_NAME, Minimizer, _split, ddmin, split_patches
+from utility import blob_store
+
+CRASH_OFFSETS = [100, 5000]  # both bytes must be mutated to crash
+CRASH_COMMAND = "cat /mnt/a"
+
+
+def _runs(test):
+    calls = []
+
+    def counted(subset):
+        calls.append(list(subset))
+        return test(subset)
+
+    return counted, calls
+
+
+def test_split():
+    assert _split(list(range(10)), 3) == [[0, 1, 2], [3, 4, 5], [6, 7, 8, 9]]
+    assert _split([1, 2], 4) == [[1], [2]]
+    assert sum(_split(list(range(7)), 7), []) == list(range(7))
+
+
+def test_ddmin_single():
+    assert ddmin(list(range(100)), lambda s: 42 in s) == [42]
+
+
+def test_ddmin_pair():
+    assert ddmin(list(range(64)), lambda s: 3 in s and 60 in s) == [3, 60]
+
+
+def test_ddmin_is_1_minimal():
+    # the failure needs any two of the odd numbers below 10
+    def test(subset):
+        return len([x for x in subset if x % 2 and x < 10]) >= 2
+
+    result = ddmin(list(range(32)), test)
+    assert test(result) and len(result) == 2
+    assert not any(test(list(c)) for c in itertools.combinations(result, 1))
+
+
+def test_ddmin_empty_fails():
+    test, calls = _runs(lambda s: True)
+    assert ddmin([1, 2, 3], test) == []
+    assert calls == [[]]
+
+
+def test_ddmin_keeps_everything_needed():
+    assert ddmin([1, 2, 3], lambda s: s == [1, 2, 3]) == [1, 2, 3]
+
+
+def test_ddmin_caches():
+    test, calls = _runs(lambda s: 5 in s and 9 in s)
+    ddmin(list(range(16)), test)
+    assert len(calls) == len(set(map(tuple, calls)))
+
+
+def test_split_patches():
+    # one patch per changed byte, unchanged bytes inside a patch are dropped
+    patches = split_patches(type("D", (), {"patches": [(10, b"abc", b"aXY"), (20, b"", b"")]})())
+    assert patches == [(11, b"b", b"X"), (12, b"c", b"Y")]
+
+
+class FakeVm:
+    def __init__(self):
+        self.snapshots = set()
+
+    def delete_snapshot(self, name):
+        self.snapshots.discard(name)
+
+    def create_snapshot_with_name(self, name):
+        self.snapshots.add(name)
+
+    def revert_to_running_snapshot(self, name):
+        assert name in self.snapshots
+
+
+class FakeReport:
+    panic = "page_fault"
+
+    def sanitized_trace(self):
+        return "ffs_blkfree() at ffs_blkfree+0x1a\nffs_truncate() at ffs_truncate+0x2b\n"
+
+
+class FakeWorker:
+    # Crashes once the image has both CRASH_OFFSETS mutated and CRASH_COMMAND runs
+    def __init__(self, seed):
+        self.vm_name = "verifier0"
+        self.vm_object = FakeVm()
+        with open(seed, "rb") as f:
+            self.seed = f.read()
+
+    def run_case(self, workdir, image_name, command_chain):
+        with open(os.path.join(workdir, image_name), "rb") as f:
+            image = f.read()
+        if any(image[off] == self.seed[off] for off in CRASH_OFFSETS):
+            return None
+        return CRASH_COMMAND if CRASH_COMMAND in command_chain else None
+
+    def reset_verifier_vm(self):
+        pass
+
+    def get_report_of_repro_crash(self, workdir):
+        return FakeReport()
+
+
+def _crash_dir(tmp_path, seed, store):
+    crash_dir = tmp_path / "crash"
+    crash_dir.mkdir()
+    with open(seed, "rb") as f:
+        data = bytearray(f.read())
+    for off in CRASH_OFFSETS + [7, 2000, 2001, 9000, 20000]:
+        data[off] ^= 0xFF
+    delta = diff_images(seed, bytes(data)).save(str(tmp_path / "mfs.img.delta"))
+    log = str(tmp_path / "exec.log")
+    with ExecLog(log) as exec_log:
+        for command in ["mkdir /mnt/a", "ls /mnt", "touch /mnt/b"]:
+            exec_log.append(command, EXEC_OK, 0)
+        exec_log.append(CRASH_COMMAND, EXEC_CRASHED)
+    manifest = {
+        "seed.img": {"blob": store.put(seed), "role": "seed"},
+        "mfs.img.delta": {"blob": store.put(delta), "role": "delta"},
+        "exec.log": {"blob": store.put(log), "role": "log"},
+    }
+    blob_store.write_manifest(str(crash_dir), manifest)
+    return str(crash_dir)
+
+
+def test_minimize(seed, tmp_path):
+    store = blob_store.BlobStore(str(tmp_path / "blobs"), codec="zip")
+    crash_dir = _crash_dir(tmp_path, seed, store)
+    worker = FakeWorker(seed)
+    summary = Minimizer(worker, store).minimize(crash_dir)
+    assert summary["mutated_bytes"] == 7
+    assert summary["min_mutated_bytes"] == 2
+    assert summary["commands"] == 4
+    assert summary["min_commands"] == [CRASH_COMMAND]
+    assert not summary["exhausted"]
+    assert not worker.vm_object.snapshots
+    with open(os.path.join(crash_dir, MINIMIZED_NAME)) as f:
+        assert json.load(f) == summary
+    # the minimized delta is stored next to the original artifacts
+    manifest = blob_store.read_manifest(crash_dir)
+    name, blob = blob_store.get_artifact_by_role(manifest, MIN_DELTA_ROLE)
+    assert name == "mfs.img.min.delta"
+    min_delta = Delta.load(store.get(blob, str(tmp_path / name)))
+    assert sorted(off for off, _, _ in min_delta.patches) == CRASH_OFFSETS
+    store.close()
+
+
+def test_minimize_budget(seed, tmp_path):
+    store = blob_store.BlobStore(str(tmp_path / "blobs"), codec="zip")
+    crash_dir = _crash_dir(tmp_path, seed, store)
+    summary = Minimizer(FakeWorker(seed), store, max_runs=6).minimize(crash_dir)
+    assert summary["exhausted"] and summary["runs"] == 6
+    assert summary["min_mutated_bytes"] <= 7
+    store.close()
+
+
+def test_minimize_without_seed(seed, tmp_path):
+    crash_dir = tmp_path / "crash"
+    crash_dir.mkdir()
+    store = blob_store.BlobStore(str(tmp_path / "blobs"), codec="zip")
+    assert Minimizer(FakeWorker(seed), store).minimize(str(crash_dir)) is None
+    store.close()
@@ -0,0 +1,262 @@
+import struct
+
+import pytest
+
+from file_system_magic.zfs_uberblock_parser import (
+    BLKPTR_SIZE,
+    MMP_MAGIC,
+    UB_USED_SIZE,
+    VDEV_LABEL_SIZE,
+    VDEV_LABEL_START_SIZE,
+    VDEV_PHYS_OFF,
+    VDEV_UBERBLOCK_RING_OFF,
+    ZFS,
+    ZFS_MAGIC,
+    decode_blkptr,
+    unpack_nvlist,
+)
+
+# {"version": uint64 5000, "name": "tank"} as zpool writes it: XDR encoding, NV_UNIQUE_NAME
+PACKED_NVLIST = bytes.fromhex(
+    "01010000" "00000000" "00000001"
+    "00000024" "00000024" "00000007" "76657273696f6e00" "00000008" "00000001" "0000000000001388"
+    "00000020" "00000020" "00000004" "6e616d65" "00000009" "00000001" "00000004" "74616e6b"
+    "00000000" "00000000"
+)
+
+
+def _xdr_string(s):
+    raw = s.encode()
+    return struct.pack(">I", len(raw)) + raw + bytes(-len(raw) % 4)
+
+
+def _xdr_nvlist(items):
+    # items: [(name, data type, nelem, XDR encoded value)]
+    out = struct.pack(">iI", 0, 1)
+    for name, dtype, nelem, value in items:
+        pair = _xdr_string(name) + struct.pack(">ii", dtype, nelem) + value
+        out += struct.pack(">ii", len(pair) + 8, len(pair) + 8) + pair
+    return out + bytes(8)
+
+
+def pack_nvlist(items):
+    return b"\x01\x01\x00\x00" + _xdr_nvlist(items)
+
+
+def uint64(name, value):
+    return name, 8, 1, struct.pack(">Q", value)
+
+
+def string(name, value):
+    return name, 9, 1, _xdr_string(value)
+
+
+def nvlist(name, items):
+    return name, 19, 1, _xdr_nvlist(items)
+
+
+def test_fixed_blob():
+    nvl, used = unpack_nvlist(PACKED_NVLIST + bytes(100))
+    assert nvl == {"version": 5000, "name": "tank"}
+    assert list(nvl) == ["version", "name"]
+    assert used == len(PACKED_NVLIST)
+    assert pack_nvlist([uint64("version", 5000), string("name", "tank")]) == PACKED_NVLIST
+
+
+def test_data_types():
+    items = [
+        ("flag", 1, 0, b""),
+        ("int32", 5, 1, struct.pack(">i", -3)),
+        ("uint8", 23, 1, struct.pack(">I", 255)),
+        ("int64", 7, 1, struct.pack(">q", -(1 << 40))),
+        uint64("guid", 0xFEDCBA9876543210),
+        ("bytes", 10, 5, b"\x01\x02\x03\x04\x05\x00\x00\x00"),
+        ("uint64s", 16, 3, struct.pack(">I3Q", 3, 1, 2, 3)),
+        ("strings", 17, 2, _xdr_string("a") + _xdr_string("bcdef")),
+        ("hrtime", 18, 1, struct.pack(">q", 99)),
+        ("unknown", 99, 1, b"\xde\xad\xbe\xef"),
+        string("after", "unknown types are skipped"),
+    ]
+    nvl, _ = unpack_nvlist(pack_nvlist(items))
+    assert nvl == {
+        "flag": True,
+        "int32": -3,
+        "uint8": 255,
+        "int64": -(1 << 40),
+        "guid": 0xFEDCBA9876543210,
+        "bytes": b"\x01\x02\x03\x04\x05",
+        "uint64s": [1, 2, 3],
+        "strings": ["a", "bcdef"],
+        "hrtime": 99,
+        "unknown": None,
+        "after": "unknown types are skipped",
+    }
+
+
+def test_nested():
+    children = [_xdr_nvlist([string("type", "disk"), uint64("id", i)]) for i in range(2)]
+    items = [
+        nvlist("vdev_tree", [string("type", "mirror"), uint64("ashift", 12), ("children", 20, 2, b"".join(children))]),
+        uint64("txg", 4),
+    ]
+    nvl, _ = unpack_nvlist(pack_nvlist(items))
+    assert nvl["vdev_tree"]["children"] == [{"type": "disk", "id": 0}, {"type": "disk", "id": 1}]
+    assert nvl["vdev_tree"]["ashift"] == 12 and nvl["txg"] == 4
+
+
+@pytest.mark.parametrize("cut", [3, 8, 30, 60])
+def test_truncated(cut):
+    with pytest.raises(ValueError):
+        unpack_nvlist(PACKED_NVLIST[:cut])
+
+
+def test_bad_input():
+    with pytest.raises(ValueError):
+        unpack_nvlist(b"\x00\x01\x00\x00" + PACKED_NVLIST[4:])  # native encoding
+    # an encoded size running past the buffer
+    with pytest.raises(ValueError):
+        unpack_nvlist(PACKED_NVLIST[:12] + struct.pack(">i", 1 << 20) + PACKED_NVLIST[16:])
+    # an array claiming more elements than bytes are left
+    with pytest.raises(ValueError):
+        unpack_nvlist(pack_nvlist([("uint64s", 16, 1, struct.pack(">I", 1 << 30))]))
+    nested = []
+    for _ in range(20):
+        nested = [nvlist("n", nested)]
+    with pytest.raises(ValueError):
+        unpack_nvlist(pack_nvlist(nested))
+
+
+def _dva(vdev, asize_sectors, offset_sectors, gang=False):
+    return struct.pack("<QQ", vdev << 32 | asize_sectors, offset_sectors | gang << 63)
+
+
+def _blkptr(dvas, prop, birth=7, fill=1):
+    dvas = dvas + [bytes(16)] * (3 - len(dvas))
+    return b"".join(dvas) + struct.pack("<QQQQQQ4Q", prop, 0, 0, birth, birth, fill, 1, 2, 3, 4)
+
+
+# lsize 32 sectors, psize 4 sectors, lz4, fletcher4, DMU_OT_OBJSET, level 1, little endian
+PROP = 31 | 3 << 16 | 15 << 32 | 7 << 40 | 11 << 48 | 1 << 56 | 1 << 63
+
+
+def test_blkptr():
+    data = _blkptr([_dva(0, 4, 0x40), _dva(1, 8, 0x80, gang=True)], PROP)
+    assert len(data) == BLKPTR_SIZE
+    bp = decode_blkptr(data)
+    assert bp["dvas"] == [
+        {"vdev": 0, "grid": 0, "asize": 2048, "offset": 0x8000, "gang": False},
+        {"vdev": 1, "grid": 0, "asize": 4096, "offset": 0x10000, "gang": True},
+    ]
+    assert (bp["lsize"], bp["psize"]) == (16384, 2048)
+    assert (bp["compression"], bp["checksum"]) == ("lz4", "fletcher4")
+    assert (bp["type"], bp["level"], bp["byteorder"]) == (11, 1, "little")
+    assert not (bp["embedded"] or bp["encrypted"] or bp["dedup"])
+    assert (bp["phys_birth"], bp["birth"], bp["fill"]) == (7, 7, 1)
+    assert bp["cksum"] == ["0x1", "0x2", "0x3", "0x4"]
+
+
+def test_embedded_blkptr():
+    # lsize and psize in bytes, the DVA words hold the payload
+    prop = 99 | 9 << 25 | 1 << 39 | 15 << 32 | 2 << 48
+    bp = decode_blkptr(b"\xff" * 48 + struct.pack("<Q", prop) + bytes(72))
+    assert bp["embedded"] and bp["dvas"] == []
+    assert (bp["lsize"], bp["psize"], bp["compression"]) == (100, 10, "lz4")
+    assert "checksum" not in bp
+
+
+def test_blkptr_unknown_enums():
+    bp = decode_blkptr(_blkptr([], 100 << 32 | 200 << 40))
+    assert (bp["compression"], bp["checksum"], bp["byteorder"]) == (100, 200, "big")
+
+
+IMAGE_SIZE = 8 << 20
+ROOTBP_SECTOR = 0x40
+
+
+def _uberblock(txg, timestamp, mmp=False):
+    ub = struct.pack("<5Q", 0x00BAB10C, 5000, txg, 0x1234, timestamp)
+    ub += _blkptr([_dva(0, 4, ROOTBP_SECTOR), _dva(0, 4, ROOTBP_SECTOR + 8), _dva(1, 4, 0x10)], PROP, birth=txg)
+    ub += struct.pack("<5Q", 5000, struct.unpack("<Q", MMP_MAGIC)[0] if mmp else 0, 1000, 0x7 | 5 << 8 | 3 << 32 | 10 << 48, 0)
+    assert len(ub) == UB_USED_SIZE
+    return ub
+
+
+def make_zfs(path, ashift=12, damaged_label=None):
+    # a single disk vdev (id 0) with two uberblocks in every label ring and a copy of the MOS objset
+    img = bytearray(IMAGE_SIZE)
+    config = pack_nvlist(
+        [
+            uint64("version", 5000),
+            string("name", "tank"),
+            nvlist("vdev_tree", [string("type", "disk"), uint64("id", 0), uint64("ashift", ashift)]),
+        ]
+    )
+    slot = 1 << min(max(ashift, 10), 13)  # VDEV_UBERBLOCK_SHIFT
+    for i, label in enumerate([0, VDEV_LABEL_SIZE, IMAGE_SIZE - 2 * VDEV_LABEL_SIZE, IMAGE_SIZE - VDEV_LABEL_SIZE]):
+        if i != damaged_label:
+            img[label + VDEV_PHYS_OFF : label + VDEV_PHYS_OFF + len(config)] = config
+        for txg, timestamp in [(5, 100), (7, 90), (7, 95)]:
+            ring_slot = txg + timestamp % 2
+            loc = label + VDEV_UBERBLOCK_RING_OFF + ring_slot * slot
+            img[loc : loc + UB_USED_SIZE] = _uberblock(txg, timestamp, mmp=txg == 7)
+    with open(path, "wb") as f:
+        f.write(img)
+    return str(path)
+
+
+def test_labels(tmp_path):
+    zfs = ZFS(make_zfs(tmp_path / "pool.img"), "zfs")
+    labels = zfs.read_labels()
+    assert [label for label, _, _ in labels] == [0, 256 << 10, IMAGE_SIZE - (512 << 10), IMAGE_SIZE - (256 << 10)]
+    assert all(config["vdev_tree"]["ashift"] == 12 for _, config, _ in labels)
+    assert zfs.get_config()["name"] == "tank"
+
+
+def test_damaged_label(tmp_path):
+    zfs = ZFS(make_zfs(tmp_path / "pool.img", damaged_label=0), "zfs")
+    assert [config is None for _, config, _ in zfs.read_labels()] == [True, False, False, False]
+    assert zfs.get_config()["name"] == "tank"
+    assert VDEV_PHYS_OFF not in [off for off, _ in zfs.get_preserved_regions()]
+
+
+@pytest.mark.parametrize("ashift,slot", [(9, 1024), (12, 4096), (16, 8192)])
+def test_uberblock_slots(tmp_path, ashift, slot):
+    zfs = ZFS(make_zfs(tmp_path / "pool.img", ashift=ashift), "zfs")
+    assert zfs.get_uberblock_size() == slot
+    ring = VDEV_UBERBLOCK_RING_OFF
+    expected = [ring + n * slot for n in [5, 7, 8]]
+    assert zfs.calc_uberblock_locations()[:3] == expected
+    assert len(zfs.find_all_superblocks()) == 12
+
+
+def test_active_uberblock(tmp_path):
+    zfs = ZFS(make_zfs(tmp_path / "pool.img"), "zfs")
+    loc, ub = zfs.get_active_uberblock()
+    # highest txg, the newer timestamp wins the tie
+    assert loc == VDEV_UBERBLOCK_RING_OFF + 8 * 4096
+    assert (ub["txg"], ub["timestamp"], ub["version"], ub["guid_sum"]) == (7, 95, 5000, 0x1234)
+    assert ub["rootbp"]["birth"] == 7 and len(ub["rootbp"]["dvas"]) == 3
+    assert ub["mmp"] == {"delay": 1000, "write_interval": 5, "seq": 3, "fail_intervals": 10}
+
+
+def test_metadata_regions(tmp_path):
+    zfs = ZFS(make_zfs(tmp_path / "pool.img"), "zfs")
+    # the third DVA lives on another vdev
+    rootbp = [(VDEV_LABEL_START_SIZE + (ROOTBP_SECTOR << 9), 2048), (VDEV_LABEL_START_SIZE + ((ROOTBP_SECTOR + 8) << 9), 2048)]
+    assert zfs.calc_rootbp_locations() == rootbp
+    regions = zfs.get_metadata_regions()
+    assert regions[0][0] == VDEV_PHYS_OFF and regions[0][1] > 0
+    assert regions[-2:] == rootbp
+    assert len([r for r in regions if r[1] == UB_USED_SIZE]) == 12
+
+
+def test_uberblock_scan_fallback(tmp_path):
+    # an image too small for the four labels, the magic scan finds the uberblocks
+    path = tmp_path / "small.img"
+    img = bytearray(512 << 10)
+    img[0x1234 : 0x1234 + 8] = ZFS_MAGIC
+    path.write_bytes(bytes(img))
+    zfs = ZFS(str(path), "zfs")
+    assert zfs.calc_label_locations() == []
+    assert zfs.find_all_superblocks() == [0x1234]
+    assert zfs.get_active_uberblock() is None
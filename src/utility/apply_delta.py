@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Guest side counterpart of Fuzzer/delta.py. Only depends on the python3 standard library.
+# python3 apply_delta.py <cached_seed> <delta_file|-> <output_image>
+
+import os
+import shutil
+import struct
+import sys
+
+DELTA_MAGIC = b"FSFZDLT1"
+DELTA_HEADER = struct.Struct("<8s32sQI")
+DELTA_PATCH = struct.Struct("<QI")
+
+
+def read_delta(src):
+    if src == "-":
+        return sys.stdin.buffer.read()
+    with open(src, "rb") as f:
+        return f.read()
+
+
+def apply_delta(seed, data, out):
+    magic, _, size, n_patches = DELTA_HEADER.unpack_from(data, 0)
+    if magic != DELTA_MAGIC:
+        print("ERROR: bad delta magic")
+        return 1
+    shutil.copyfile(seed, out)
+    with open(out, "r+b") as f:
+        f.truncate(size)
+        pos = DELTA_HEADER.size
+        for _ in range(n_patches):
+            offset, length = DELTA_PATCH.unpack_from(data, pos)
+            pos += DELTA_PATCH.size + length  # skip the old bytes
+            f.seek(offset)
+            f.write(data[pos : pos + length])
+            pos += length
+    return 0
+
+
+def main():
+    seed, src, out = sys.argv[1], sys.argv[2], sys.argv[3]
+    data = read_delta(src)
+    if not os.path.isfile(seed):
+        print("MISSING_SEED")
+        return 2
+    os.utime(seed, None)  # keeps the host side LRU eviction of cached seeds honest
+    ret = apply_delta(seed, data, out)
+    if not ret:
+        print("OK")
+    return ret
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# python3 blob_store.py <blob dir> stats
+# python3 blob_store.py <blob dir> gc  (only while no fuzzer is running)
+# python3 blob_store.py <blob dir> release <crash_dir> [<crash_dir> ...]
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+BLOB_STORE_NAME = "blobs"
+BLOB_INDEX_NAME = "index.sqlite"
+MANIFEST_NAME = "artifacts.json"
+DELTA_SUFFIX = ".delta"  # a delta artifact is named after the mutated image it rebuilds
+CODECS = ["zstd", "lz4", "zip"]
+FILE_SUFFIX = {"zstd": ".zst", "lz4": ".lz4", "zip": ".zip"}
+CHUNK_SIZE = 1 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 1,
+    created REAL NOT NULL
+);
+"""
+
+
+def get_codec(codec):
+    # zstd and lz4 are optional, zip always works
+    if codec == "zstd" and zstandard is None or codec == "lz4" and lz4 is None or codec not in CODECS:
+        return "zip"
+    return codec
+
+
+def get_file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def compress_file(src, dst, codec, threads=1):
+    if codec == "zip":
+        with zipfile.ZipFile(dst, "w", compression=zipfile.ZIP_DEFLATED) as myzip:
+            myzip.write(src, arcname="blob")
+        return dst
+    if codec == "zstd":
+        # threads=-1 lets zstd use every logical CPU
+        writer = zstandard.ZstdCompressor(level=3, threads=threads).stream_writer(open(dst, "wb"), closefd=True)
+    else:
+        writer = lz4.frame.open(dst, "wb")
+    with open(src, "rb") as f, writer:
+        shutil.copyfileobj(f, writer, CHUNK_SIZE)
+    return dst
+
+
+def decompress_file(src, dst):
+    if src.endswith(FILE_SUFFIX["zip"]):
+        with zipfile.ZipFile(src, "r") as myzip, myzip.open("blob") as reader, open(dst, "wb") as f:
+            shutil.copyfileobj(reader, f, CHUNK_SIZE)
+        return dst
+    if src.endswith(FILE_SUFFIX["zstd"]):
+        reader = zstandard.ZstdDecompressor().stream_reader(open(src, "rb"), closefd=True)
+    else:
+        reader = lz4.frame.open(src, "rb")
+    with reader, open(dst, "wb") as f:
+        shutil.copyfileobj(reader, f, CHUNK_SIZE)
+    return dst
+
+
+class BlobStore:
+    """
+    Content-addressed store for crash artifacts: seeds, mutation deltas, syscall logs and vmcores.
+    Every file is stored once, compressed, under <root>/<digest[:2]>/<digest><suffix> with the
+    sha256 of its raw content as digest. Crash directories only reference blobs (artifacts.json),
+    an SQLite index counts the references and a blob is deleted with its last reference.
+    Several fuzzer processes and the packer processes share one store, see CrashStore for the locking.
+    """
+
+    def __init__(self, root, codec="zstd", threads=1):
+        self.root = root
+        self.codec = get_codec(codec)
+        self.threads = threads
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(root, BLOB_INDEX_NAME), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def get_blob_path(self, digest, codec):
+        return os.path.join(self.root, digest[:2], digest + FILE_SUFFIX[codec])
+
+    def _transaction(self, fn, *args):
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(cur, *args)
+                cur.execute("COMMIT")
+            except (sqlite3.Error, OSError):
+                cur.execute("ROLLBACK")
+                raise
+            return result
+
+    @staticmethod
+    def _add_ref(cur, digest):
+        return cur.execute("UPDATE blobs SET refs = refs + 1 WHERE digest = ?", (digest,)).rowcount > 0
+
+    def put(self, path, digest=None):
+        # Returns the digest of path, the file itself is left untouched
+        digest = digest or get_file_digest(path)
+        if self._transaction(self._add_ref, digest):
+            return digest
+        # compressing happens outside of the transaction, a concurrent put of the same content
+        # writes an identical file and only bumps the refcount
+        blob = self.get_blob_path(digest, self.codec)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        tmp = "{}.{}.{}.tmp".format(blob, os.getpid(), threading.get_ident())
+        compress_file(path, tmp, self.codec, self.threads)
+        self._transaction(self._insert, digest, blob, tmp, os.path.getsize(path))
+        return digest
+
+    def _insert(self, cur, digest, blob, tmp, size):
+        if self._add_ref(cur, digest):
+            os.remove(tmp)
+            return
+        os.replace(tmp, blob)
+        cur.execute(
+            "INSERT INTO blobs (digest, codec, size, stored_size, created) VALUES (?, ?, ?, ?, ?)",
+            (digest, self.codec, size, os.path.getsize(blob), time.time()),
+        )
+
+    def add_ref(self, digest):
+        return self._transaction(self._add_ref, digest)
+
+    def release(self, digest):
+        return self._transaction(self._release, digest)
+
+    def _release(self, cur, digest):
+        row = cur.execute("SELECT codec, refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if not row:
+            return False
+        if row[1] > 1:
+            cur.execute("UPDATE blobs SET refs = refs - 1 WHERE digest = ?", (digest,))
+            return False
+        cur.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        if os.path.exists(self.get_blob_path(digest, row[0])):
+            os.remove(self.get_blob_path(digest, row[0]))
+        return True
+
+    def get(self, digest, save_to):
+        # Writes the raw content of a blob to save_to
+        with self.lock:
+            row = self.conn.execute("SELECT codec FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if not row:
+            raise KeyError("Unknown blob {}".format(digest))
+        return decompress_file(self.get_blob_path(digest, row[0]), save_to)
+
+    def gc(self):
+        # drops index rows without a file and files without an index row, e.g. left by a killed process
+        removed = 0
+        with self.lock:
+            known = {}
+            for digest, codec in self.conn.execute("SELECT digest, codec FROM blobs").fetchall():
+                if os.path.exists(self.get_blob_path(digest, codec)):
+                    known[self.get_blob_path(digest, codec)] = digest
+                else:
+                    self.conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    removed += 1
+        for directory in [d for d in os.scandir(self.root) if d.is_dir()]:
+            for f in os.scandir(directory.path):
+                if f.path not in known and (not f.name.endswith(".tmp") or time.time() - f.stat().st_mtime > 3600):
+                    os.remove(f.path)
+                    removed += 1
+        return removed
+
+    def stats(self):
+        # (#blobs, #references, bytes referenced by crash directories, bytes on disk)
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(refs), 0), COALESCE(SUM(size * refs), 0), COALESCE(SUM(stored_size), 0) FROM blobs"
+            ).fetchone()
+
+
+def write_manifest(crash_dir, artifacts):
+    # artifacts: {file name: {"blob": digest, "role": seed|image|delta|log|vmcore}}
+    tmp = os.path.join(crash_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(json.dumps(artifacts, indent=4, sort_keys=True))
+    os.replace(tmp, os.path.join(crash_dir, MANIFEST_NAME))
+
+
+def read_manifest(crash_dir):
+    path = os.path.join(crash_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def get_artifact_by_role(manifest, role):
+    for name, artifact in sorted(manifest.items()):
+        if artifact["role"] == role:
+            return name, artifact["blob"]
+    return None, None
+
+
+def release_crash(store, crash_dir):
+    # drops the references of a crash directory and the directory itself
+    for artifact in (read_manifest(crash_dir) or {}).values():
+        store.release(artifact["blob"])
+    shutil.rmtree(crash_dir)
+
+
+def main():
+    store = BlobStore(sys.argv[1])
+    if sys.argv[2] == "stats":
+        blobs, refs, referenced_size, stored_size = store.stats()
+        print(
+            "{} blobs, {} references, {:.1f}MB referenced, {:.1f}MB stored".format(
+                blobs, refs, referenced_size / float(1 << 20), stored_size / float(1 << 20)
+            )
+        )
+    elif sys.argv[2] == "gc":
+        print("Removed {} orphans".format(store.gc()))
+    elif sys.argv[2] == "release":
+        for crash_dir in sys.argv[3:]:
+            release_crash(store, crash_dir)
+    store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
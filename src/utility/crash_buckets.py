@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Crash bucketing on top of the sanitized traces of extract_core_features
+# python3 crash_buckets.py <core.txt> [<core.txt>]
+
+import hashlib
+import random
+import re
+import struct
+import sys
+
+TOP_N_FRAMES = 5  # frames below the panic machinery that make up a bucket
+NUM_PERM = 64  # MinHash signature length
+LSH_BANDS = 16  # NUM_PERM / LSH_BANDS rows per band
+SIMILARITY_THRESHOLD = 0.6  # estimated Jaccard similarity above which two buckets are clustered
+
+# frames every panic or syscall shares, they say nothing about the bug
+IGNORED_FRAMES = {
+    "db_trace_self_wrapper",
+    "db_trace_self",
+    "kdb_backtrace",
+    "kdb_enter",
+    "vpanic",
+    "panic",
+    "kassert_panic",
+    "doadump",
+    "kern_reboot",
+    "trap_fatal",
+    "trap_pfault",
+    "trap",
+    "calltrap",
+    "alltraps",
+    "dblfault_handler",
+    "amd64_syscall",
+    "ia32_syscall",
+    "fast_syscall_common",
+    "Xfast_syscall",
+    "Xint0x80_syscall",
+    "syscall",
+    # NetBSD/OpenBSD ddb and Linux oops machinery
+    "db_enter",
+    "db_panic",
+    "kern_assert",
+    "__assert",
+    "dump_stack",
+    "dump_stack_lvl",
+    "show_stack",
+    "die",
+    "oops_end",
+    "page_fault_oops",
+    "exc_page_fault",
+    "asm_exc_page_fault",
+    "do_syscall_64",
+    "entry_SYSCALL_64_after_hwframe",
+}
+
+FRAME_NAME = re.compile(r"^(?:#\d+\s+)?(?:0x[0-9a-fA-F]+\s+in\s+)?([A-Za-z_][\w.$]*)")
+MERSENNE_PRIME = (1 << 61) - 1
+# fixed coefficients so signatures stay comparable across runs and hosts
+_rnd = random.Random(0x5EED)
+PERMUTATIONS = [(_rnd.randrange(1, MERSENNE_PRIME), _rnd.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+SIGNATURE = struct.Struct("<{}Q".format(NUM_PERM))
+
+
+def get_frames(sanitized_stack_trace):
+    # function names only, offsets, addresses and arguments differ between otherwise equal traces
+    frames = []
+    for line in sanitized_stack_trace.split("\n"):
+        match = FRAME_NAME.match(line.strip())
+        if match and match.group(1) not in IGNORED_FRAMES:
+            frames.append(match.group(1))
+    return frames
+
+
+def get_bucket_hash(panic, frames, top_n=TOP_N_FRAMES):
+    return hashlib.sha256("|".join([str(panic)] + frames[:top_n]).encode()).hexdigest()
+
+
+def _shingles(frames):
+    # single frames and frame bigrams, so inlined or missing frames only shift part of the set
+    shingles = set(frames)
+    shingles.update("{}>{}".format(a, b) for a, b in zip(frames, frames[1:]))
+    return shingles
+
+
+def get_minhash(frames):
+    # None without frames: an empty set is not similar to anything, the crash only joins its exact bucket
+    if not frames:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in _shingles(frames)]
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+
+def estimate_similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / float(NUM_PERM)
+
+
+def get_lsh_keys(signature):
+    rows = NUM_PERM // LSH_BANDS
+    return [
+        "{}:{}".format(band, hashlib.sha1(SIGNATURE.pack(*signature)[band * rows * 8 : (band + 1) * rows * 8]).hexdigest())
+        for band in range(LSH_BANDS)
+    ]
+
+
+def pack_signature(signature):
+    return SIGNATURE.pack(*signature)
+
+
+def unpack_signature(blob):
+    return list(SIGNATURE.unpack(blob))
+
+
+def main():
+    import extract_core_features  # sibling script, only needed when run standalone
+
+    signatures = []
+    for core in sys.argv[1:]:
+        report = extract_core_features.parse_core_file(core)
+        frames = get_frames(report.sanitized_trace())
+        signatures.append(get_minhash(frames))
+        print("{}: {} {}".format(core, get_bucket_hash(report.panic, frames), frames[:TOP_N_FRAMES]))
+    if len(signatures) == 2 and None not in signatures:
+        print("Estimated similarity: {}".format(estimate_similarity(*signatures)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
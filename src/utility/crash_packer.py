@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# python3 crash_packer.py <crash_dir> [zstd|lz4|zip]
+
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import shutil
+import sys
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from utility import blob_store
+
+STAGING_DIR = "sample_files"  # raw crash files waiting for the background packer
+PENDING_NAME = "pending.json"  # staged artifacts, lets crash_packer.py finish the job after a kill
+
+
+def pack_crash(crash_dir, artifacts, blob_root, codec, threads=1):
+    """
+    Runs in a pool process. Moves the artifacts of a crash directory into the blob store
+    and replaces them by an artifacts.json manifest.
+    artifacts: list of (path relative to crash_dir, name, role, digest or None)
+    """
+    store = blob_store.BlobStore(blob_root, codec=codec, threads=threads)
+    manifest = blob_store.read_manifest(crash_dir) or {}
+    try:
+        for rel_path, name, role, digest in artifacts:
+            path = os.path.join(crash_dir, rel_path)
+            manifest[name] = {"blob": store.put(path, digest), "role": role}
+            # the manifest follows every put, so a killed packer never loses a reference
+            blob_store.write_manifest(crash_dir, manifest)
+            os.remove(path)
+    finally:
+        store.close()
+    shutil.rmtree(os.path.join(crash_dir, STAGING_DIR), ignore_errors=True)
+    return crash_dir
+
+
+def stage_files(files, crash_dir):
+    """
+    Links (or copies) the sample files into the crash directory right away,
+    the fuzzer overwrites the originals with the next test case.
+    files: list of (path, name, role, digest or None), returns the staged artifacts for pack_crash
+    """
+    staging = os.path.join(crash_dir, STAGING_DIR)
+    os.makedirs(staging, exist_ok=True)
+    artifacts = []
+    for path, name, role, digest in files:
+        if not path:
+            continue
+        dst = os.path.join(staging, name)
+        try:
+            os.link(path, dst)
+        except OSError:
+            shutil.copy2(path, dst)
+        artifacts.append((os.path.join(STAGING_DIR, name), name, role, digest))
+    with open(os.path.join(staging, PENDING_NAME), "w") as f:
+        f.write(json.dumps(artifacts))
+    return artifacts
+
+
+class CrashPacker:
+    """
+    Packs crash artifacts in a background process pool so the fuzzing VM is back in use as soon as
+    the core has been fetched. Sample files are staged synchronously (cheap hard links), hashing,
+    compressing and storing them in the content-addressed blob store happens later.
+    zstd (multi-threaded) and lz4 are much faster than deflate, zip stays the fallback when
+    neither module is installed.
+    """
+
+    def __init__(self, blob_root, codec="zstd", workers=2):
+        self.blob_root = blob_root
+        self.codec = blob_store.get_codec(codec)
+        if self.codec != codec:
+            logging.warning("Codec {} not available, falling back to {}".format(codec, self.codec))
+        self.workers = max(1, workers)
+        # every pool process gets its share of the cores for multi-threaded zstd
+        self.threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.pool = None
+        self.pending = set()
+
+    def _get_pool(self):
+        if not self.pool:
+            # spawn, the fuzzer process runs several threads which a fork would copy in an arbitrary state
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self.pool
+
+    def _on_done(self, future):
+        self.pending.discard(future)
+        if future.exception():
+            logging.error("Packing crash artifacts failed: {}".format(future.exception()))
+        else:
+            logging.debug("Packed {}".format(future.result()))
+
+    def pack(self, crash_dir, artifacts):
+        future = self._get_pool().submit(pack_crash, crash_dir, artifacts, self.blob_root, self.codec, self.threads)
+        self.pending.add(future)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def shutdown(self):
+        if self.pool:
+            if self.pending:
+                print("Waiting for {} crash directories to be packed...".format(len(self.pending)))
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+def is_packed(crash_dir):
+    return not os.path.isdir(os.path.join(crash_dir, STAGING_DIR))
+
+
+def main():
+    # packs a crash directory left behind unpacked, e.g. after the fuzzer was killed
+    crash_dir = sys.argv[1].rstrip("/")
+    codec = blob_store.get_codec(sys.argv[2] if len(sys.argv) > 2 else "zstd")
+    artifacts = []
+    if not is_packed(crash_dir):
+        with open(os.path.join(crash_dir, STAGING_DIR, PENDING_NAME), "r") as f:
+            artifacts = [tuple(x) for x in json.load(f) if os.path.exists(os.path.join(crash_dir, x[0]))]
+    artifacts += [(f, f, "vmcore", None) for f in os.listdir(crash_dir) if f.startswith("vmcore")]
+    blob_root = os.path.join(os.path.dirname(os.path.abspath(crash_dir)), blob_store.BLOB_STORE_NAME)
+    print(pack_crash(crash_dir, artifacts, blob_root, codec, -1))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
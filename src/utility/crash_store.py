@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# python3 crash_store.py <crashes.sqlite> import <legacy crash.db>
+# python3 crash_store.py <crashes.sqlite> panics [bucket_seconds]
+# python3 crash_store.py <crashes.sqlite> clusters
+# python3 crash_store.py <crashes.sqlite> verified
+
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from utility import crash_buckets
+
+CRASH_STORE_NAME = "crashes.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crashes (
+    id INTEGER PRIMARY KEY,
+    found_at REAL NOT NULL,
+    fuzzer TEXT,
+    vm TEXT,
+    fs_type TEXT,
+    fs_size TEXT,
+    engine TEXT,
+    seed TEXT,
+    panic TEXT,
+    trace_hash TEXT NOT NULL,
+    crash_dir TEXT,
+    runtime TEXT,
+    iteration INTEGER,
+    is_unique INTEGER NOT NULL DEFAULT 0,
+    verify_result INTEGER
+);
+CREATE INDEX IF NOT EXISTS crashes_trace_hash ON crashes (trace_hash);
+CREATE INDEX IF NOT EXISTS crashes_panic_found_at ON crashes (panic, found_at);
+CREATE TABLE IF NOT EXISTS traces (
+    trace_hash TEXT PRIMARY KEY,
+    first_crash INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket TEXT PRIMARY KEY,
+    cluster TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    panic TEXT
+);
+CREATE TABLE IF NOT EXISTS lsh (
+    band_key TEXT NOT NULL,
+    bucket TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lsh_band_key ON lsh (band_key);
+CREATE TABLE IF NOT EXISTS clusters (
+    cluster TEXT PRIMARY KEY,
+    first_crash INTEGER NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 1
+);
+"""
+
+# columns added after the first release of the schema
+MIGRATIONS = [
+    ("crashes", "bucket", "TEXT"),
+    ("crashes", "cluster", "TEXT"),
+    ("crashes", "target_os", "TEXT"),
+    ("crashes", "verify_details", "TEXT"),
+    ("buckets", "panic", "TEXT"),
+]
+
+
+class CrashStore:
+    """
+    SQLite backed crash database.
+    Every crash is a row with typed columns, the traces table counts exact sanitized backtrace hashes.
+    Dedup happens on clusters: a crash with a bucket (panic + top frames, see crash_buckets) joins the
+    cluster of an identical bucket, or of a similar one with the same panic found through the MinHash LSH index.
+    Only the first crash of a cluster is unique and gets verified.
+    WAL mode and IMMEDIATE transactions keep several fuzzer processes
+    (and the threads of a worker pool sharing one instance) from stepping on each other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        for table, column, column_type in MIGRATIONS:
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info({})".format(table))]
+            if column not in columns:
+                self.conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, column_type))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS crashes_cluster ON crashes (cluster)")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM crashes").fetchone()[0]
+
+    def is_known(self, trace_hash):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM traces WHERE trace_hash = ?", (trace_hash,)).fetchone() is not None
+
+    def record_crash(
+        self,
+        trace_hash,
+        panic=None,
+        fuzzer=None,
+        vm=None,
+        fs_type=None,
+        fs_size=None,
+        engine=None,
+        seed=None,
+        crash_dir=None,
+        runtime=None,
+        iteration=None,
+        found_at=None,
+        bucket=None,
+        signature=None,
+        target_os=None,
+    ):
+        # Returns True if the crash starts a new cluster
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cluster = self._assign_cluster(cur, bucket, signature, panic) if bucket else trace_hash
+                is_unique = cur.execute("SELECT 1 FROM clusters WHERE cluster = ?", (cluster,)).fetchone() is None
+                cur.execute(
+                    "INSERT INTO crashes (found_at, fuzzer, vm, fs_type, fs_size, engine, seed, panic, trace_hash,"
+                    " crash_dir, runtime, iteration, is_unique, bucket, cluster, target_os)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        found_at or time.time(),
+                        fuzzer,
+                        vm,
+                        fs_type,
+                        fs_size,
+                        engine,
+                        None if seed is None else str(seed),
+                        panic,
+                        trace_hash,
+                        crash_dir,
+                        None if runtime is None else str(runtime),
+                        iteration,
+                        int(is_unique),
+                        bucket,
+                        cluster,
+                        target_os,
+                    ),
+                )
+                crash_id = cur.lastrowid
+                for table, key, value in [("traces", "trace_hash", trace_hash), ("clusters", "cluster", cluster)]:
+                    cur.execute(
+                        "INSERT INTO {table} ({key}, first_crash) VALUES (?, ?)"
+                        " ON CONFLICT({key}) DO UPDATE SET hits = hits + 1".format(table=table, key=key),
+                        (value, crash_id),
+                    )
+                cur.execute("COMMIT")
+            except sqlite3.Error:
+                cur.execute("ROLLBACK")
+                raise
+            return is_unique
+
+    def _assign_cluster(self, cur, bucket, signature, panic):
+        row = cur.execute("SELECT cluster FROM buckets WHERE bucket = ?", (bucket,)).fetchone()
+        if row:
+            return row[0]
+        cluster = bucket
+        if signature:
+            lsh_keys = crash_buckets.get_lsh_keys(signature)
+            candidates = cur.execute(
+                "SELECT DISTINCT buckets.cluster, buckets.signature FROM lsh JOIN buckets ON lsh.bucket = buckets.bucket"
+                " WHERE lsh.band_key IN ({}) AND buckets.panic IS ?".format(", ".join("?" * len(lsh_keys))),
+                lsh_keys + [panic],
+            ).fetchall()
+            best = 0
+            for candidate_cluster, blob in candidates:
+                similarity = crash_buckets.estimate_similarity(signature, crash_buckets.unpack_signature(blob))
+                if similarity >= crash_buckets.SIMILARITY_THRESHOLD and similarity > best:
+                    cluster, best = candidate_cluster, similarity
+            cur.executemany("INSERT INTO lsh (band_key, bucket) VALUES (?, ?)", [(key, bucket) for key in lsh_keys])
+            cur.execute(
+                "INSERT INTO buckets (bucket, cluster, signature, panic) VALUES (?, ?, ?, ?)",
+                (bucket, cluster, crash_buckets.pack_signature(signature), panic),
+            )
+        else:
+            cur.execute(
+                "INSERT INTO buckets (bucket, cluster, signature, panic) VALUES (?, ?, ?, ?)", (bucket, cluster, b"", panic)
+            )
+        return cluster
+
+    def clusters(self):
+        # (cluster, panic of its first crash, #crashes, #distinct traces) ordered by size
+        with self.lock:
+            return self.conn.execute(
+                "SELECT crashes.cluster, first.panic, COUNT(*), COUNT(DISTINCT crashes.trace_hash) FROM crashes"
+                " JOIN clusters ON crashes.cluster = clusters.cluster JOIN crashes AS first ON first.id = clusters.first_crash"
+                " GROUP BY crashes.cluster ORDER BY COUNT(*) DESC"
+            ).fetchall()
+
+    def unverified(self):
+        # (crash_dir, trace_hash, target_os) of every unique crash that still awaits verification
+        with self.lock:
+            return self.conn.execute(
+                "SELECT crash_dir, trace_hash, target_os FROM crashes WHERE is_unique = 1 AND verify_result IS NULL ORDER BY id"
+            ).fetchall()
+
+    def mark_verified(self, crash_dir, result, details=None):
+        # details: JSON document of the verification run
+        with self.lock:
+            self.conn.execute(
+                "UPDATE crashes SET verify_result = ?, verify_details = ? WHERE crash_dir = ?", (result, details, crash_dir)
+            )
+
+    def verification_results(self):
+        # (crash_dir, panic, verify_result, verify_details) of every verified crash
+        with self.lock:
+            return self.conn.execute(
+                "SELECT crash_dir, panic, verify_result, verify_details FROM crashes WHERE verify_result IS NOT NULL ORDER BY id"
+            ).fetchall()
+
+    def crashes_per_panic(self, bucket_seconds=3600):
+        # (panic, bucket start, #crashes, #unique crashes) ordered by time.
+        # Not aliased as bucket, GROUP BY would pick the bucket column of the crashes table
+        with self.lock:
+            return self.conn.execute(
+                "SELECT panic, CAST(found_at / ? AS INTEGER) * ? AS period, COUNT(*), SUM(is_unique) FROM crashes"
+                " GROUP BY panic, period ORDER BY period, panic",
+                (bucket_seconds, bucket_seconds),
+            ).fetchall()
+
+    def import_legacy(self, legacy_db):
+        # name; vm; fs; size; engine; panic; sha256; crash_dir; runtime; iteration
+        imported = 0
+        with open(legacy_db, "r") as f:
+            for line in f:
+                fields = [x.strip() for x in line.split("; ")]
+                if len(fields) < 10 or self.is_known(fields[6]):
+                    continue
+                self.record_crash(
+                    trace_hash=fields[6],
+                    panic=fields[5],
+                    fuzzer=fields[0],
+                    vm=fields[1],
+                    fs_type=fields[2],
+                    fs_size=fields[3],
+                    engine=fields[4],
+                    crash_dir=fields[7],
+                    runtime=fields[8],
+                    iteration=int(fields[9]) if fields[9].isdigit() else None,
+                    found_at=os.path.getmtime(fields[7]) if os.path.exists(fields[7]) else os.path.getmtime(legacy_db),
+                )
+                imported += 1
+        return imported
+
+
+def open_crash_store(crash_dump_dir):
+    # Picks up a legacy text crash.db from the same directory on first use
+    store = CrashStore(os.path.join(crash_dump_dir, CRASH_STORE_NAME))
+    legacy_db = os.path.join(crash_dump_dir, "crash.db")
+    if not len(store) and os.path.isfile(legacy_db):
+        store.import_legacy(legacy_db)
+    return store
+
+
+def main():
+    store = CrashStore(sys.argv[1])
+    if sys.argv[2] == "import":
+        print("Imported {} crashes".format(store.import_legacy(sys.argv[3])))
+    elif sys.argv[2] == "clusters":
+        for cluster, panic, crashes, traces in store.clusters():
+            print("{}\t{}\t{}\t{}".format(cluster[:16], panic, crashes, traces))
+    elif sys.argv[2] == "verified":
+        for crash_dir, panic, result, details in store.verification_results():
+            reason = json.loads(details)["reason"] if details else ""
+            print("{}\t{}\t{}\t{}".format(os.path.basename(crash_dir), panic, result, reason))
+    elif sys.argv[2] == "panics":
+        bucket_seconds = int(sys.argv[3]) if len(sys.argv) > 3 else 3600
+        for panic, bucket, crashes, unique in store.crashes_per_panic(bucket_seconds):
+            print("{}\t{}\t{}\t{}".format(time.strftime("%Y-%m-%d %H:%M", time.localtime(bucket)), panic, crashes, unique))
+    store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,36 +1,137 @@
 #!/usr/bin/env python3
+# python3 extract_core_features.py <core.txt> [frames]
 
+import collections
 import hashlib
 import re
 import sys
 
+# panic line markers by precedence, the panic message follows the marker.
+# The BSD "panic:" wins, a FreeBSD "Fatal trap 9: general protection fault" line must not shadow it.
+PANIC_MARKERS = ["panic:", "Kernel panic - not syncing:", "BUG:", "kernel BUG at", "general protection fault"]
+# markers that only count at the start of a line, after the dmesg timestamp and caller id, "BUG:" is part of "DEBUG:"
+LINE_START_MARKERS = {"BUG:": re.compile(r"^\s*(?:\[[^\]]*\]\s*)*BUG:")}
+MAX_TRACE_LINES = 512
 
-def get_panic_name(data):
-    return (
-        str(data)
-        .split("panic:")[1]
-        .split(":")[0]
-        .split("(")[0]
-        .split("bp")[0]
-        .split("fip")[0]
-        .split("\\")[0]
-        .split(", addr:")[0]
-        .strip()
-        .replace(" ", "_")
-        .split("_/")[0]
-    )
+# (start marker, end markers) of the backtrace per flavor, only the first backtrace of a core is used
+TRACE_MARKERS = collections.OrderedDict(
+    [
+        ("freebsd", ("KDB: stack backtrace:", ["--- syscall", "Uptime"])),
+        ("netbsd", ("Begin traceback", ["End traceback"])),
+        ("openbsd", ("> trace", ["end trace frame", "ddb{"])),
+        ("linux", ("Call Trace:", ["</TASK>", "---[ end trace", "Code:"])),
+    ]
+)
 
+FRAME_PATTERNS = [
+    # FreeBSD: vpanic() at vpanic+0x1a3/frame 0xfffffe001b81d2e0
+    # NetBSD/OpenBSD: ffs_read(d3ab0c28,0,0) at netbsd:ffs_read+0x1a4
+    re.compile(r"^(?P<function>[\w.$]+)\(.*?\) at (?:\w+:)?[\w.$]+\+(?P<offset>0x[0-9a-fA-F]+)"),
+    # FreeBSD >= 13: #0 0xffffffff80bf0cb5 at kdb_backtrace+0x65
+    re.compile(r"^#\d+\s+0x[0-9a-fA-F]+\s+at\s+(?P<function>[\w.$]+)\+(?P<offset>0x[0-9a-fA-F]+)"),
+    # Linux: ext4_fill_super+0x1234/0x5678 [ext4], "? " marks unreliable frames
+    re.compile(r"^(?P<unreliable>\? )?(?P<function>[\w.$]+)\+(?P<offset>0x[0-9a-fA-F]+)/0x[0-9a-fA-F]+"),
+]
 
-def get_core_details(data):
-    full_strace = (
-        str(data)
-        .split("KDB: stack backtrace:")[1]
-        .split("--- syscall")[0]
-        .split("Uptime")[0]
-        .replace("\\", "\n")
-        .replace("\nn", "\n")
-        .strip()
-    )
+# kgdb backtrace, the source location may be wrapped onto the next line
+GDB_FRAME = re.compile(r"^(?:\(kgdb\) )?#\d+\s+(?:0x[0-9a-fA-F]+ in )?(?P<function>[\w.$]+) \(")
+GDB_LOCATION = re.compile(r"\sat (?P<location>\S+:\d+)\s*$")
+DMESG_TIMESTAMP = re.compile(r"^\[\s*\d+\.\d+\]\s*")
+
+Frame = collections.namedtuple("Frame", ["function", "offset", "location"])
+
+
+class CoreReport:
+    """
+    Everything the fuzzer and the verifier need from a core.txt, gathered in a single pass.
+    panic: normalized panic name, frames: parsed backtrace (function, offset, file:line of kgdb),
+    trace_lines: the backtrace lines the sha256 of get_core_details has always been taken over.
+    """
+
+    def __init__(self):
+        self.panic = None
+        self.panic_rank = len(PANIC_MARKERS)
+        self.flavor = None
+        self.frames = []
+        self.trace_lines = []
+        self.trace_done = False
+        self.gdb_done = False
+        self.gdb_function = None
+        self.locations = {}
+
+    def sanitized_trace(self):
+        if self.flavor == "freebsd":
+            return _get_legacy_trace(self.trace_lines)
+        return "".join("{}+{}\n".format(frame.function, frame.offset) for frame in self.frames)
+
+    def feed(self, line):
+        # returns False once nothing of interest can follow anymore
+        if self.panic_rank:
+            self._match_panic(line)
+        if self.flavor is None:
+            self._match_trace_start(line)
+        elif not self.trace_done:
+            self._add_trace_line(line)
+        if self.flavor == "freebsd" and not self.gdb_done:
+            self._add_gdb_line(line)
+        return not (self.panic is not None and self.trace_done and (self.flavor != "freebsd" or self.gdb_done))
+
+    def _match_panic(self, line):
+        for rank, marker in enumerate(PANIC_MARKERS[: self.panic_rank]):
+            if marker in line and (marker not in LINE_START_MARKERS or LINE_START_MARKERS[marker].match(line)):
+                message = line.split(marker, 1)[1] if marker.endswith(":") else marker
+                self.panic, self.panic_rank = _normalize_panic(message), rank
+                return
+
+    def finish(self):
+        self.frames = [
+            Frame(frame.function, frame.offset, self.locations.get(frame.function)) for frame in self.frames
+        ]
+        return self
+
+    def _match_trace_start(self, line):
+        for flavor, (start, _) in TRACE_MARKERS.items():
+            if start in line:
+                self.flavor = flavor
+                self._add_trace_line(line.split(start, 1)[1])
+                return
+
+    def _add_trace_line(self, line):
+        for end in TRACE_MARKERS[self.flavor][1]:
+            if end in line:
+                line, self.trace_done = line.split(end)[0], True
+        self.trace_lines.append(line)
+        if len(self.trace_lines) >= MAX_TRACE_LINES:
+            self.trace_done = True
+        for pattern in FRAME_PATTERNS:
+            match = pattern.match(DMESG_TIMESTAMP.sub("", line.strip()).strip())
+            if match:
+                if not match.groupdict().get("unreliable"):
+                    self.frames.append(Frame(match.group("function"), match.group("offset"), None))
+                break
+
+    def _add_gdb_line(self, line):
+        match = GDB_FRAME.match(line)
+        if match:
+            self.gdb_function = match.group("function")
+        elif line.startswith("(kgdb)") and self.locations:
+            self.gdb_done = True
+            return
+        location = GDB_LOCATION.search(line)
+        if self.gdb_function and location:
+            self.locations.setdefault(self.gdb_function, location.group("location"))
+            self.gdb_function = None
+
+
+def _normalize_panic(message):
+    # same cuts the panic name has always been built with
+    for sep in [":", "(", "bp", "fip", "\t", "\\", ", addr:"]:
+        message = message.split(sep)[0]
+    return message.strip().replace(" ", "_").split("_/")[0]
+
+
+def _get_legacy_trace(trace_lines):
+    full_strace = "\n".join(trace_lines).strip()
     clean_strace = ""
     for line in full_strace.split("\n"):
         if re.match(r"---\strap\s", line):
@@ -42,16 +143,46 @@ def get_core_details(data):
     return clean_strace
 
 
+def parse_core_lines(lines):
+    report = CoreReport()
+    for line in lines:
+        if not report.feed(line.rstrip("\r\n")):
+            break
+    return report.finish()
+
+
+def parse_core_file(path):
+    # streams the file, memory stays bounded by the backtrace no matter how large the core.txt is
+    with open(path, "rb") as f:
+        return parse_core_lines(line.decode("utf-8", "backslashreplace") for line in f)
+
+
+def _split_lines(data):
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", "backslashreplace")
+    return data.split("\n")
+
+
+def get_panic_name(data):
+    return parse_core_lines(_split_lines(data)).panic or ""
+
+
+def get_core_details(data):
+    return parse_core_lines(_split_lines(data)).sanitized_trace()
+
+
 def get_sha256_sum(sanitized_stack_trace):
     return hashlib.sha256(sanitized_stack_trace.encode()).hexdigest()
 
 
 def main():
-    with open(sys.argv[1], "rb") as f:
-        data = f.read()
-
-    clean_stack_trace = get_core_details(data)
-    print(get_sha256_sum(clean_stack_trace))
+    report = parse_core_file(sys.argv[1])
+    if len(sys.argv) > 2 and sys.argv[2] == "frames":
+        print("{} ({})".format(report.panic, report.flavor))
+        for frame in report.frames:
+            print("{}+{}\t{}".format(frame.function, frame.offset, frame.location or ""))
+        return
+    print(get_sha256_sum(report.sanitized_trace()))
 
 
 if __name__ == "__main__":
@@ -2,17 +2,29 @@ import os
 import sys
 import pathlib
 
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent))
+from utility import blob_store
+
 
 def main():
     # python3 cleaner.py crash_dumps/
-    subfolders = sorted([f.path for f in os.scandir(sys.argv[1]) if f.is_dir()])
+    store = blob_store.BlobStore(os.path.join(sys.argv[1], blob_store.BLOB_STORE_NAME))
+    subfolders = sorted([f.path for f in os.scandir(sys.argv[1]) if f.is_dir() and f.name != blob_store.BLOB_STORE_NAME])
     for entry in subfolders:
+        manifest = blob_store.read_manifest(entry)
+        if manifest is not None:
+            # vmcores packed into the blob store only lose their reference
+            for name in [n for n, artifact in manifest.items() if artifact["role"] == "vmcore"]:
+                store.release(manifest.pop(name)["blob"])
+            blob_store.write_manifest(entry, manifest)
+            continue
         try:
             file_list_in_entry = [f for f in os.listdir(entry) if os.path.isfile(os.path.join(entry, f))]
             vmcore = list(filter(lambda element: "vmcore" in element, file_list_in_entry))[0]
             pathlib.Path(os.path.join(entry, vmcore)).unlink()
         except:
             continue
+    store.close()
 
 
 if __name__ == "__main__":